@@ -9,6 +9,7 @@ python -m pip install imgui[sdl2]
 python -m pip install pysdl2
 python -m pip install Pillow
 python -m pip install numpy
+python -m pip install pyserial
 
 copy "remoteroadrunner\SDL2.dll" "C:\windows\system32\SDL2.dll"
 
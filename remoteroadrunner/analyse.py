@@ -0,0 +1,255 @@
+'''
+Offline analysis of session archives (see archive.py).
+
+Each archive is analysed in a separate process, producing partial aggregates
+of the lap and section times of every track. The partial aggregates are merged
+into the result, so a season of sessions never has to be in memory at once.
+Only the chunks holding lap packets (of the requested track) are read.
+
+The robot records section sizes rather than times, so the time of a section
+is estimated as its share of the lap time by size. Sections are numbered
+after normalising the map (see track_library.normalise), like the sections
+of tracks in the library.
+
+Usage:
+  python analyse.py info ~/.remoteroadrunner/sessions
+  python analyse.py laps sessions/*.rra --workers 8
+  python analyse.py sections sessions --track "Practice Track"
+'''
+import argparse
+import concurrent.futures
+import glob
+import os
+
+import archive
+import codec
+import serial_interface
+import track_library
+
+LAP_KINDS = [ 'newtrack', 'sec', 'mapd', 'lap' ]
+
+UNKNOWN_MAP = -1 # Map version used until a full map is read
+
+class Best:
+  '''
+  The smallest value seen, and where it was seen
+  '''
+  def __init__(self):
+    self.value  = None
+    self.path   = None
+    self.time   = None # Host time the value was recorded at
+
+  def add(self, value, path, time):
+    if self.value == None or value < self.value:
+      self.value, self.path, self.time = value, path, time
+
+  def merge(self, other):
+    if other.value != None:
+      self.add(other.value, other.path, other.time)
+
+class Stats:
+  def __init__(self):
+    self.count = 0
+    self.total = 0.0
+    self.best  = Best()
+
+  def add(self, value, path, time):
+    self.count += 1
+    self.total += value
+    self.best.add(value, path, time)
+
+  def merge(self, other):
+    self.count += other.count
+    self.total += other.total
+    self.best.merge(other.best)
+
+  def mean(self):
+    return self.total / self.count if self.count > 0 else None
+
+class TrackStats:
+  '''
+  Aggregate lap and section times of one track
+  '''
+  def __init__(self):
+    self.laps     = Stats()
+    self.sections = [] # Stats of the estimated time of each normalised section
+    self.sessions = set()
+
+  def add_lap(self, path, time, lap_time, sections):
+    self.laps.add(lap_time, path, time)
+    self.sessions.add(path)
+    total = sum([ size for kind, size in sections ])
+    if total <= 0:
+      return
+    while len(self.sections) < len(sections):
+      self.sections.append(Stats())
+    for i, (kind, size) in enumerate(sections):
+      self.sections[i].add(lap_time * size / total, path, time)
+
+  def merge(self, other):
+    self.laps.merge(other.laps)
+    self.sessions |= other.sessions
+    while len(self.sections) < len(other.sections):
+      self.sections.append(Stats())
+    for mine, theirs in zip(self.sections, other.sections):
+      mine.merge(theirs)
+
+class Summary:
+  '''
+  Partial (or merged) aggregate of a set of archives
+  '''
+  def __init__(self):
+    self.tracks   = {} # Track hash -> TrackStats
+    self.archives = 0
+    self.records  = 0
+    self.errors   = [] # (path, message) of archives that could not be read
+
+  def track(self, hash):
+    if hash not in self.tracks:
+      self.tracks[hash] = TrackStats()
+    return self.tracks[hash]
+
+  def merge(self, other):
+    for hash, stats in other.tracks.items():
+      self.track(hash).merge(stats)
+    self.archives += other.archives
+    self.records  += other.records
+    self.errors   += other.errors
+    return self
+
+def apply_delta(sections, version, delta):
+  '''
+  Apply a map delta to the sections. Returns the new map version, or
+  UNKNOWN_MAP if the map is unknown until the next full map (e.g. a delta was
+  not recorded). Maps from devices that do not send versions have version None.
+  '''
+  if version == UNKNOWN_MAP or (version != None and delta.version != version + 1):
+    return UNKNOWN_MAP
+  try:
+    serial_interface.apply_map_delta(sections, delta)
+  except ValueError:
+    return UNKNOWN_MAP
+  return delta.version
+
+def analyse_archive(path, track = None):
+  '''
+  Get the Summary of one archive, optionally only for one track hash
+  '''
+  summary = Summary()
+  try:
+    with archive.ArchiveReader(path) as reader:
+      sections = []
+      version  = UNKNOWN_MAP # Version of the map in 'sections'
+      for record in reader.records(kinds = LAP_KINDS, track = track):
+        summary.records += 1
+        packet = codec.decode(record.packet.decode('utf-8'))
+        if packet.kind == 'newtrack':
+          sections = []
+          version  = packet.value
+        elif packet.kind == 'sec':
+          sections.append(packet.value)
+        elif packet.kind == 'mapd':
+          version = apply_delta(sections, version, packet.value)
+        elif packet.kind == 'lap' and record.track != '' and version != UNKNOWN_MAP:
+          normalised = track_library.normalise(sections)
+          summary.track(record.track).add_lap(path, record.time, packet.value, normalised)
+      summary.archives += 1
+  except (OSError, ValueError) as e:
+    summary.errors.append((path, str(e)))
+  return summary
+
+def find_archives(paths):
+  '''
+  Expand directories and glob patterns into a list of archive files
+  '''
+  found = []
+  for path in paths:
+    if os.path.isdir(path):
+      found += sorted(glob.glob(os.path.join(path, '*.rra')))
+    elif any([ c in path for c in '*?[' ]):
+      found += sorted(glob.glob(path))
+    else:
+      found.append(path)
+  return found
+
+def analyse(paths, track = None, workers = None):
+  '''
+  Analyse many archives across a process pool and merge the results
+  '''
+  summary = Summary()
+  if workers == 1 or len(paths) <= 1:
+    for path in paths:
+      summary.merge(analyse_archive(path, track))
+    return summary
+
+  with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+    for partial in pool.map(analyse_archive, paths, [ track ] * len(paths), chunksize = max(1, len(paths) // 64)):
+      summary.merge(partial)
+  return summary
+
+def resolve_track(library, name):
+  '''
+  Get the hash of a track from its name, hash or the start of its hash
+  '''
+  if name == None:
+    return None
+  for record in library.tracks.values():
+    if record.name == name or record.hash.startswith(name):
+      return record.hash
+  return name
+
+def track_name(library, hash):
+  record = library.get(hash) if library != None else None
+  return record.name if record != None else hash[:8]
+
+def format_best(best):
+  return '{0:.3f}s ({1})'.format(best.value, os.path.basename(best.path)) if best.value != None else '-'
+
+def print_laps(summary, library):
+  for hash, stats in sorted(summary.tracks.items(), key = lambda item: -item[1].laps.count):
+    print('{0:20} {1:6} laps in {2:4} sessions  mean {3:.3f}s  best {4}'.format(
+      track_name(library, hash), stats.laps.count, len(stats.sessions), stats.laps.mean(), format_best(stats.laps.best)))
+
+def print_sections(summary, library):
+  for hash, stats in summary.tracks.items():
+    print('{0} ({1} laps)'.format(track_name(library, hash), stats.laps.count))
+    for i, section in enumerate(stats.sections):
+      print('  section {0:2} {1:6} laps  mean {2:.3f}s  best {3}'.format(i + 1, section.count, section.mean(), format_best(section.best)))
+
+def print_info(paths):
+  for path in paths:
+    with archive.ArchiveReader(path) as reader:
+      size    = os.path.getsize(path)
+      records = sum([ chunk.count for chunk in reader.chunks ])
+      print('{0}: {1} chunks, {2} records, {3:.1f} KB{4}'.format(path, len(reader.chunks), records, size / 1000,
+        ' (index rebuilt, the archive was not closed)' if reader.recovered else ''))
+      print('  kinds:  ' + ', '.join([ '{0} {1}'.format(kind, count) for kind, count in sorted(reader.kinds().items()) ]))
+      print('  tracks: ' + ', '.join([ hash[:8] for hash in reader.tracks() ]))
+
+def main():
+  parser = argparse.ArgumentParser(description = 'Analyse session archives')
+  parser.add_argument('mode', choices = [ 'info', 'laps', 'sections' ])
+  parser.add_argument('paths', nargs = '+', help = 'Archives, directories of archives or glob patterns')
+  parser.add_argument('--track', default = None, help = 'Name or hash of the track to analyse')
+  parser.add_argument('--workers', type = int, default = None, help = 'Processes to use (default: one per CPU)')
+  parser.add_argument('--library', default = track_library.DEFAULT_PATH, help = 'Track library used to name tracks')
+  args = parser.parse_args()
+
+  paths = find_archives(args.paths)
+  if args.mode == 'info':
+    print_info(paths)
+    return
+
+  library = track_library.TrackLibrary(args.library) if os.path.isdir(args.library) else None
+  track   = resolve_track(library, args.track) if library != None else args.track
+  summary = analyse(paths, track, args.workers)
+  print('{0} archives, {1} records'.format(summary.archives, summary.records))
+  for path, message in summary.errors:
+    print('Failed to read {0}: {1}'.format(path, message))
+  if args.mode == 'laps':
+    print_laps(summary, library)
+  else:
+    print_sections(summary, library)
+
+if __name__ == '__main__':
+  main()
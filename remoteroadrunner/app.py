@@ -1,6 +1,8 @@
 
 # 3rd Party Libs
 import asyncio
+import inspect
+import json
 import time
 import os
 import OpenGL.GL as gl
@@ -19,21 +21,34 @@ from datetime import datetime
 
 # Local modules
 import bluetooth
+import serial_interface
+import serial_link
+import tcp_link
 import plat
 import gui
 from commands import RoadRunnerContext
-
-class Device:
-  def __init__(self, name, address, manufacturer):
-    self.name = name.strip()
-    self.address = address
-    self.manufacturer = manufacturer
-
-    if len(self.name) == 0:
-      self.name = "Unknown"
-
-  def detailed(self):
-    return "{0} [{1}][addr: {2}]".format(self.name, self.manufacturer, self.address)
+import sim.tuner
+import experiment
+import track_library
+import archive
+import speed_profile
+import metrics
+from profiler import Timer
+import watch
+import sensor_stream
+import discovery
+import console_log
+
+def parse_switch(text):
+  '''
+  Parse an on/off console argument (0/1, true/false or on/off)
+  '''
+  value = text.strip().lower()
+  if value in [ '1', 'true', 'on' ]:
+    return True
+  if value in [ '0', 'false', 'off' ]:
+    return False
+  raise ValueError("Expected 0/1, true/false or on/off, got '{0}'".format(text))
 
 class Command:
   def __init__(self, func, arg_types):
@@ -41,6 +56,10 @@ class Command:
     self.arg_types = arg_types
 
   def __call__(self, *args):
+    '''
+    Call the command function.
+    Coroutine functions, and functions returning a Message, return an awaitable result.
+    '''
     converted = [ self.arg_types[i](args[i]) for i in range(len(args)) ]
     return self.func(*converted)
 
@@ -48,7 +67,9 @@ class AppCommands:
   def __init__(self, app):
     self.app = app
     self.commands = {}
+    self.tasks = set() # Running console commands (see keep_task)
     self.add("list_commands", self.list_commands)
+    self.add("run", self.run_script, [ str, int ])
 
   def list_commands(self):
     return '\n'.join([ name for name in self.commands.keys() ])
@@ -70,6 +91,51 @@ class AppCommands:
         return "Exception Raised: {0}".format(str(e))
     return "Command '{0}' does not exist".format(cmd_name)
 
+  def keep_task(self, task):
+    '''
+    Hold a reference to a task until it is done. The event loop only keeps
+    weak references, so an unreferenced task can be collected mid-run.
+    '''
+    self.tasks.add(task)
+    task.add_done_callback(self.tasks.discard)
+    return task
+
+  async def call_async(self, command):
+    '''
+    Call a command and wait for its result if it is awaitable
+    '''
+    result = self.call(command)
+    if inspect.isawaitable(result):
+      try:
+        result = await result
+      except Exception as e:
+        return "Exception Raised: {0}".format(str(e))
+    return result
+
+  async def run_script(self, path, concurrency = 1):
+    '''
+    Run a file of console commands, one command per line.
+    Lines starting with '#' are ignored.
+
+    Up to 'concurrency' commands are run at the same time.
+    Each step is timed and its result logged when it completes.
+    '''
+    with open(path) as script:
+      lines = [ line.strip() for line in script ]
+    steps = [ line for line in lines if len(line) > 0 and not line.startswith('#') ]
+
+    limit = asyncio.Semaphore(max(1, concurrency))
+    async def run_step(index, command):
+      async with limit:
+        start  = time.perf_counter()
+        result = await self.call_async(command)
+        elapsed = (time.perf_counter() - start) * 1000
+        self.app.log("[{0}/{1}] {2} ({3:.1f} ms): {4}".format(index + 1, len(steps), command, elapsed, result))
+
+    start = time.perf_counter()
+    await asyncio.gather(*[ run_step(i, command) for i, command in enumerate(steps) ])
+    return "Ran {0} commands from '{1}' in {2:.1f} ms".format(len(steps), path, (time.perf_counter() - start) * 1000)
+
 class App:
   def __init__(self):
     imgui.create_context()
@@ -85,15 +151,26 @@ class App:
 
     self.is_scanning = False
     self.console_in  = []
-    self.console_log = []
+    self.console_log = console_log.ConsoleLog(limit = 20000) # Entries kept in the console, trimmed in blocks
     self.log_time    = True
 
     self.commands = AppCommands(self)
-    self.devices  = { 
-      # "64:69:4E:7B:5E:0B": Device("roadrunner", "64:69:4E:7B:5E:0B", "chief egb220 engineers")
-    }
+    self.devices  = discovery.DeviceTable()
+    self.devices.add_listener(self.__on_devices_changed)
+    self.device_filter = None # Only devices with names containing this are listed
 
     self.connected_device = ""
+    self.tuned = None # Best gains found by the 'tune' command
+    self.speed_profile = None # speed_profile.ProfileReport from the 'optimise_profile' command
+    self.variable_refresh_interval = 1.0 # Seconds between checks for stale variables
+    self.last_variable_refresh     = 0
+    self.context.track_library = track_library.TrackLibrary()
+    self.recorder = None # archive.SessionRecorder writing the session to disk
+    self.metrics_path          = None # Prometheus text file the metrics are written to
+    self.metrics_dump_interval = 10.0 # Seconds between writes of the metrics file
+    self.last_metrics_dump     = 0
+    self.frame_time = metrics.histogram('app_frame_seconds', 'Time to process, update and render a frame')
+    self.loop_lag   = metrics.histogram('app_loop_lag_seconds', 'How much longer than requested the event loop took to resume the app')
     self.register_console_commands()
 
   def __del__(self):
@@ -106,29 +183,45 @@ class App:
   def set_log_time(self, enabled):
     self.log_time = bool(enabled)
 
+  def set_variable_ttl(self, ttl):
+    self.context.variables.ttl = ttl
+
   def start_scanner(self):
-    asyncio.create_task(self.scanner.start())
+    self.commands.keep_task(asyncio.create_task(self.scanner.start()))
     self.is_scanning = True
     self.log("Started scanning...")
 
   def stop_scanner(self):
-    asyncio.create_task(self.scanner.stop())
+    self.commands.keep_task(asyncio.create_task(self.scanner.stop()))
     self.is_scanning = False
     self.log("Stopped scanning...")
 
-  def log(self, message, color=None):
+  def log(self, message, color=None, category=None, severity=None):
+    '''
+    Add a message to the console. 'category' and 'severity' are used to filter
+    the console, and are worked out from the message if they are not given.
+    '''
     entry = []
     if self.log_time:
-      date_text = "[{0}]".format(str(datetime.now().time()))
+      now = time.time()
+      date_text = "[{0}]".format(str(datetime.fromtimestamp(now).time()))
+
+      # Add the device time so host events can be lined up with device telemetry
+      clock = self.context.get_clock() if self.context != None else None
+      if clock != None and clock.is_synced():
+        date_text += "[dev {0:.3f}]".format(clock.to_device(now))
       entry.append({"col": imgui.get_style_color_vec_4(imgui.COLOR_PLOT_HISTOGRAM), "text": date_text})
 
+    stamp = len(entry)
     if isinstance(message, list) and isinstance(color, list):
       for msg, col in zip(message, color):
         entry.append({ "col": col, "text": msg })
     else:
       entry.append({ "col": color, "text": message })
 
-    self.console_log.append(entry)
+    # The time stamp is not searched
+    text = ' '.join([ str(part["text"]) for part in entry[stamp:] ])
+    self.console_log.append(entry, text, category, severity)
 
   async def _connect_async(self, address):
     self.log("Connecting to {0}".format(address))
@@ -139,30 +232,318 @@ class App:
     else:
       self.log("Failed to connect to {0}".format(address))
 
-  def connect(self, address):
+  def connect(self, address, name = None):
+    '''
+    Connect to a device by address, or with 'connect --name <name>'
+    to the first device seen with that name.
+    '''
+    if address == '--name':
+      return self.connect_name(name)
+    self.connecting = True
+    self.commands.keep_task(asyncio.create_task(self._connect_async(address)))
+
+  async def connect_name(self, name, timeout = 30.0):
+    '''
+    Scan for a device by name and connect as soon as it is seen
+    '''
+    if name == None:
+      return "Expected a device name"
+    was_scanning = self.is_scanning
+    if not was_scanning:
+      self.start_scanner()
+    self.log("Waiting for '{0}'".format(name))
+    device = await self.devices.wait_for(name = name, timeout = timeout)
+    # Scanning slows the connection down, so it is stopped once the robot is
+    # seen even if it was already running. A scan we started is also stopped on timeout.
+    if self.is_scanning and (device != None or not was_scanning):
+      self.stop_scanner()
+    if device == None:
+      return "'{0}' was not seen within {1:.0f} seconds".format(name, timeout)
+    self.connect(device.address)
+    return "Found " + device.detailed()
+
+  async def _connect_serial_async(self, port, baudrate):
+    self.log("Opening serial port {0} at {1} baud".format(port, baudrate))
+    await self.context.connect_serial(port, baudrate)
+    if not self.context.bt.connect_failed():
+      self.connected_device = port
+      self.log("Connected to {0}".format(port))
+    else:
+      self.log("Failed to open {0}".format(port))
+
+  def connect_serial(self, port, baudrate = serial_link.DEFAULT_BAUDRATE):
+    self.connecting = True
+    self.commands.keep_task(asyncio.create_task(self._connect_serial_async(port, baudrate)))
+
+  async def _connect_gateway_async(self, host, port):
+    address = "{0}:{1}".format(host, port)
+    self.log("Connecting to gateway {0}".format(address))
+    await self.context.connect_gateway(host, port)
+    if not self.context.bt.connect_failed():
+      self.connected_device = address
+      self.log("Connected to gateway {0}".format(address))
+    else:
+      self.log("Failed to connect to gateway {0}".format(address))
+
+  def connect_gateway(self, host, port = tcp_link.DEFAULT_PORT):
+    self.connecting = True
+    self.commands.keep_task(asyncio.create_task(self._connect_gateway_async(host, port)))
+
+  async def _connect_sim_async(self, time_scale):
+    self.log("Connecting to simulated robot")
+    await self.context.connect_sim(time_scale = time_scale)
+    self.connected_device = "Simulator"
+    self.log("Connected to simulated robot")
+
+  def connect_sim(self, time_scale = 1.0):
     self.connecting = True
-    asyncio.create_task(self._connect_async(address))
+    self.commands.keep_task(asyncio.create_task(self._connect_sim_async(time_scale)))
 
   def call_command(self, name):
-    self.context.call_command(name)
-  
+    return self.context.call_command(name)
+
   def refresh_commands(self):
-    self.context.sync_command_list()
+    return self.context.sync_command_list()
 
   def refresh_variables(self):
-    self.context.sync_variable_list()
+    return self.context.sync_variable_list()
+
+  def save_track(self, path):
+    '''
+    Save the current track details as JSON (used by the sim tuner)
+    '''
+    with open(path, 'w') as track_file:
+      json.dump(self.context.get_track_details(), track_file)
+    return "Saved {0} sections to '{1}'".format(len(self.context.get_track_details()), path)
+
+  def list_tracks(self):
+    '''
+    List the tracks in the track library
+    '''
+    library = self.context.track_library
+    records = sorted(library.tracks.values(), key = lambda record: record.created)
+    lines   = [ '{0} {1}'.format(record.hash[:8], record.summary()) for record in records ]
+    return '\n'.join([ "{0} tracks in '{1}'".format(len(library), library.path) ] + lines)
+
+  def name_track(self, name):
+    '''
+    Name the track being driven
+    '''
+    if self.context.current_track == None:
+      return "The current track has not been recognised"
+    self.context.track_library.rename(self.context.current_track, name)
+    return "Named track " + self.context.current_track.summary()
+
+  def record(self, path = None, compression = 'zlib'):
+    '''
+    Record the packets pushed by the device to a session archive
+    '''
+    self.stop_recording()
+    if path == None:
+      os.makedirs(archive.DEFAULT_PATH, exist_ok = True)
+      path = os.path.join(archive.DEFAULT_PATH, datetime.now().strftime('%Y%m%d-%H%M%S') + '.rra')
+    self.recorder = archive.SessionRecorder(self.context, path, compression)
+    return "Recording to '{0}'".format(path)
+
+  def stop_recording(self):
+    if self.recorder == None:
+      return "Not recording"
+    self.recorder.close()
+    result = "Recorded {0} packets to '{1}'".format(self.recorder.packets, self.recorder.path)
+    self.recorder = None
+    return result
+
+  async def tune(self, mode = 'descent', samples = 10):
+    '''
+    Tune the PID gains in the simulator using the current track details
+    '''
+    sections = [ list(section) for section in self.context.get_track_details() ]
+    if len(sections) == 0:
+      return "No track details to tune on"
+
+    start = None
+    if mode == 'descent':
+      variables = self.context.get_variable_snapshot()
+      for name in sim.tuner.GAIN_VARIABLES:
+        entry = variables.get(name)
+        if entry == None or entry.value == None:
+          return "Gain {0} is not loaded yet".format(name)
+      start = [ variables.get(name).value for name in sim.tuner.GAIN_VARIABLES ]
+
+    def run():
+      with sim.tuner.Tuner(sections, cache = sim.tuner.EvaluationCache()) as tuner:
+        if mode == 'grid':
+          return sim.tuner.best(tuner.grid(samples = samples))[0]
+        elif mode == 'random':
+          return sim.tuner.best(tuner.random(samples = samples))[0]
+        return tuner.coordinate_descent(start)[-1]
+
+    self.tuned = await asyncio.get_event_loop().run_in_executor(None, run)
+    return "Best: {0}".format(self.tuned)
+
+  async def push_tuned(self):
+    '''
+    Send the gains found by 'tune' to the robot
+    '''
+    if self.tuned == None:
+      return "Nothing has been tuned"
+    messages = sim.tuner.push_gains(self.context, self.tuned)
+    responses = await asyncio.gather(*messages)
+    return '\n'.join(responses)
+
+  def optimise_profile(self, deceleration = speed_profile.DEFAULT_DECELERATION):
+    '''
+    Compute speed targets for each section of the current track details.
+    The straight and corner speeds are the robot's srtSpd and crnSpd.
+    '''
+    sections = self.context.get_track_details()
+    if len(sections) == 0:
+      return "No track details to optimise"
+
+    straight = self.context.get_var('srtSpd')
+    corner   = self.context.get_var('crnSpd')
+    if straight == None or corner == None:
+      return "The robot's speeds are not known yet"
+
+    try:
+      targets = speed_profile.optimise(sections, straight, corner, deceleration)
+    except ValueError as e:
+      return str(e)
+    self.speed_profile = speed_profile.ProfileReport(targets, sections, straight, corner, self.context.current_track)
+    return self.speed_profile.summary()
+
+  async def upload_profile(self):
+    '''
+    Send the profile found by 'optimise_profile' to the robot and follow it
+    '''
+    if self.speed_profile == None:
+      return "No profile has been optimised"
+    message = self.context.upload_track_profile(self.speed_profile.targets)
+    if message == None:
+      return None
+    response = await message
+    if serial_interface.parse_response_map(response) != len(self.speed_profile.targets):
+      return "Upload failed: " + response
+    self.context.set_var('prof', True, True)
+    return "Uploaded {0} sections, following the profile".format(len(self.speed_profile.targets))
+
+  def follow_profile(self, enabled):
+    '''
+    Follow the uploaded speed profile, or react to the track
+    '''
+    return self.context.set_var('prof', enabled.lower() not in [ '0', 'false' ], True)
+
+  async def run_experiment(self, path, results_path):
+    '''
+    Run the experiment described in a JSON file and write the results as CSV
+    '''
+    exp = experiment.load_experiment(self.context, path)
+    exp.on_progress = self.log
+    self.log("Running {0} trials of {1} laps".format(len(exp.order), exp.laps))
+    try:
+      await exp.run()
+    finally:
+      exp.write_csv(results_path)
+    return "Saved {0} laps to '{1}'\n{2}".format(len(exp.results), results_path, exp.summary())
+
+  def watch_variable(self, name, period = watch.DEFAULT_PERIOD):
+    '''
+    Plot the value of a variable, pushed by the device every 'period' milliseconds
+    '''
+    self.gui.watch.visible = True
+    return self.context.watch_var(name, period)
+
+  def unwatch_variable(self, name):
+    return self.context.unwatch_var(name)
+
+  def toggle_watches(self):
+    self.gui.watch.visible = not self.gui.watch.visible
+
+  def stream_sensors(self, link, period = 10):
+    '''
+    Start streaming the sensor array over a link ('off', 'bt' or 'wired')
+    '''
+    if isinstance(link, str):
+      links = { 'off': sensor_stream.STREAM_OFF, 'bt': sensor_stream.STREAM_BLUETOOTH, 'wired': sensor_stream.STREAM_WIRED }
+      if link not in links:
+        return "Unknown link '{0}'. Expected one of {1}".format(link, list(links.keys()))
+      link = links[link]
+    if link != sensor_stream.STREAM_OFF:
+      self.gui.sensors.visible = True
+    return self.context.stream_sensors(link, period)
+
+  def toggle_sensors(self):
+    self.gui.sensors.visible = not self.gui.sensors.visible
+
+  def enable_metrics(self, enabled):
+    metrics.REGISTRY.enabled = enabled
+    if metrics.REGISTRY.enabled:
+      self.gui.metrics.visible = True
+
+  def toggle_profiler(self):
+    self.gui.profiler.visible = not self.gui.profiler.visible
+
+  def toggle_metrics(self):
+    self.gui.metrics.visible = not self.gui.metrics.visible
+
+  def dump_metrics(self, path, interval = 10.0):
+    '''
+    Periodically write the metrics to 'path' in the Prometheus text format.
+    Metrics are enabled if they are not already.
+    '''
+    self.metrics_path          = path
+    self.metrics_dump_interval = interval
+    self.last_metrics_dump     = 0
+    metrics.REGISTRY.enabled   = True
+    return "Writing metrics to '{0}' every {1:.1f} seconds".format(path, interval)
+
+  async def get_variable(self, name):
+    '''
+    Fetch a variable from the device and return the value
+    '''
+    message = self.context.sync_var(name)
+    if message == None:
+      return None
+    await message
+    return self.context.get_var(name)
+
+  def set_variable(self, name, value):
+    '''
+    Set a variable on the device.
+    The value is converted to the type of the variable.
+    '''
+    var_type = self.context.get_var_type(name)
+    if var_type is bool:
+      value = value.lower() not in [ '0', 'false' ]
+    else:
+      value = var_type(value)
+    return self.context.set_var(name, value, True)
 
   def __on_device_found(self, device, adv_data):
-    man_name = "Unknown"
-    if len(device.name) == 0:
+    name = adv_data.local_name if getattr(adv_data, 'local_name', None) else device.name
+    if name == None or len(name) == 0:
       return # Ignore unnamed devices
+    self.devices.observe(name, device.address, getattr(adv_data, 'rssi', None))
 
-    new_device = Device(device.name, device.address, man_name)
-    if device.address not in self.devices:
-      self.log(["Found BT Device: ", new_device.detailed()], [imgui.Vec4(0.3, 0.8, 0.3, 1), None])
-    self.devices[device.address] = new_device
+  def __on_devices_changed(self, added, removed):
+    '''
+    Log the devices found since the last notification (see DeviceTable.update)
+    '''
+    added = [ device for device in added if device.matches(self.device_filter) ]
+    if len(added) == 1:
+      self.log(["Found BT Device: ", added[0].detailed()], [imgui.Vec4(0.3, 0.8, 0.3, 1), None])
+    elif len(added) > 1:
+      self.log(["Found {0} BT Devices: ".format(len(added)), ', '.join([ device.name for device in added ])], [imgui.Vec4(0.3, 0.8, 0.3, 1), None])
+
+  def set_device_filter(self, name = None):
+    '''
+    Only list devices with names containing 'name'
+    '''
+    self.device_filter = name
+    return "Listing {0} of {1} devices".format(len(self.devices.view(name)), len(self.devices))
 
   def update(self):
+    self.devices.update()
     self.gui.update()
 
     if self.connecting and self.context.is_connected():
@@ -172,37 +553,90 @@ class App:
 
     self.context.handle_incoming()
 
+    # Re-fetch expired variables in the background
+    now = time.time()
+    if now - self.last_variable_refresh > self.variable_refresh_interval:
+      self.context.refresh_stale_variables(now)
+      self.last_variable_refresh = now
+
     for cmd in self.console_in:
       self.process_console(cmd)
     self.console_in = []
 
+    if self.metrics_path != None and now - self.last_metrics_dump > self.metrics_dump_interval:
+      self.last_metrics_dump = now
+      try:
+        metrics.REGISTRY.dump(self.metrics_path)
+      except OSError as e:
+        self.log("Failed to write metrics: " + str(e))
+        self.metrics_path = None
+
   def clear_console(self):
     self.console_log.clear()
 
   def process_console(self, cmd):
     self.log(["> ", cmd], [imgui.get_style_color_vec_4(imgui.COLOR_SEPARATOR_ACTIVE), None])
     result = self.commands.call(cmd)
+    if inspect.isawaitable(result):
+      # Log the result when the command completes (e.g. the device responds)
+      self.commands.keep_task(asyncio.create_task(self.__log_result_async(result)))
+    else:
+      self.__log_result(result)
+
+  async def __log_result_async(self, result):
+    try:
+      result = await result
+    except Exception as e:
+      result = "Exception Raised: {0}".format(str(e))
+    self.__log_result(result)
+
+  def __log_result(self, result):
     if result != None:
       try:
         self.log(str(result))
       except:
         self.log("Success, but cannot convert the returned value to a string")
 
+  async def sleep(self, seconds):
+    await asyncio.sleep(seconds)
+
   def process_events(self):
     event = SDL_Event()
     while SDL_PollEvent(ctypes.byref(event)) != 0:
       if event.type == SDL_QUIT:
         self.running = False
         break
+      if event.type == SDL_WINDOWEVENT and event.window.event == SDL_WINDOWEVENT_SIZE_CHANGED:
+        self.window.update_size()
+        self.gui.invalidate_layout()
       self.renderer.process_event(event)
     self.renderer.process_inputs()
 
   async def run(self):
+    sleep_time = 0.001
+    profile    = self.gui.profile
     while self.running:
-      self.process_events()
-      self.update()
-      self.render()
-      await asyncio.sleep(0.001)
+      start = time.perf_counter()
+      with Timer(profile, 'events'):
+        self.process_events()
+      with Timer(profile, 'update'):
+        self.update()
+      with Timer(profile, 'draw'):
+        self.render()
+      profile.end_frame(time.perf_counter() - start)
+
+      # Waiting for vsync is not counted against the frame budget
+      with Timer(profile, 'swap'):
+        SDL_GL_SwapWindow(self.window.sdl_window)
+      self.frame_time.observe_since(start)
+
+      start = metrics.clock()
+      await asyncio.sleep(sleep_time)
+      if start != 0:
+        self.loop_lag.observe(max(0.0, time.perf_counter() - start - sleep_time))
+
+    # Write the archive index
+    self.stop_recording()
 
   def render(self):
     imgui.new_frame()
@@ -211,14 +645,41 @@ class App:
     self.gui.draw()
     imgui.render()
     self.renderer.render(imgui.get_draw_data())
-    SDL_GL_SwapWindow(self.window.sdl_window)
 
   def register_console_commands(self):
     self.commands.add("clear", self.clear_console)
     self.commands.add("call", self.call_command, [ str ])
     self.commands.add("refresh_variables", self.refresh_variables)
     self.commands.add("refresh_commands", self.refresh_commands)
-    self.commands.add("connect", self.connect, [ str ])
+    self.commands.add("get", self.get_variable, [ str ])
+    self.commands.add("set", self.set_variable, [ str, str ])
+    self.commands.add("watch", self.watch_variable, [ str, int ])
+    self.commands.add("unwatch", self.unwatch_variable, [ str ])
+    self.commands.add("toggle_watches", self.toggle_watches)
+    self.commands.add("stream", self.stream_sensors, [ str, int ])
+    self.commands.add("toggle_sensors", self.toggle_sensors)
+    self.commands.add("metrics", self.enable_metrics, [ parse_switch ])
+    self.commands.add("toggle_metrics", self.toggle_metrics)
+    self.commands.add("toggle_profiler", self.toggle_profiler)
+    self.commands.add("dump_metrics", self.dump_metrics, [ str, float ])
+    self.commands.add("sleep", self.sleep, [ float ])
+    self.commands.add("save_track", self.save_track, [ str ])
+    self.commands.add("tracks", self.list_tracks)
+    self.commands.add("name_track", self.name_track, [ str ])
+    self.commands.add("record", self.record, [ str, str ])
+    self.commands.add("stop_recording", self.stop_recording)
+    self.commands.add("tune", self.tune, [ str, int ])
+    self.commands.add("push_tuned", self.push_tuned)
+    self.commands.add("optimise_profile", self.optimise_profile, [ float ])
+    self.commands.add("upload_profile", self.upload_profile)
+    self.commands.add("follow_profile", self.follow_profile, [ str ])
+    self.commands.add("experiment", self.run_experiment, [ str, str ])
+    self.commands.add("variable_ttl", self.set_variable_ttl, [ float ])
+    self.commands.add("connect", self.connect, [ str, str ])
+    self.commands.add("device_filter", self.set_device_filter, [ str ])
+    self.commands.add("connect_serial", self.connect_serial, [ str, int ])
+    self.commands.add("connect_gateway", self.connect_gateway, [ str, int ])
+    self.commands.add("connect_sim", self.connect_sim, [ float ])
     self.commands.add("log_time", self.set_log_time, [ bool ])
     self.commands.add("start_scanner", self.start_scanner)
     self.commands.add("stop_scanner", self.stop_scanner)
@@ -0,0 +1,368 @@
+'''
+Compressed session archives.
+
+A session archive records the packets pushed by the device during a run
+(newtrack, sec, mapd, lap and watch packets, and optionally sensor stream frames).
+Records are grouped into chunks and each chunk is compressed on its own, so
+any chunk can be read without reading the ones before it.
+
+File layout:
+  header   MAGIC, VERSION
+  chunk    CHUNK_MAGIC, compression, raw size, compressed size, data
+  ...
+  index    zlib compressed JSON list of ChunkInfo
+  trailer  index offset, index size, INDEX_MAGIC
+
+The index has the time range, packet kinds and track hashes of every chunk,
+so readers can skip the chunks a query does not need. An archive that was
+not closed (e.g. the app crashed) has no index; it is rebuilt by reading
+every chunk.
+
+Each record is:
+  host time (f64), track hash length (u8), packet length (u32), track hash, packet
+'''
+import collections
+import json
+import lzma
+import os
+import struct
+import time
+import zlib
+
+import codec
+import track_library
+
+MAGIC       = b'RRSA'
+VERSION     = 1
+CHUNK_MAGIC = b'RRCH'
+INDEX_MAGIC = b'RRIX'
+
+HEADER  = struct.Struct('<4sB')
+CHUNK   = struct.Struct('<4sBII')  # Magic, compression, raw size, compressed size
+RECORD  = struct.Struct('<dBI')    # Time, track hash length, packet length
+TRAILER = struct.Struct('<QI4s')   # Index offset, index size, magic
+
+NONE = 0
+ZLIB = 1
+LZMA = 2
+COMPRESSION = { 'none': NONE, 'zlib': ZLIB, 'lzma': LZMA }
+
+CHUNK_SIZE = 1 << 16 # Uncompressed bytes of records in each chunk
+
+FRAME_KIND = 'frame' # Kind of binary sensor stream frames
+
+DEFAULT_PATH = os.path.join(os.path.expanduser('~'), '.remoteroadrunner', 'sessions')
+
+Record = collections.namedtuple('Record', [ 'time', 'kind', 'track', 'packet' ])
+
+def compress(data, compression):
+  if compression == ZLIB:
+    return zlib.compress(data, 6)
+  if compression == LZMA:
+    return lzma.compress(data)
+  return data
+
+def decompress(data, compression):
+  if compression == ZLIB:
+    return zlib.decompress(data)
+  if compression == LZMA:
+    return lzma.decompress(data)
+  return data
+
+def packet_kind(packet):
+  '''
+  Get the kind of a recorded packet (the codec kind, or FRAME_KIND)
+  '''
+  if len(packet) > 0 and packet[0] == 0xFE:
+    return FRAME_KIND
+  return codec.packet_kind(packet.decode('utf-8', 'replace')) or 'unknown'
+
+class ChunkInfo:
+  def __init__(self, offset, size, start = None, end = None, count = 0, kinds = None, tracks = None):
+    self.offset = offset # Offset of the chunk header in the file
+    self.size   = size   # Size of the chunk including the header
+    self.start  = start  # Time of the first record
+    self.end    = end    # Time of the last record
+    self.count  = count  # Number of records
+    self.kinds  = kinds if kinds != None else {}     # Packet kind -> number of records
+    self.tracks = tracks if tracks != None else []   # Track hashes of the records
+
+  def add(self, record):
+    self.start  = record.time if self.start == None else self.start
+    self.end    = record.time
+    self.count += 1
+    self.kinds[record.kind] = self.kinds.get(record.kind, 0) + 1
+    if record.track != '' and record.track not in self.tracks:
+      self.tracks.append(record.track)
+
+  def matches(self, start = None, end = None, kinds = None, track = None):
+    '''
+    Check if the chunk could contain records matching a query.
+    'track' can be the start of a hash.
+    '''
+    if start != None and self.end != None and self.end < start:
+      return False
+    if end != None and self.start != None and self.start > end:
+      return False
+    if kinds != None and not any([ kind in self.kinds for kind in kinds ]):
+      return False
+    if track != None and not any([ hash.startswith(track) for hash in self.tracks ]):
+      return False
+    return True
+
+  def to_json(self):
+    return { 'offset': self.offset, 'size': self.size, 'start': self.start, 'end': self.end,
+             'count': self.count, 'kinds': self.kinds, 'tracks': self.tracks }
+
+  @staticmethod
+  def from_json(data):
+    return ChunkInfo(data['offset'], data['size'], data['start'], data['end'], data['count'], data['kinds'], data['tracks'])
+
+class ArchiveWriter:
+  def __init__(self, path, compression = 'zlib', chunk_size = CHUNK_SIZE):
+    if compression not in COMPRESSION:
+      raise ValueError("Unknown compression '{0}'. Expected one of {1}".format(compression, list(COMPRESSION.keys())))
+    self.path        = path
+    self.compression = COMPRESSION[compression]
+    self.chunk_size  = chunk_size
+    self.chunks      = [] # ChunkInfo of each chunk written
+    self.buffer      = bytearray()
+    self.pending     = None # ChunkInfo of the records in the buffer
+    self.file        = open(path, 'wb')
+    self.file.write(HEADER.pack(MAGIC, VERSION))
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *args):
+    self.close()
+
+  def write(self, packet, track = '', t = None):
+    '''
+    Add a packet (bytes) to the archive
+    '''
+    record = Record(t if t != None else time.time(), packet_kind(packet), track, packet)
+    hash   = track.encode('ascii')
+    if self.pending == None:
+      self.pending = ChunkInfo(0, 0)
+    self.pending.add(record)
+    self.buffer += RECORD.pack(record.time, len(hash), len(packet))
+    self.buffer += hash
+    self.buffer += packet
+    if len(self.buffer) >= self.chunk_size:
+      self.flush()
+
+  def flush(self):
+    '''
+    Compress and write the buffered records as a chunk
+    '''
+    if self.pending == None:
+      return
+    data = compress(bytes(self.buffer), self.compression)
+    info = self.pending
+    info.offset = self.file.tell()
+    info.size   = CHUNK.size + len(data)
+    self.file.write(CHUNK.pack(CHUNK_MAGIC, self.compression, len(self.buffer), len(data)))
+    self.file.write(data)
+    self.file.flush()
+    self.chunks.append(info)
+    self.buffer  = bytearray()
+    self.pending = None
+
+  def close(self):
+    if self.file == None:
+      return
+    self.flush()
+    index  = zlib.compress(json.dumps([ chunk.to_json() for chunk in self.chunks ]).encode('utf-8'))
+    offset = self.file.tell()
+    self.file.write(index)
+    self.file.write(TRAILER.pack(offset, len(index), INDEX_MAGIC))
+    self.file.close()
+    self.file = None
+
+class ArchiveReader:
+  def __init__(self, path):
+    self.path      = path
+    self.file      = open(path, 'rb')
+    self.recovered = False # True if the index was rebuilt from the chunks
+    header = self.file.read(HEADER.size)
+    if len(header) < HEADER.size:
+      raise ValueError("'{0}' is not a session archive".format(path))
+    magic, version = HEADER.unpack(header)
+    if magic != MAGIC:
+      raise ValueError("'{0}' is not a session archive".format(path))
+    if version > VERSION:
+      raise ValueError("'{0}' was written by a newer version ({1})".format(path, version))
+    self.chunks = self.__read_index()
+    if self.chunks == None:
+      self.chunks    = self.__scan()
+      self.recovered = True
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *args):
+    self.close()
+
+  def close(self):
+    self.file.close()
+
+  def __read_index(self):
+    '''
+    Read the index from the end of the file. Returns None if there is no index.
+    '''
+    size = self.file.seek(0, os.SEEK_END)
+    if size < HEADER.size + TRAILER.size:
+      return None
+    self.file.seek(size - TRAILER.size)
+    offset, length, magic = TRAILER.unpack(self.file.read(TRAILER.size))
+    if magic != INDEX_MAGIC or offset + length + TRAILER.size != size:
+      return None
+    self.file.seek(offset)
+    return [ ChunkInfo.from_json(data) for data in json.loads(zlib.decompress(self.file.read(length))) ]
+
+  def __scan(self):
+    '''
+    Rebuild the index by reading every chunk. A chunk cut short
+    by a crash ends the archive.
+    '''
+    chunks = []
+    offset = HEADER.size
+    while True:
+      self.file.seek(offset)
+      header = self.file.read(CHUNK.size)
+      if len(header) < CHUNK.size:
+        break
+      magic, compression, raw_size, size = CHUNK.unpack(header)
+      if magic != CHUNK_MAGIC:
+        break
+      info = ChunkInfo(offset, CHUNK.size + size)
+      try:
+        for record in self.__parse(decompress(self.file.read(size), compression)):
+          info.add(record)
+      except (zlib.error, lzma.LZMAError, struct.error):
+        break
+      chunks.append(info)
+      offset += info.size
+    return chunks
+
+  def __parse(self, data):
+    records = []
+    pos     = 0
+    while pos < len(data):
+      t, hash_size, packet_size = RECORD.unpack_from(data, pos)
+      pos   += RECORD.size
+      track  = data[pos:pos + hash_size].decode('ascii')
+      pos   += hash_size
+      packet = data[pos:pos + packet_size]
+      pos   += packet_size
+      records.append(Record(t, packet_kind(packet), track, packet))
+    return records
+
+  def read_chunk(self, index):
+    '''
+    Get the records in a chunk
+    '''
+    info = self.chunks[index]
+    self.file.seek(info.offset)
+    magic, compression, raw_size, size = CHUNK.unpack(self.file.read(CHUNK.size))
+    if magic != CHUNK_MAGIC:
+      raise ValueError('Bad chunk at offset {0}'.format(info.offset))
+    return self.__parse(decompress(self.file.read(size), compression))
+
+  def find_chunks(self, start = None, end = None, kinds = None, track = None):
+    '''
+    Get the indices of the chunks that could contain records matching a query
+    '''
+    return [ i for i, chunk in enumerate(self.chunks) if chunk.matches(start, end, kinds, track) ]
+
+  def records(self, start = None, end = None, kinds = None, track = None):
+    '''
+    Iterate over the records matching a query. Only chunks that could
+    contain matching records are read.
+    '''
+    for index in self.find_chunks(start, end, kinds, track):
+      for record in self.read_chunk(index):
+        if start != None and record.time < start:
+          continue
+        if end != None and record.time > end:
+          continue
+        if kinds != None and record.kind not in kinds:
+          continue
+        if track != None and not record.track.startswith(track):
+          continue
+        yield record
+
+  def tracks(self):
+    return sorted(set([ track for chunk in self.chunks for track in chunk.tracks ]))
+
+  def kinds(self):
+    counts = {}
+    for chunk in self.chunks:
+      for kind, count in chunk.kinds.items():
+        counts[kind] = counts.get(kind, 0) + count
+    return counts
+
+class SessionRecorder:
+  '''
+  Records the packets pushed by the device to an archive.
+
+  The map packets of a lap (newtrack and sec, or mapd) are held until the lap
+  time arrives, then written together, tagged with the hash of the track.
+  Other packets are tagged with the track being driven.
+  '''
+  def __init__(self, context, path, compression = 'zlib', frames = False):
+    self.context = context
+    self.writer  = ArchiveWriter(path, compression)
+    self.frames  = frames
+    self.lap     = [] # (time, packet) of the map packets of the current lap
+    self.track   = '' # Hash of the last track recorded
+    self.packets = 0
+    context.add_push_listener(self.on_push)
+    if frames:
+      context.add_frame_listener(self.on_frame)
+
+  @property
+  def path(self):
+    return self.writer.path
+
+  def on_push(self, recieved):
+    kind = codec.packet_kind(recieved)
+    now  = time.time()
+    if kind == 'newtrack':
+      self.lap = [ (now, recieved) ]
+    elif kind in [ 'sec', 'mapd' ]:
+      self.lap.append((now, recieved))
+    elif kind == 'lap':
+      # The context has applied the map packets, the lap packet is passed to listeners first
+      sections = self.context.get_track_details()
+      if len(sections) > 0:
+        self.track = self.track_hash(sections)
+      for t, packet in self.lap + [ (now, recieved) ]:
+        self.__write(packet, t)
+      self.lap = []
+    else:
+      self.__write(recieved, now)
+
+  def on_frame(self, frame):
+    self.writer.write(bytes(frame), self.track)
+    self.packets += 1
+
+  def __write(self, packet, t):
+    self.writer.write(packet.encode('utf-8'), self.track, t)
+    self.packets += 1
+
+  def track_hash(self, sections):
+    '''
+    Get the hash of a track, as used by the track library
+    '''
+    library = self.context.track_library
+    record  = library.find(sections) if library != None else None
+    if record != None:
+      return record.hash
+    return track_library.content_hash(track_library.normalise(sections))
+
+  def close(self):
+    self.context.remove_push_listener(self.on_push)
+    self.context.remove_frame_listener(self.on_frame)
+    self.writer.close()
@@ -0,0 +1,148 @@
+'''
+Synchronisation of the host clock with the device clock (millis()).
+
+The host sends 'time' requests and records when each one was sent and
+answered. Like NTP, the device time is assumed to be read halfway through
+the round trip. A line is fitted through the samples with the shortest
+round trips to estimate the offset and drift between the clocks.
+
+Round trip times of every message are also tracked (like TCP's smoothed
+RTT and variance) to pick the response timeout.
+'''
+import collections
+import time
+
+MILLIS_WRAP = 1 << 32 # millis() is an unsigned long and wraps after ~49 days
+
+# When a packet was sent, in host seconds and device seconds
+PacketStamp = collections.namedtuple('PacketStamp', [ 'host', 'device' ])
+
+class ClockSync:
+  def __init__(self, max_samples = 32, min_timeout = 1.0, max_timeout = 5.0):
+    self.samples      = collections.deque(maxlen = max_samples) # (host time, device seconds, round trip)
+    self.offset       = None # Device seconds at host time 'origin'
+    self.drift        = 0.0  # Device seconds per host second, minus 1
+    self.origin       = 0.0
+    self.last_millis  = None # Used to unwrap millis()
+    self.wraps        = 0
+
+    # Round trip estimates, in seconds
+    self.srtt         = None # Smoothed round trip time
+    self.rttvar       = 0.0  # Round trip variation (jitter)
+    self.min_rtt      = None
+    self.last_rtt     = None
+    self.min_timeout  = min_timeout
+    self.max_timeout  = max_timeout
+
+  def is_synced(self):
+    return self.offset != None
+
+  def unwrap(self, millis):
+    '''
+    Convert a millis() value to seconds, accounting for it wrapping
+    '''
+    if self.last_millis != None and millis < self.last_millis and self.last_millis - millis > MILLIS_WRAP // 2:
+      self.wraps += 1
+    self.last_millis = millis
+    return (millis + self.wraps * MILLIS_WRAP) / 1000
+
+  def add_rtt(self, rtt):
+    '''
+    Add the round trip time of a message (see RFC 6298)
+    '''
+    self.last_rtt = rtt
+    self.min_rtt  = rtt if self.min_rtt == None else min(self.min_rtt, rtt)
+    if self.srtt == None:
+      self.srtt   = rtt
+      self.rttvar = rtt / 2
+    else:
+      self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - rtt)
+      self.srtt   = 0.875 * self.srtt + 0.125 * rtt
+
+  def backoff(self):
+    '''
+    Lengthen the timeout after a message timed out
+    '''
+    if self.srtt != None:
+      self.rttvar = max(self.rttvar * 2, self.srtt)
+
+  def add_sample(self, sent, millis, recieved):
+    '''
+    Add the response to a 'time' request.
+    'sent' and 'recieved' are host times in seconds.
+    '''
+    rtt = recieved - sent
+    self.samples.append(((sent + recieved) / 2, self.unwrap(millis), rtt))
+    self.__fit()
+
+  def __fit(self):
+    # Use the samples with the shortest round trips, they have the least uncertainty
+    ordered = sorted(self.samples, key = lambda s: s[2])
+    best    = ordered[:max(2, len(ordered) // 2)]
+
+    self.origin = best[0][0]
+    if len(best) < 2:
+      self.offset = best[0][1]
+      self.drift  = 0.0
+      return
+
+    xs = [ s[0] - self.origin for s in best ]
+    ys = [ s[1] for s in best ]
+    mean_x = sum(xs) / len(xs)
+    mean_y = sum(ys) / len(ys)
+    var_x  = sum([ (x - mean_x) ** 2 for x in xs ])
+    if var_x < 1.0: # Not enough time between samples to measure drift
+      slope = 1.0
+    else:
+      slope = sum([ (x - mean_x) * (y - mean_y) for x, y in zip(xs, ys) ]) / var_x
+    self.drift  = slope - 1
+    self.offset = mean_y - slope * mean_x
+
+  def to_device(self, host_time):
+    '''
+    Convert a host time (seconds since the epoch) to device seconds
+    '''
+    if not self.is_synced():
+      return None
+    return self.offset + (host_time - self.origin) * (1 + self.drift)
+
+  def to_host(self, device_time):
+    '''
+    Convert device seconds to a host time (seconds since the epoch)
+    '''
+    if not self.is_synced():
+      return None
+    return self.origin + (device_time - self.offset) / (1 + self.drift)
+
+  def stamp(self, host_time = None):
+    '''
+    Get the (host time, device time) that a packet recieved at 'host_time' was sent.
+    The device time is None until the clocks are synchronised.
+    '''
+    host_time = time.time() if host_time is None else host_time
+    return PacketStamp(host_time, self.to_device(host_time - self.one_way_latency()))
+
+  def one_way_latency(self):
+    '''
+    Estimate of the time for a packet to travel in one direction
+    '''
+    return self.min_rtt / 2 if self.min_rtt != None else 0.0
+
+  def jitter(self):
+    return self.rttvar
+
+  def timeout(self):
+    '''
+    Get the response timeout for the current link conditions
+    '''
+    if self.srtt == None:
+      return self.max_timeout
+    return min(self.max_timeout, max(self.min_timeout, self.srtt + 4 * self.rttvar))
+
+  def uncertainty(self):
+    '''
+    Half the shortest round trip in the fitted samples, the bound on the offset error
+    '''
+    if len(self.samples) == 0:
+      return None
+    return min([ s[2] for s in self.samples ]) / 2
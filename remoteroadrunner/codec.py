@@ -0,0 +1,301 @@
+'''
+Encoder and decoder for the text protocol (see SerialCommands.h in the sketch).
+
+Requests are encoded by the functions below. Responses and pushes are decoded
+with one table lookup on their first line (or first word) to a parser for that
+packet kind.
+
+Responses:
+  OK+CALL
+  OK+SET
+  OK+WATCH
+  OK+UNWATCH
+  OK+GET\\n<name> <type> <value>
+  OK+TYPE\\n<type>
+  OK+TIME\\n<millis>
+  OK+LSCMD\\n<count>\\n<name>\\n...
+  OK+LSVAR\\n<count>\\n<name> <type>\\n...
+  OK+MAP\\n<count>
+  OK+G\\n<index> <value>
+  ERR+<message>
+
+Pushes:
+  newtrack <version>
+  sec <type> <size>
+  mapd <version> <count>\\n<index> <type> <size>\\n...
+  lap <milliseconds>
+  watch <millis>\\n<name> <value>\\n...
+'''
+import collections
+
+# A variable reported by 'lsvar'. 'type' is float, int, bool or None (unsupported).
+VarSpec = collections.namedtuple('VarSpec', [ 'name', 'type' ])
+
+# A decoded packet. 'kind' is the packet kind (e.g. 'GET', 'ERR' or 'lap').
+Packet = collections.namedtuple('Packet', [ 'kind', 'value' ])
+
+# The sections of the track map that changed since the previous version.
+# 'count' is the number of sections in the map, 'changes' is a list of (index, [type, size]).
+MapDelta = collections.namedtuple('MapDelta', [ 'version', 'count', 'changes' ])
+
+TYPES = { 'f32': float, 'f64': float, 'i32': int, 'b': bool }
+
+FLOAT_FORMAT = '{0:.4f}'
+
+def format_value(value):
+  '''
+  Format a value so the device can parse it (with Stream::parseInt or parseFloat)
+  '''
+  if isinstance(value, bool): # Check first, bool is also an int
+    return '1' if value else '0'
+  if isinstance(value, float):
+    return FLOAT_FORMAT.format(value)
+  return str(value)
+
+def parse_value(var_type, text):
+  '''
+  Parse a value printed by the device. Arduino's Print writes 'nan',
+  'inf' or 'ovf' (overflow) for floats it cannot print.
+  '''
+  if var_type is bool:
+    return text != '0'
+  if var_type is float and text == 'ovf':
+    return float('inf')
+  return var_type(text)
+
+# Requests
+
+def encode_call(name):
+  return 'call ' + name
+
+def encode_set(name, value):
+  return 'set {0} {1}'.format(name, format_value(value))
+
+def encode_get(name):
+  return 'get ' + name
+
+# Index addressed forms. The index is the position of the variable or
+# command in the lsvar/lscmd response.
+
+def encode_call_id(index):
+  return 'c {0}'.format(int(index))
+
+def encode_set_id(index, value):
+  return 's {0} {1}'.format(int(index), format_value(value))
+
+def encode_get_id(index):
+  return 'g {0}'.format(int(index))
+
+def encode_type(name):
+  return 'type ' + name
+
+def encode_lscmd():
+  return 'lscmd'
+
+def encode_lsvar():
+  return 'lsvar'
+
+def encode_watch(name, period_ms):
+  return 'watch {0} {1}'.format(name, int(period_ms))
+
+def encode_unwatch(name = None):
+  return 'unwatch' if name == None else 'unwatch ' + name
+
+def encode_time():
+  return 'time'
+
+def encode_map(targets):
+  '''
+  Encode a map upload. 'targets' is a list of (type, size, speed, brake)
+  '''
+  lines = [ 'map {0}'.format(len(targets)) ]
+  lines += [ '{0} {1} {2} {3}'.format(int(kind), int(size), int(speed), int(brake)) for kind, size, speed, brake in targets ]
+  return '\n'.join(lines)
+
+# Parsers, given the rest of the packet after the kind
+
+def _parse_empty(body):
+  return None
+
+def _parse_error(body):
+  return body # The error message
+
+def _parse_get(body):
+  name, type_name, text = body.split(' ', 2)
+  var_type = TYPES.get(type_name)
+  return name, parse_value(var_type, text) if var_type != None else None
+
+def _parse_get_id(body):
+  '''
+  The value is returned as text, the type is not sent (it is known from lsvar)
+  '''
+  index, text = body.split(' ', 1)
+  return int(index), text
+
+def _parse_type(body):
+  return TYPES.get(body)
+
+def _parse_time(body):
+  return int(body)
+
+def _parse_count(body):
+  return int(body)
+
+def _parse_lscmd(body):
+  count, _, names = body.partition('\n')
+  return names.split('\n')[:int(count)]
+
+def _parse_lsvar(body):
+  count, _, lines = body.partition('\n')
+  specs = []
+  for line in lines.split('\n')[:int(count)]:
+    name, _, type_name = line.partition(' ')
+    specs.append(VarSpec(name, TYPES.get(type_name)))
+  return specs
+
+def _parse_section(body):
+  kind, size = body.split(' ', 1)
+  return [ int(kind), int(size) ]
+
+def _parse_new_track(body):
+  return int(body) if body.strip() != '' else None # The map version, if the device sends one
+
+def _parse_map_delta(body):
+  head, _, lines = body.partition('\n')
+  version, count = head.split(' ', 1)
+  changes = []
+  for line in lines.split('\n'):
+    if line != '':
+      index, kind, size = line.split(' ', 2)
+      changes.append((int(index), [ int(kind), int(size) ]))
+  return MapDelta(int(version), int(count), changes)
+
+def _parse_lap(body):
+  return int(body) / 1000
+
+def _parse_watch(body):
+  time, _, lines = body.partition('\n')
+  values = []
+  for line in lines.split('\n'):
+    name, _, text = line.partition(' ')
+    if text != '':
+      values.append((name, parse_value(float, text))) # printValue also prints 'ovf' and 'nan'
+  return int(time), values
+
+# Response kind -> parser. The kind is the first line without 'OK+'.
+RESPONSE_PARSERS = {
+  'CALL':    _parse_empty,
+  'SET':     _parse_empty,
+  'WATCH':   _parse_empty,
+  'UNWATCH': _parse_empty,
+  'GET':     _parse_get,
+  'TYPE':    _parse_type,
+  'TIME':    _parse_time,
+  'LSCMD':   _parse_lscmd,
+  'LSVAR':   _parse_lsvar,
+  'MAP':     _parse_count,
+  'G':       _parse_get_id,
+}
+
+# Push kind -> parser. The kind is the first word.
+PUSH_PARSERS = {
+  'newtrack': _parse_new_track,
+  'sec':      _parse_section,
+  'mapd':     _parse_map_delta,
+  'lap':      _parse_lap,
+  'watch':    _parse_watch,
+}
+
+def packet_kind(packet):
+  '''
+  Get the kind of a packet without parsing it. Returns 'ERR' for errors,
+  the response kind for other responses (e.g. 'GET'), the first word
+  of pushes (e.g. 'lap'), or None if the packet is not recognised.
+  '''
+  if packet.startswith('OK+'):
+    kind = packet[3:].partition('\n')[0]
+    return kind if kind in RESPONSE_PARSERS else None
+  if packet.startswith('ERR+'):
+    return 'ERR'
+  end = len(packet)
+  for separator in ' \n':
+    index = packet.find(separator)
+    if index >= 0 and index < end:
+      end = index
+  kind = packet[:end]
+  return kind if kind in PUSH_PARSERS else None
+
+def decode(packet):
+  '''
+  Decode a packet into a Packet(kind, value).
+  Raises ValueError if the packet is malformed or not recognised.
+  '''
+  if packet.startswith('OK+'):
+    kind, _, body = packet[3:].partition('\n')
+    parser = RESPONSE_PARSERS.get(kind)
+  elif packet.startswith('ERR+'):
+    kind, body, parser = 'ERR', packet[4:], _parse_error
+  else:
+    kind, body = packet, ''
+    for separator in ' \n':
+      head, found, rest = packet.partition(separator)
+      if found and len(head) < len(kind):
+        kind, body = head, rest
+    parser = PUSH_PARSERS.get(kind)
+
+  if parser == None:
+    raise ValueError('Unknown packet: {0!r}'.format(packet[:32]))
+  try:
+    return Packet(kind, parser(body))
+  except (ValueError, IndexError) as e:
+    raise ValueError('Malformed {0} packet: {1}'.format(kind, e))
+
+def decode_response(packet, kind):
+  '''
+  Get the value of a response of the expected kind, or None if it is
+  an error, a different kind or malformed.
+  '''
+  if not packet.startswith('OK+'):
+    return None
+  try:
+    decoded = decode(packet)
+  except ValueError:
+    return None
+  return decoded.value if decoded.kind == kind else None
+
+PUSH_KINDS = frozenset(PUSH_PARSERS.keys())
+
+def is_push(packet):
+  '''
+  Check if a packet was pushed by the device rather than sent as a response
+  '''
+  return packet_kind(packet) in PUSH_KINDS
+
+# First word of a request -> the kind of its OK response
+REQUEST_RESPONSES = {
+  'call':    'CALL',
+  'c':       'CALL',
+  'set':     'SET',
+  's':       'SET',
+  'get':     'GET',
+  'g':       'G',
+  'type':    'TYPE',
+  'lscmd':   'LSCMD',
+  'lsvar':   'LSVAR',
+  'watch':   'WATCH',
+  'unwatch': 'UNWATCH',
+  'time':    'TIME',
+  'map':     'MAP',
+}
+
+def response_matches(request, response):
+  '''
+  Check if a response can be the answer to a request. An OK response of a
+  different kind (e.g. a late answer to an earlier request) does not match.
+  Errors, and requests the table does not know, match any response.
+  '''
+  words    = request.split(None, 1)
+  expected = REQUEST_RESPONSES.get(words[0].lower()) if len(words) > 0 else None
+  if expected == None or not response.startswith('OK+'):
+    return True
+  return response[3:].partition('\n')[0] == expected
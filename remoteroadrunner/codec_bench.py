@@ -0,0 +1,158 @@
+'''
+Throughput benchmark for the protocol codec.
+
+Random packets of every response and push form are generated, printed the
+way the sketch prints them, and decoded. The same generator is used by the
+round trip and fuzz tests in tests/test_codec.py.
+
+Usage:
+  python codec_bench.py --iterations 100000 --seed 1
+'''
+import argparse
+import math
+import random
+import string
+import time
+
+import codec
+
+NAME_CHARS = string.ascii_letters + string.digits + '_'
+ERRORS     = [ 'Unknown Variable', 'Unknown Command Token', 'Command Not Found', 'Too Many Watches', 'Not Watched' ]
+
+def random_name(rng):
+  return ''.join([ rng.choice(NAME_CHARS) for _ in range(rng.randint(1, 12)) ])
+
+def random_value(rng, type_name):
+  '''
+  Get a random value of a type and the text the sketch prints for it
+  '''
+  if type_name == 'b':
+    value = rng.random() < 0.5
+    return value, '1' if value else '0'
+  if type_name == 'i32':
+    value = rng.randint(-2 ** 31, 2 ** 31 - 1)
+    return value, str(value)
+  special = rng.random()
+  if special < 0.02:
+    return float('nan'), 'nan'
+  if special < 0.04:
+    return float('inf'), 'inf'
+  if special < 0.06:
+    return float('inf'), 'ovf'
+  value = round(rng.uniform(-1e6, 1e6), 2) # Print writes 2 decimal places
+  return value, '{0:.2f}'.format(value)
+
+def random_packet(rng):
+  '''
+  Get a random packet and the Packet it should decode to
+  '''
+  form = rng.randrange(17)
+  if form == 0:
+    return 'OK+CALL', codec.Packet('CALL', None)
+  elif form == 1:
+    return 'OK+SET', codec.Packet('SET', None)
+  elif form == 2:
+    return 'OK+WATCH', codec.Packet('WATCH', None)
+  elif form == 3:
+    return 'OK+UNWATCH', codec.Packet('UNWATCH', None)
+  elif form == 4:
+    name = random_name(rng)
+    type_name = rng.choice(list(codec.TYPES.keys()))
+    value, text = random_value(rng, type_name)
+    return 'OK+GET\n{0} {1} {2}'.format(name, type_name, text), codec.Packet('GET', (name, value))
+  elif form == 5:
+    type_name = rng.choice(list(codec.TYPES.keys()) + [ 'none' ])
+    return 'OK+TYPE\n' + type_name, codec.Packet('TYPE', codec.TYPES.get(type_name))
+  elif form == 6:
+    millis = rng.randint(0, 2 ** 32 - 1)
+    return 'OK+TIME\n{0}'.format(millis), codec.Packet('TIME', millis)
+  elif form == 7:
+    names = [ random_name(rng) for _ in range(rng.randint(0, 20)) ]
+    return 'OK+LSCMD\n{0}\n{1}'.format(len(names), ''.join([ n + '\n' for n in names ])), codec.Packet('LSCMD', names)
+  elif form == 8:
+    specs = [ (random_name(rng), rng.choice(list(codec.TYPES.keys()) + [ 'none' ])) for _ in range(rng.randint(0, 20)) ]
+    text  = ''.join([ '{0} {1}\n'.format(n, t) for n, t in specs ])
+    return 'OK+LSVAR\n{0}\n{1}'.format(len(specs), text), codec.Packet('LSVAR', [ codec.VarSpec(n, codec.TYPES.get(t)) for n, t in specs ])
+  elif form == 9:
+    message = rng.choice(ERRORS)
+    return 'ERR+' + message, codec.Packet('ERR', message)
+  elif form == 10:
+    if rng.random() < 0.5:
+      return 'newtrack', codec.Packet('newtrack', None)
+    version = rng.randint(0, 2 ** 32 - 1)
+    return 'newtrack {0}'.format(version), codec.Packet('newtrack', version)
+  elif form == 11:
+    kind, size = rng.randint(0, 2), rng.randint(0, 100000)
+    return 'sec {0} {1}'.format(kind, size), codec.Packet('sec', [ kind, size ])
+  elif form == 12:
+    millis = rng.randint(0, 10 ** 7)
+    return 'lap {0}'.format(millis), codec.Packet('lap', millis / 1000)
+  elif form == 13:
+    count = rng.randint(0, 32)
+    return 'OK+MAP\n{0}'.format(count), codec.Packet('MAP', count)
+  elif form == 14:
+    index = rng.randint(0, 255)
+    value, text = random_value(rng, rng.choice(list(codec.TYPES.keys())))
+    return 'OK+G\n{0} {1}'.format(index, text), codec.Packet('G', (index, text))
+  elif form == 15:
+    version, count = rng.randint(0, 2 ** 32 - 1), rng.randint(0, 32)
+    changes = [ (i, [ rng.randint(0, 2), rng.randint(1, 100000) ]) for i in range(count) if rng.random() < 0.3 ]
+    text    = ''.join([ '\n{0} {1} {2}'.format(i, t, size) for i, (t, size) in changes ])
+    return 'mapd {0} {1}{2}'.format(version, count, text), codec.Packet('mapd', codec.MapDelta(version, count, changes))
+  millis = rng.randint(0, 2 ** 32 - 1)
+  values = [ (random_name(rng), round(rng.uniform(-1e4, 1e4), 4)) for _ in range(rng.randint(1, 8)) ]
+  text   = ''.join([ '\n{0} {1:.4f}'.format(n, v) for n, v in values ])
+  return 'watch {0}{1}'.format(millis, text), codec.Packet('watch', (millis, values))
+
+def same(a, b):
+  '''
+  Compare decoded values, treating nan as equal to nan
+  '''
+  if isinstance(a, float) and isinstance(b, float):
+    return a == b or (math.isnan(a) and math.isnan(b))
+  if isinstance(a, (list, tuple)) and isinstance(b, (list, tuple)):
+    return len(a) == len(b) and all([ same(x, y) for x, y in zip(a, b) ])
+  return a == b and type(a) == type(b)
+
+def mutate(rng, packet):
+  choice = rng.randrange(4)
+  if choice == 0: # Truncate
+    return packet[:rng.randrange(len(packet) + 1)]
+  if choice == 1: # Change a character
+    i = rng.randrange(len(packet))
+    return packet[:i] + rng.choice(string.printable) + packet[i + 1:]
+  if choice == 2: # Remove a character
+    i = rng.randrange(len(packet))
+    return packet[:i] + packet[i + 1:]
+  other, _ = random_packet(rng) # Splice two packets
+  return packet[:rng.randrange(len(packet) + 1)] + other[rng.randrange(len(other) + 1):]
+
+def bench(count, seed):
+  rng     = random.Random(seed)
+  samples = {}
+  for _ in range(count):
+    packet, expected = random_packet(rng)
+    samples.setdefault(expected.kind, []).append(packet)
+
+  total_packets = 0
+  total_time    = 0.0
+  for kind in sorted(samples.keys()):
+    packets = samples[kind]
+    start   = time.perf_counter()
+    for packet in packets:
+      codec.decode(packet)
+    elapsed = time.perf_counter() - start
+    total_packets += len(packets)
+    total_time    += elapsed
+    print('{0:10} {1:8.0f} packets/s {2:6.2f} us/packet'.format(kind, len(packets) / elapsed, elapsed / len(packets) * 1e6))
+  print('{0:10} {1:8.0f} packets/s {2:6.2f} us/packet'.format('all', total_packets / total_time, total_time / total_packets * 1e6))
+
+def main():
+  parser = argparse.ArgumentParser(description = 'Benchmark the protocol codec')
+  parser.add_argument('--iterations', type = int, default = 100000)
+  parser.add_argument('--seed', type = int, default = 0)
+  args = parser.parse_args()
+  bench(args.iterations, args.seed)
+
+if __name__ == '__main__':
+  main()
@@ -1,49 +1,256 @@
 import serial_interface
+import codec
+import collections
 import queue
 import asyncio
 import bluetooth
+import serial_link
+import tcp_link
+import sim.device
 import imgui
+import metrics
+import snapshot
+from link import handler_time
 from message import Message
+from variables import VariableCache
+from watch import WatchList
+from sensor_stream import SensorStream
+from track_library import TrackMatcher
+import sensor_stream
 
 class RoadRunnerContext:
   def __init__(self, app):
     self.commands = [  ]
-    self.variables = {  }
+    self.command_ids = {} # Command name -> index on the device
+    self.use_ids  = True  # Address variables and commands by index once the lists are known
+    self.variables = VariableCache()
     self.bt = None
     self.get_queue = queue.Queue()
+    self.in_flight = {  } # Request key -> queued or unanswered Message, removed when it completes
     self.app = app
-    self.track_details = []
-    self.lap_times     = []
+    self.track         = snapshot.EMPTY_TRACK # Published track map, replaced on every change (see snapshot.py)
+    self.laps          = snapshot.EMPTY_LAPS  # Published lap times
+    self.track_edits   = collections.deque()  # (map version, index, section) edits of the track map, applied by handle_incoming
+    self.max_laps      = 1000 # Lap times kept. The track library keeps the full history.
+    self.track_library  = None  # TrackLibrary that maps and lap times are recorded in
+    self.track_matcher  = None  # Matches the map being recieved against the library
+    self.current_track  = None  # TrackRecord of the track being driven
+    self.push_listeners = [] # Functions called with every packet pushed by the device
+    self.watches       = WatchList()
+    self.sensors       = SensorStream()
+    self.frame_listeners = [] # Functions called with every sensor stream frame
 
   # self.app.log([ "BT Recv: ", msg.strip()], [imgui.Vec4(0.3, 0.8, 0.3, 1), None])
 
   def connect(self, address):
     # Create the connection
-    self.bt = bluetooth.Connection(self.app, address)
+    return self.use_link(bluetooth.Connection(self.app, address))
+
+  def connect_serial(self, port, baudrate=serial_link.DEFAULT_BAUDRATE):
+    # Create a wired connection
+    return self.use_link(serial_link.SerialConnection(self.app, port, baudrate))
+
+  def connect_gateway(self, host, port=tcp_link.DEFAULT_PORT):
+    # Connect to a gateway that owns the connection to the device
+    return self.use_link(tcp_link.TCPConnection(self.app, host, port))
+
+  def connect_sim(self, device=None, time_scale=1.0):
+    # Connect to a simulated robot, for testing without hardware
+    return self.use_link(sim.device.SimulatedConnection(self.app, device, time_scale=time_scale))
+
+  def use_link(self, link):
+    '''
+    Use a connection to communicate with the device.
+    Returns the connect task of the link.
+    '''
+    if self.bt != None:
+      self.bt.close()
+
+    # Requests waiting on a previous connection will never be answered
+    self.in_flight = {}
+
+    # Indices are only valid for the device they were listed by
+    self.variables.clear_ids()
+    self.command_ids = {}
+
+    # Map deltas only apply to the map of the device they came from
+    self.track = self.track.publish(map_version = None)
+
+    self.bt = link
     self.bt.set_response_handler(self.__bt_message_handler)
+    self.bt.set_frame_handler(self.__frame_handler)
 
     # Return the connect task
     return self.bt.get_connect_task()
 
   def handle_incoming(self):
+    self.__apply_track_edits()
     if self.bt != None:
       self.bt.handle_messages()
 
-  def __bt_message_handler(self, recieved):
+  def add_push_listener(self, listener):
+    '''
+    Add a function that is called with every packet pushed by the device
+    (e.g. newtrack, sec and lap packets).
+    '''
+    self.push_listeners.append(listener)
+
+  def remove_push_listener(self, listener):
+    if listener in self.push_listeners:
+      self.push_listeners.remove(listener)
+
+  def add_frame_listener(self, listener):
+    '''
+    Add a function that is called with every binary sensor stream frame
+    '''
+    self.frame_listeners.append(listener)
+
+  def remove_frame_listener(self, listener):
+    if listener in self.frame_listeners:
+      self.frame_listeners.remove(listener)
+
+  def __frame_handler(self, packet):
+    self.sensors.add_frame(packet)
+    for listener in self.frame_listeners:
+      listener(packet)
+
+  def stream_sensors(self, link, period_ms):
+    '''
+    Start (or stop, if link is STREAM_OFF) the sensor array stream.
+    Returns the list of sent messages.
+    '''
+    self.sensors.clear()
+    return self.set_vars({ sensor_stream.STREAM_PERIOD_VAR: int(period_ms), sensor_stream.STREAM_LINK_VAR: int(link) })
+
+  def __bt_message_handler(self, recieved, stamp=None):
+    start = metrics.clock()
+    try:
+      self.__handle_push(recieved, stamp)
+    except ValueError as e:
+      # A corrupt packet is dropped, it must not stop the app
+      self.app.log('Dropped bad BT Message ({0}): {1}'.format(e, recieved))
+    if start != 0:
+      handler_time(serial_interface.packet_type(recieved)).observe_since(start)
+
+  def __handle_push(self, recieved, stamp):
+    for listener in self.push_listeners:
+      listener(recieved)
+
     if serial_interface.is_new_track(recieved):
-      self.track_details = []
+      self.track = self.track.publish(sections = (), complete = False, map_version = serial_interface.parse_new_track(recieved))
+      if self.track_library != None:
+        self.track_matcher = TrackMatcher(self.track_library)
     elif serial_interface.is_track_section(recieved):
-      self.track_details.append(serial_interface.parse_track_section(recieved))
+      section = serial_interface.parse_track_section(recieved)
+      self.track = self.track.publish(sections = self.track.sections + snapshot.freeze_sections([ section ]))
+      if self.track_matcher != None:
+        self.set_current_track(self.track_matcher.add_section(section))
+    elif serial_interface.is_map_delta(recieved):
+      self.handle_map_delta(serial_interface.parse_map_delta(recieved))
     elif serial_interface.is_lap_time(recieved):
-      self.lap_times.append(serial_interface.parse_lap_time(recieved))
+      lap_time = serial_interface.parse_lap_time(recieved)
+      self.laps = self.laps.add(lap_time, stamp, self.max_laps)
+      track     = self.track
+      if len(track.sections) > 0 and not track.complete:
+        self.track = track.publish(complete = True)
+        if self.track_library != None:
+          self.set_current_track(self.track_library.add_track(track.sections))
+      if self.track_library != None and self.current_track != None:
+        self.track_library.add_lap(self.current_track, lap_time)
+    elif serial_interface.is_watch(recieved):
+      self.handle_watch(recieved)
     else:
       self.app.log('Unhandled BT Message: ' + str(recieved))
 
+  def handle_map_delta(self, delta):
+    '''
+    Patch the track details with the sections that changed since the last
+    map. Asks the device for the full map if a version was missed.
+    '''
+    track = self.track
+    if track.map_version == None or delta.version != track.map_version + 1:
+      self.app.log('Track map version {0} does not follow {1}, requesting the full map'.format(delta.version, track.map_version))
+      self.track = track.publish(map_version = None)
+      self.call_command('syncTrack')
+      return
+
+    if len(delta.changes) == 0 and delta.count == len(track.sections):
+      self.track = track.publish(map_version = delta.version) # The device drove the same map
+      return
+
+    sections = [ list(section) for section in track.sections ]
+    try:
+      serial_interface.apply_map_delta(sections, delta)
+    except ValueError as e:
+      self.app.log('Bad track map delta ({0}), requesting the full map'.format(e))
+      self.track = track.publish(map_version = None)
+      self.call_command('syncTrack')
+      return
+
+    # The changed map is looked up in the library again when the lap finishes
+    self.track = track.publish(sections = snapshot.freeze_sections(sections), complete = False, map_version = delta.version)
+
   def get_lap_times(self):
-    return self.lap_times
+    return self.laps.times
+
+  def get_lap_snapshot(self):
+    return self.laps
+
+  def get_clock(self):
+    '''
+    Get the clock synchronisation state of the connection, or None
+    '''
+    return self.bt.clock if self.bt != None else None
 
   def get_track_details(self):
-    return self.track_details
+    return self.track.sections
+
+  def get_track_snapshot(self):
+    return self.track
+
+  def set_section(self, index, kind, size):
+    '''
+    Change a section of the track map.
+    Track edits are applied by handle_incoming, in the order they were made.
+    Edits of a map that has been replaced by then are dropped.
+    '''
+    self.track_edits.append((self.track.map_version, index, (kind, size)))
+
+  def add_section(self, kind, size):
+    '''
+    Add a section to the end of the track map
+    '''
+    self.track_edits.append((self.track.map_version, None, (kind, size)))
+
+  def remove_section(self, index):
+    self.track_edits.append((self.track.map_version, index, None))
+
+  def __apply_track_edits(self):
+    if len(self.track_edits) == 0:
+      return
+    sections = list(self.track.sections)
+    while len(self.track_edits) > 0:
+      map_version, index, section = self.track_edits.popleft()
+      if map_version != self.track.map_version:
+        continue # The device sent a new map after the edit was made
+      if index == None:
+        sections.append(section)
+      elif index >= len(sections):
+        continue # The map was replaced after the edit was made
+      elif section == None:
+        del sections[index]
+      else:
+        sections[index] = section
+    self.track = self.track.publish(sections = tuple(sections))
+
+  def set_current_track(self, record):
+    '''
+    Set the track being driven. Does nothing if 'record' is None.
+    '''
+    if record == None or record is self.current_track:
+      return
+    self.current_track = record
+    self.app.log('Recognised track ' + record.summary())
 
   def is_connected(self):
     return self.bt != None and self.bt.connected
@@ -52,52 +259,94 @@ class RoadRunnerContext:
     return self.commands
 
   def get_variables(self):
-    return self.variables.keys()
+    return self.variables.snapshot.names()
+
+  def get_variable_snapshot(self):
+    return self.variables.snapshot
 
   def get_var_type(self, name):
-    return type(self.get_var(name))
+    return self.variables.get(name).type
 
   def get_var(self, name):
     '''
     Get the local value of a variable
     '''
-    return self.variables[name]
+    return self.variables.value(name)
+
+  def get_var_entry(self, name):
+    '''
+    Get the cache entry of a variable.
+    This includes the staleness and version details.
+    '''
+    return self.variables.get(name)
 
   def set_var(self, name, value, force=False):
     '''
     Set the local value of a variable
     '''
-    if (type(self.variables[name]) == type(value)):
-      sync = self.variables[name] != value
-      self.variables[name] = value
-      if sync or force:
-        self.sync_var(name, True)
+    entry = self.variables.get(name)
+    if entry.type == type(value):
+      if entry.value != value:
+        self.variables.set_local(name, value)
+        return self.sync_var(name, True)
+      elif force:
+        return self.sync_var(name, True)
+    return None
+
+  def set_vars(self, values):
+    '''
+    Set several variables on the device at once.
+    The set messages are queued together and sent back to back.
+    Returns the list of sent messages.
+    '''
+    messages = [ self.set_var(name, value, True) for name, value in values.items() ]
+    return [ message for message in messages if message != None ]
 
   def call_command(self, name):
     '''
-    Call a command on the device
+    Call a command on the device.
+    Returns the sent message, which can be awaited for the response.
     '''
-    self.send(
-      Message(serial_interface.call_command(name))
+    return self.send(
+      Message(self.call_packet(name))
         .on_response(lambda packet, response : None)
     )
 
+  def call_packet(self, name):
+    index = self.command_ids.get(name) if self.use_ids else None
+    return serial_interface.call_command(name) if index == None else serial_interface.call_command_id(index)
+
+  def set_packet(self, name, value):
+    index = self.variables.get(name).id if self.use_ids and name in self.variables else None
+    return serial_interface.set_var(name, value) if index == None else serial_interface.set_var_id(index, value)
+
+  def get_packet(self, name):
+    '''
+    Get the packet that fetches a variable, addressed by index if it is known
+    '''
+    index = self.variables.get(name).id if self.use_ids and name in self.variables else None
+    return serial_interface.get_var(name) if index == None else serial_interface.get_var_id(index)
+
   def sync_var(self, name, apply=False):
     '''
     Sync the variable state with the arduino value.
     If apply is True, the value in this app will be sent to the device.
     If apply is False, the value will be fetched from the arduino.
+    Returns the sent message, or None if nothing was sent.
     '''
     if apply:
       if name not in self.variables:
-        return
-      self.send(
-        Message(serial_interface.set_var(name, self.variables[name]))
-          .on_response(lambda sent, response: None)
+        return None
+      entry   = self.variables.get(name)
+      version = entry.version
+      return self.send(
+        Message(self.set_packet(name, entry.value))
+          .on_response(lambda sent, response: self.handle_set(name, version, response))
+          .on_done(lambda message: self.handle_set_timeout(name, version) if message.timed_out else None)
       )
     else:
-      self.send(
-        Message(serial_interface.get_var(name))
+      return self.send(
+        Message(self.get_packet(name))
           .on_response(self.handle_get)
       )
 
@@ -105,7 +354,7 @@ class RoadRunnerContext:
     '''
     Fetch the command list from the device
     '''
-    self.send(
+    return self.send(
       Message(serial_interface.list_commands())
         .on_response(self.handle_command_list)
     )
@@ -114,61 +363,193 @@ class RoadRunnerContext:
     '''
     Fetch the variable list from the device
     '''
-    self.send(
+    return self.send(
       Message(serial_interface.list_vars())
         .on_response(self.handle_variable_list)
     )
 
+  def upload_track_profile(self, targets):
+    '''
+    Upload a map with speed targets (speed_profile.SectionTarget) in one packet.
+    Returns the sent message.
+    '''
+    return self.send(
+      Message(serial_interface.upload_map(targets))
+        .on_response(lambda sent, response: self.handle_map_response(len(targets), response))
+    )
+
+  def handle_map_response(self, count, response):
+    loaded = serial_interface.parse_response_map(response)
+    if loaded != count:
+      self.app.log("Failed to upload the track profile: {0}".format(response))
+
+  def watch_var(self, name, period_ms):
+    '''
+    Ask the device to push the value of a variable every 'period_ms' milliseconds.
+    Returns the sent message.
+    '''
+    self.watches.add(name, period_ms)
+    return self.send(
+      Message(serial_interface.watch_var(name, period_ms))
+        .on_response(lambda sent, response: self.handle_watch_response(name, response))
+    )
+
+  def unwatch_var(self, name):
+    '''
+    Stop the device pushing the value of a variable.
+    Returns the sent message.
+    '''
+    self.watches.remove(name)
+    return self.send(
+      Message(serial_interface.unwatch_var(name))
+        .on_response(lambda sent, response: None)
+    )
+
+  def handle_watch_response(self, name, response):
+    if not serial_interface.response_is_watch(response):
+      self.app.log("Failed to watch {0}: {1}".format(name, response))
+      self.watches.remove(name)
+
+  def handle_watch(self, recieved):
+    time, values = serial_interface.parse_watch(recieved)
+    self.watches.add_samples(time, values)
+
+    # Watched values keep the variable cache up to date without a get
+    for name, value in values:
+      if name in self.variables:
+        var_type = self.variables.get(name).type
+        if var_type != None:
+          self.variables.set_device_value(name, var_type(value))
+
   def handle_command_list(self, sent, response):
     self.commands = serial_interface.parse_response_lscmd(response)
+    self.command_ids = { name: index for index, name in enumerate(self.commands) }
+
+
+  def refresh_stale_variables(self, now=None):
+    '''
+    Fetch the variables whose cached value has expired.
+    Returns the number of variables requested.
+    '''
+    if not self.is_connected():
+      return 0
+
+    # Skip variables that already have a request waiting for a response
+    stale = [ name for name in self.variables.stale(now) if not self.is_in_flight(self.get_packet(name)) ]
+    for name in stale:
+      self.sync_var(name)
+    return len(stale)
 
+  def is_in_flight(self, packet):
+    '''
+    Check if an identical request is queued or waiting for a response
+    '''
+    existing = self.in_flight.get(serial_interface.request_key(packet))
+    return existing != None and not existing.is_complete()
 
   def handle_variable_list(self, sent, response):
     if not serial_interface.response_is_lsvar(response):
       return
 
-    added = []
-    existing = []
+    # Keep cached variables that still exist on the remote device
+    self.variables.update_list(serial_interface.parse_response_lsvar(response))
 
-    # Added missing variables
-    for var_def in serial_interface.parse_response_lsvar(response):
-      name = var_def["name"]
-      var_type = var_def["type"]
+    # Fetch the value of variables that were added or have expired
+    self.refresh_stale_variables()
 
-      if name in self.variables:
-        var = self.variables[name]
-        if (isinstance(var, var_type)):
-          var = var_type()
-          existing.append(name)
-        else:
-          added.append(name)
-      else:
-        added.append(name)
+  def handle_set(self, name, version, response):
+    if serial_interface.response_is_set(response):
+      self.variables.acknowledge(name, version)
+    else:
+      self.app.log("Failed to set {0}: {1}".format(name, response))
+      self.rollback_var(name, version)
 
-    # Create a new dictionary, only containing the variables
-    # on the remote device
-    prev_vars = self.variables
-    self.variables = {}
-    for name in existing:
-      self.variables[name] = prev_vars[name]
+  def handle_set_timeout(self, name, version):
+    self.app.log("Failed to set {0}: no response".format(name))
+    self.rollback_var(name, version)
 
-    # Fetch the value of variables that were added
-    for var in added:
-      self.sync_var(var)
+  def rollback_var(self, name, version):
+    '''
+    Restore the last device value of a variable after a set failed, and fetch it again
+    '''
+    if self.variables.reject(name, version):
+      self.sync_var(name)
 
-      
   def handle_get(self, sent, response):
+    result = serial_interface.parse_response_get(response)
+    if result == None:
+      result = self.parse_get_id(response)
+    if result == None or result[1] is None:
+      print("Failed to get variable: {0}".format(response))
+      return
+    var_name, value = result
+    self.variables.set_device_value(var_name, value)
+
+  def parse_get_id(self, response):
+    '''
+    Get the (name, value) from an index addressed get response, or None
+    '''
+    result = serial_interface.parse_response_get_id(response)
+    if result == None:
+      return None
+    name = self.variables.name_of(result[0])
+    if name == None or self.variables.get(name).type == None:
+      return None
     try:
-      var_name, value = serial_interface.parse_response_get(response)
-      self.variables[var_name] = value
-    except Exception as e:
-      print("Failed to get variable: {0}".format(e))
+      return name, codec.parse_value(self.variables.get(name).type, result[1])
+    except ValueError:
+      return None
 
   def send(self, message):
+    '''
+    Send a message to the device.
+    Returns the message, or None if it could not be sent.
+    '''
     if self.bt == None:
       self.app.log([ "Failed to Send:", "Not Connected", "{" + str(message.packet) + "}" ], [imgui.Vec4(0.8, 0.3, 0.3, 1), None, imgui.Vec4(0.3, 0.8, 0.3, 1)])
-      return False
+      return None
+
+    if self.__merge_in_flight(message):
+      return message
 
     self.app.log([ "BT Send: ", str(message.packet)], [imgui.Vec4(0.3, 0.3, 0.8, 1), None])
     self.bt.enqueue_message(message)
-    return True
+    return message
+
+  def __merge_in_flight(self, message):
+    '''
+    Single-flight de-duplication of requests.
+
+    If an identical request is already queued or awaiting a response,
+    the message is attached to it instead of being sent again.
+    A set that has not been sent yet is replaced with the newer value.
+
+    Returns True if the message was merged with an existing request.
+    '''
+    key = serial_interface.request_key(message.packet)
+    if key == None:
+      return False
+
+    existing = self.in_flight.get(key)
+    if existing != None and not existing.is_complete():
+      if existing.packet == message.packet:
+        existing.attach(message)
+        self.app.log([ "BT Merged: ", str(message.packet)], [imgui.Vec4(0.3, 0.3, 0.8, 1), None])
+        return True
+
+      if serial_interface.is_set_request(message.packet) and not existing.sent:
+        self.app.log([ "BT Replaced: ", "{0} -> {1}".format(existing.packet, message.packet)], [imgui.Vec4(0.3, 0.3, 0.8, 1), None])
+        existing.packet = message.packet
+        existing.attach(message)
+        return True
+
+    self.in_flight[key] = message
+    message.on_done(lambda done: self.__remove_in_flight(key, done))
+    return False
+
+  def __remove_in_flight(self, key, message):
+    '''
+    Forget a request once it is answered or times out, unless a newer one has replaced it
+    '''
+    if self.in_flight.get(key) is message:
+      del self.in_flight[key]
@@ -0,0 +1,361 @@
+'''
+Conformance harness for the SerialCommands protocol.
+
+The golden transcript (transcripts/serial_commands.txt) has the exact bytes
+SerialCommands in the sketch sends in response to each request, starting from
+the values in sketch.ino. Replaying it against a transport checks the device
+on the other end byte for byte. Decoding every response in it with the codec
+checks the host parsers against the same bytes, so the sketch, the simulator
+and the host are all checked against one spec.
+
+Transcript lines:
+  # comment
+  > request       Sent to the device
+  < response      The expected response, exactly
+  ~ pattern       The expected response as a regular expression (e.g. for times)
+  = value         repr() of the value the codec decodes from the response
+  @ packet        A pushed packet, only checked with the codec
+  % ms            Service time of the response (written in recordings)
+Packets are written without the '\\0' terminator, using \\n, \\r, \\t, \\0 and \\\\ escapes.
+
+Transports:
+  sim             A SimulatedDevice
+  serial:<url>    A serial port, pty or pyserial URL (e.g. /dev/ttyACM0 or socket://host:port)
+  recorded:<path> The responses in a recorded transcript
+
+Every request is timed, from writing the request to reading the response.
+The median and 95th percentile service time of each command is printed, and
+the medians can be compared with a saved baseline to catch regressions.
+
+Usage:
+  python conformance.py check
+  python conformance.py replay sim --repeat 50 --save-baseline sim.json
+  python conformance.py replay sim --repeat 50 --baseline sim.json
+  python conformance.py replay serial:/dev/ttyACM0 --record session.txt
+  python conformance.py replay recorded:session.txt
+'''
+import argparse
+import json
+import os
+import re
+import time
+
+import codec
+import serial_interface
+
+DEFAULT_TRANSCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'transcripts', 'serial_commands.txt')
+
+ESCAPES   = { 'n': '\n', 'r': '\r', 't': '\t', '0': '\0', '\\': '\\' }
+UNESCAPES = { value: '\\' + key for key, value in ESCAPES.items() }
+
+def unescape(text):
+  result = ''
+  i      = 0
+  while i < len(text):
+    if text[i] == '\\' and i + 1 < len(text) and text[i + 1] in ESCAPES:
+      result += ESCAPES[text[i + 1]]
+      i += 2
+    else:
+      result += text[i]
+      i += 1
+  return result
+
+def escape(text):
+  return ''.join([ UNESCAPES.get(c, c) for c in text ])
+
+class Entry:
+  def __init__(self, line, request = None, push = None):
+    self.line     = line     # Line number in the transcript
+    self.request  = request  # Packet sent, or None for a push
+    self.push     = push     # Pushed packet
+    self.response = None     # Expected response
+    self.pattern  = None     # Expected response as a regular expression
+    self.value    = None     # repr() of the decoded response
+    self.time     = None     # Recorded service time in seconds
+
+  def packet(self):
+    '''
+    Get the packet the codec checks, or None
+    '''
+    return self.push if self.request == None else self.response
+
+def load_transcript(path):
+  '''
+  Read the entries of a transcript. Raises ValueError if it is malformed.
+  '''
+  entries = []
+  with open(path, 'r', encoding = 'utf-8') as f:
+    for number, line in enumerate(f, 1):
+      line = line.rstrip('\r\n')
+      if line.strip() == '' or line.startswith('#'):
+        continue
+      tag, text = line[:1], unescape(line[2:])
+      if tag == '>':
+        entries.append(Entry(number, request = text))
+        continue
+      if tag == '@':
+        entries.append(Entry(number, push = text))
+        continue
+
+      if len(entries) == 0 or tag not in '<~=%':
+        raise ValueError("{0}:{1}: unexpected line '{2}'".format(path, number, line))
+      entry = entries[-1]
+      if tag == '<':
+        entry.response = text
+      elif tag == '~':
+        entry.pattern = re.compile(text, re.DOTALL)
+      elif tag == '=':
+        entry.value = line[2:] # Compared with repr(), not unescaped
+      else:
+        entry.time = float(text) / 1000
+  return entries
+
+def save_transcript(path, results):
+  '''
+  Write a recording of a replay (a list of Result), which can be replayed with RecordedTransport
+  '''
+  with open(path, 'w', encoding = 'utf-8') as f:
+    f.write('# Recorded {0}\n'.format(time.strftime('%Y-%m-%d %H:%M:%S')))
+    for result in results:
+      f.write('> {0}\n'.format(escape(result.entry.request)))
+      if result.response != None:
+        f.write('< {0}\n'.format(escape(result.response)))
+      f.write('% {0:.3f}\n'.format(result.time * 1000))
+
+def command_name(request):
+  words = request.split()
+  return words[0].lower() if len(words) > 0 else ''
+
+def check_decoding(entries):
+  '''
+  Check the codec decodes every response and push in a transcript to the
+  expected value. Returns a list of failure messages.
+  '''
+  failures = []
+  for entry in entries:
+    packet = entry.packet()
+    if packet == None:
+      continue
+    try:
+      decoded = codec.decode(packet)
+    except ValueError as e:
+      failures.append('line {0}: {1}'.format(entry.line, e))
+      continue
+    if codec.packet_kind(packet) != decoded.kind:
+      failures.append('line {0}: packet_kind() is {1}, decode() is {2}'.format(entry.line, codec.packet_kind(packet), decoded.kind))
+    if entry.push != None and not codec.is_push(packet):
+      failures.append('line {0}: not recognised as a push'.format(entry.line))
+    if entry.value != None and repr(decoded.value) != entry.value:
+      failures.append('line {0}: decoded {1}, expected {2}'.format(entry.line, repr(decoded.value), entry.value))
+  return failures
+
+class SimTransport:
+  '''
+  Sends requests straight to a SimulatedDevice. Each replay starts with a new device.
+  '''
+  def __init__(self):
+    from sim.device import SimulatedDevice
+    self.device_type = SimulatedDevice
+    self.device      = None
+
+  def reset(self):
+    self.device = self.device_type()
+
+  def request(self, packet):
+    start    = time.perf_counter()
+    response = self.device.execute(packet)
+    return response, time.perf_counter() - start
+
+  def close(self):
+    pass
+
+class SerialTransport:
+  '''
+  Sends requests over a serial port (or anything pyserial opens from a URL).
+  Pushes, sensor stream frames and debug output are skipped while waiting for a response.
+  '''
+  def __init__(self, url, baudrate = 115200, timeout = 2.0):
+    import serial # Only needed for this transport
+    self.serial  = serial.serial_for_url(url, baudrate = baudrate, timeout = 0.01)
+    self.timeout = timeout
+    self.buffer  = bytearray()
+
+  def reset(self):
+    pass
+
+  def __read_packet(self, deadline):
+    '''
+    Read the next '\\0' terminated packet. Returns None on timeout.
+    '''
+    while True:
+      end = self.buffer.find(b'\0')
+      if end >= 0:
+        packet = bytes(self.buffer[:end])
+        del self.buffer[:end + 1]
+        return packet
+      if time.perf_counter() > deadline:
+        return None
+      self.buffer += self.serial.read(max(1, self.serial.in_waiting))
+
+  def request(self, packet):
+    start    = time.perf_counter()
+    deadline = start + self.timeout
+    self.serial.write(packet.encode('utf-8') + b'\0')
+    while True:
+      data = self.__read_packet(deadline)
+      if data == None:
+        return None, time.perf_counter() - start
+      if len(data) > 0 and data[0] == 0xFE:
+        continue # A sensor stream frame
+      recieved = data.decode('utf-8', errors = 'replace')
+      frame    = serial_interface.find_frame_start(recieved)
+      if frame < 0 or codec.is_push(recieved[frame:]):
+        continue
+      return recieved[frame:], time.perf_counter() - start
+
+  def close(self):
+    self.serial.close()
+
+class RecordedTransport:
+  '''
+  Answers requests with the responses in a recorded transcript, in order
+  '''
+  def __init__(self, path):
+    self.entries  = [ entry for entry in load_transcript(path) if entry.request != None ]
+    self.position = 0
+
+  def reset(self):
+    self.position = 0
+
+  def request(self, packet):
+    if self.position >= len(self.entries):
+      return None, 0.0
+    entry = self.entries[self.position]
+    self.position += 1
+    if entry.request != packet:
+      raise ValueError("Recording has '{0}' at line {1}, replaying '{2}'".format(escape(entry.request), entry.line, escape(packet)))
+    return entry.response, entry.time if entry.time != None else 0.0
+
+  def close(self):
+    pass
+
+def open_transport(name, baudrate = 115200, timeout = 2.0):
+  if name == 'sim':
+    return SimTransport()
+  if name.startswith('serial:'):
+    return SerialTransport(name[len('serial:'):], baudrate, timeout)
+  if name.startswith('recorded:'):
+    return RecordedTransport(name[len('recorded:'):])
+  raise ValueError("Unknown transport '{0}'. Expected sim, serial:<url> or recorded:<path>".format(name))
+
+class Result:
+  def __init__(self, entry, response, time):
+    self.entry    = entry
+    self.response = response
+    self.time     = time # Service time in seconds
+
+  def failure(self):
+    '''
+    Get a message describing how the response differs from the transcript, or None
+    '''
+    entry = self.entry
+    if self.response == None:
+      return "line {0}: no response to '{1}'".format(entry.line, escape(entry.request))
+    if entry.response != None and self.response != entry.response:
+      return "line {0}: '{1}' got '{2}', expected '{3}'".format(entry.line, escape(entry.request), escape(self.response), escape(entry.response))
+    if entry.pattern != None and entry.pattern.fullmatch(self.response) == None:
+      return "line {0}: '{1}' got '{2}', expected /{3}/".format(entry.line, escape(entry.request), escape(self.response), entry.pattern.pattern)
+    return None
+
+def replay(entries, transport):
+  '''
+  Send the requests in a transcript and get the Result of each
+  '''
+  transport.reset()
+  results = []
+  for entry in entries:
+    if entry.request != None:
+      response, seconds = transport.request(entry.request)
+      results.append(Result(entry, response, seconds))
+  return results
+
+def percentile(values, p):
+  ordered = sorted(values)
+  return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+def service_times(results):
+  '''
+  Get the { command: (count, median ms, p95 ms) } of the results
+  '''
+  times = {}
+  for result in results:
+    times.setdefault(command_name(result.entry.request), []).append(result.time * 1000)
+  return { name: (len(values), percentile(values, 0.5), percentile(values, 0.95)) for name, values in times.items() }
+
+def find_regressions(stats, baseline, tolerance, slack):
+  '''
+  Get the commands with a median service time more than 'tolerance' (a fraction)
+  slower than the baseline, ignoring differences under 'slack' ms
+  '''
+  regressions = []
+  for name, (count, median, p95) in sorted(stats.items()):
+    base = baseline.get(name)
+    if base != None and median > base * (1 + tolerance) and median - base > slack:
+      regressions.append('{0}: {1:.3f} ms, baseline {2:.3f} ms'.format(name, median, base))
+  return regressions
+
+def print_stats(stats, baseline):
+  print('{0:10} {1:>6} {2:>10} {3:>10} {4:>10}'.format('command', 'count', 'median ms', 'p95 ms', 'baseline'))
+  for name, (count, median, p95) in sorted(stats.items()):
+    base = '{0:.3f}'.format(baseline[name]) if name in baseline else '-'
+    print('{0:10} {1:6} {2:10.3f} {3:10.3f} {4:>10}'.format(name, count, median, p95, base))
+
+def main():
+  parser = argparse.ArgumentParser(description = 'Check a transport and the host codec against the golden SerialCommands transcript')
+  parser.add_argument('mode', choices = [ 'check', 'replay' ])
+  parser.add_argument('transport', nargs = '?', default = 'sim', help = 'sim, serial:<url> or recorded:<path>')
+  parser.add_argument('--transcript', default = DEFAULT_TRANSCRIPT)
+  parser.add_argument('--repeat', type = int, default = 1, help = 'Times to replay the transcript')
+  parser.add_argument('--baudrate', type = int, default = 115200)
+  parser.add_argument('--timeout', type = float, default = 2.0, help = 'Seconds to wait for each response')
+  parser.add_argument('--record', help = 'Write the responses of the first replay to a transcript')
+  parser.add_argument('--baseline', help = 'JSON file of median service times to compare with')
+  parser.add_argument('--save-baseline', help = 'Write the median service times to a JSON file')
+  parser.add_argument('--tolerance', type = float, default = 0.5, help = 'Fraction a median can be slower than the baseline')
+  parser.add_argument('--slack', type = float, default = 0.05, help = 'Differences under this many ms are not regressions')
+  args = parser.parse_args()
+
+  entries  = load_transcript(args.transcript)
+  failures = check_decoding(entries)
+  if args.mode == 'replay':
+    transport = open_transport(args.transport, args.baudrate, args.timeout)
+    results   = []
+    try:
+      for i in range(max(1, args.repeat)):
+        passed = replay(entries, transport)
+        if i == 0: # The other replays are only timed
+          failures += [ message for message in [ result.failure() for result in passed ] if message != None ]
+          if args.record != None:
+            save_transcript(args.record, passed)
+        results += passed
+    finally:
+      transport.close()
+
+    stats    = service_times(results)
+    baseline = {}
+    if args.baseline != None:
+      with open(args.baseline, 'r') as f:
+        baseline = json.load(f)
+    print_stats(stats, baseline)
+    failures += [ 'Slower than the baseline: ' + message for message in find_regressions(stats, baseline, args.tolerance, args.slack) ]
+    if args.save_baseline != None:
+      with open(args.save_baseline, 'w') as f:
+        json.dump({ name: median for name, (count, median, p95) in stats.items() }, f, indent = 2, sort_keys = True)
+
+  for message in failures:
+    print(message)
+  print('{0} entries, {1} failures'.format(len(entries), len(failures)))
+  exit(1 if len(failures) > 0 else 0)
+
+if __name__ == '__main__':
+  main()
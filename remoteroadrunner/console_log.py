@@ -0,0 +1,330 @@
+'''
+The console log, with an inverted index for searching it.
+
+Every record is split into tokens (lower case words, keeping a trailing '+'
+so 'ERR+' is not the 'err' variable) when it is appended, and the index maps
+each token to the IDs of the records containing it. Record IDs only ever
+increase, so the ID lists stay sorted without sorting them. A search
+intersects the ID lists of the query tokens, starting with the shortest. The
+last token of a query also matches tokens it is the start of, so the results
+are useful while the query is being typed.
+
+Records also have a category (where they came from) and a severity, which can
+be used to narrow a search. Both are worked out from the text of the record
+when the caller does not give them, and are indexed like tokens.
+
+When old records are removed their IDs are left in the index and skipped by
+searches. The ID lists are cleaned up a few tokens at a time as new records
+are appended, so removing records never stalls the console.
+
+LogFilter keeps the result of a search up to date as records are appended,
+by checking only the new records, so the console only searches the index
+when the filter changes.
+'''
+import bisect
+import itertools
+import re
+
+CATEGORIES = [ 'input', 'send', 'recv', 'device', 'app' ]
+SEVERITIES = [ 'info', 'warning', 'error' ]
+
+TOKEN = re.compile('[a-z0-9_]+\\+?')
+
+COMPACT_STEP = 16 # Tokens cleaned up for each record appended after records are removed
+
+SEND_PREFIXES    = ( 'BT Send', 'BT Merged', 'BT Replaced', 'Failed to Send' )
+ERROR_PREFIXES   = ( 'Failed', 'Exception', 'ERR+' )
+WARNING_PREFIXES = ( 'Bad ', 'Unhandled', 'Track map version' )
+
+def tokenize(text):
+  return TOKEN.findall(text.lower())
+
+def classify(text):
+  '''
+  Get the (category, severity) of a log message from its text
+  '''
+  if text.startswith('> '):
+    category = 'input'
+  elif text.startswith(SEND_PREFIXES):
+    category = 'send'
+  elif ' Recv:' in text[:16]:
+    category = 'recv'
+  elif text.startswith('Device:'):
+    category = 'device'
+  else:
+    category = 'app'
+
+  # Responses are logged after the link name, e.g. 'BT Recv: ERR+Unknown Command'
+  if text.startswith(ERROR_PREFIXES) or 'ERR+' in text[:24]:
+    severity = 'error'
+  elif text.startswith(WARNING_PREFIXES):
+    severity = 'warning'
+  else:
+    severity = 'info'
+  return category, severity
+
+class LogRecord:
+  __slots__ = [ 'id', 'parts', 'text', 'category', 'severity', 'lines' ]
+
+  def __init__(self, id, parts, text, category, severity):
+    self.id       = id
+    self.parts    = parts    # [ { 'col': colour or None, 'text': text } ] drawn by the console
+    self.text     = text     # Text that is searched (the parts without the time stamp)
+    self.category = category
+    self.severity = severity
+    self.lines    = max([ part['text'].count('\n') + 1 for part in parts ] + [ 1 ])
+
+class Query:
+  '''
+  A parsed search. 'categories' and 'severities' are sets of the allowed
+  values, or None to allow all of them.
+  '''
+  def __init__(self, text = '', categories = None, severities = None):
+    tokens          = tokenize(text)
+    self.text       = text
+    self.tokens     = tokens[:-1] # Matched exactly
+    self.prefix     = tokens[-1] if len(tokens) > 0 else None
+    self.categories = frozenset(categories) if categories != None else None
+    self.severities = frozenset(severities) if severities != None else None
+
+  def key(self):
+    return (tuple(self.tokens), self.prefix, self.categories, self.severities)
+
+  def is_empty(self):
+    return self.prefix == None and self.categories == None and self.severities == None
+
+  def allows(self, record):
+    '''
+    Check if a record is in the categories and severities of the query
+    '''
+    return (self.categories == None or record.category in self.categories) and \
+           (self.severities == None or record.severity in self.severities)
+
+  def matches(self, record):
+    '''
+    Check a single record, without the index
+    '''
+    if not self.allows(record):
+      return False
+    if self.prefix == None:
+      return True
+    tokens = set(tokenize(record.text))
+    if any([ token not in tokens and token + '+' not in tokens for token in self.tokens ]):
+      return False
+    return any([ token.startswith(self.prefix) for token in tokens ])
+
+class ConsoleLog:
+  def __init__(self, limit = 20000):
+    self.limit    = limit # Records kept. Old records are removed in blocks of a tenth of the limit.
+    self.records  = []    # LogRecord of each record kept, oldest first
+    self.next_id  = 0     # ID of the next record appended
+    self.trimmed  = 0     # Number of times old records were removed (or the log was cleared)
+    self.postings = {}    # Token -> IDs of the records containing it. May include removed records.
+    self.vocab    = []    # Sorted tokens, for prefix searches
+    self.stale    = []    # Tokens that may have IDs of removed records
+    self.facet_ids = {}   # (category, severity) -> IDs of the records kept
+
+  def __len__(self):
+    return len(self.records)
+
+  def __iter__(self):
+    return iter(self.records)
+
+  @property
+  def first_id(self):
+    return self.records[0].id if len(self.records) > 0 else self.next_id
+
+  def category_count(self, category):
+    return sum([ len(ids) for (c, s), ids in self.facet_ids.items() if c == category ])
+
+  def severity_count(self, severity):
+    return sum([ len(ids) for (c, s), ids in self.facet_ids.items() if s == severity ])
+
+  def get(self, id):
+    '''
+    Get a record by its ID, or None if it was removed
+    '''
+    index = id - self.first_id
+    return self.records[index] if 0 <= index < len(self.records) else None
+
+  def since(self, id):
+    '''
+    Get the records with IDs from 'id' on
+    '''
+    return self.records[max(0, id - self.first_id):]
+
+  def append(self, parts, text = None, category = None, severity = None):
+    '''
+    Add a record. 'text' is the text to search, by default the text of every part.
+    Returns the LogRecord.
+    '''
+    text = text if text != None else ' '.join([ part['text'] for part in parts ])
+    if category == None or severity == None:
+      found    = classify(text)
+      category = category if category != None else found[0]
+      severity = severity if severity != None else found[1]
+
+    record = LogRecord(self.next_id, parts, text, category, severity)
+    self.next_id += 1
+    self.records.append(record)
+    self.facet_ids.setdefault((category, severity), []).append(record.id)
+
+    for token in set(tokenize(text)):
+      ids = self.postings.get(token)
+      if ids == None:
+        ids = self.postings[token] = []
+        bisect.insort(self.vocab, token)
+      ids.append(record.id)
+
+    if len(self.records) > self.limit:
+      self.trim(len(self.records) - self.limit + self.limit // 10)
+    elif len(self.stale) > 0:
+      self.__compact(COMPACT_STEP)
+    return record
+
+  def trim(self, count):
+    '''
+    Remove the oldest 'count' records
+    '''
+    del self.records[:count]
+    self.trimmed += 1
+    first = self.first_id
+    for ids in self.facet_ids.values():
+      del ids[:bisect.bisect_left(ids, first)]
+    self.stale = list(self.postings.keys())
+
+  def __compact(self, count):
+    '''
+    Remove the IDs of removed records from the lists of some stale tokens
+    '''
+    first = self.first_id
+    for token in self.stale[-count:]:
+      ids = self.postings[token]
+      del ids[:bisect.bisect_left(ids, first)]
+      if len(ids) == 0:
+        del self.postings[token]
+        del self.vocab[bisect.bisect_left(self.vocab, token)]
+    del self.stale[-count:]
+
+  def clear(self):
+    self.trim(len(self.records))
+    self.postings = {}
+    self.vocab    = []
+    self.stale    = []
+
+  def __live(self, ids):
+    '''
+    Get the IDs of records that have not been removed
+    '''
+    if len(self.stale) == 0 or len(ids) == 0 or ids[0] >= self.first_id:
+      return ids
+    return ids[bisect.bisect_left(ids, self.first_id):]
+
+  def __token_ids(self, token):
+    '''
+    Get the IDs of records with a token. 'ok' also finds 'OK+'.
+    '''
+    ids  = self.__live(self.postings.get(token, []))
+    plus = self.postings.get(token + '+')
+    if plus == None or token.endswith('+'):
+      return ids
+    return sorted(itertools.chain(ids, self.__live(plus)))
+
+  def __prefix_ids(self, prefix):
+    '''
+    Get the sorted IDs of records with a token starting with 'prefix'
+    '''
+    start  = bisect.bisect_left(self.vocab, prefix)
+    end    = bisect.bisect_left(self.vocab, prefix + '\x7f')
+    tokens = self.vocab[start:end]
+    if len(tokens) == 1:
+      return self.__live(self.postings[tokens[0]])
+    ids = set()
+    for token in tokens:
+      ids.update(self.__live(self.postings[token]))
+    return sorted(ids)
+
+  def __facet_lists(self, query):
+    '''
+    Get the ID lists of the (category, severity) pairs a query allows, and of the ones it does not
+    '''
+    allowed, other = [], []
+    for (category, severity), ids in self.facet_ids.items():
+      if (query.categories == None or category in query.categories) and (query.severities == None or severity in query.severities):
+        allowed.append(ids)
+      else:
+        other.append(ids)
+    return allowed, other
+
+  def search(self, query):
+    '''
+    Get the IDs of the records matching a Query, oldest first
+    '''
+    faceted = query.categories != None or query.severities != None
+    lists   = [ self.__token_ids(token) for token in query.tokens ]
+    if query.prefix != None:
+      lists.append(self.__prefix_ids(query.prefix))
+    if len(lists) == 0:
+      if not faceted:
+        return [ record.id for record in self.records ]
+      allowed, _ = self.__facet_lists(query)
+      return sorted(itertools.chain(*allowed)) # Each list is already sorted, which the sort makes use of
+
+    lists.sort(key = len)
+    candidates = lists[0]
+    for ids in lists[1:]:
+      if len(candidates) == 0:
+        break
+      others     = set(ids)
+      candidates = [ id for id in candidates if id in others ]
+    if not faceted:
+      return list(candidates)
+
+    # Use a set of whichever is smaller, the records the facets allow or the ones they do not
+    allowed, other = self.__facet_lists(query)
+    if sum([ len(ids) for ids in allowed ]) <= sum([ len(ids) for ids in other ]):
+      keep = set(itertools.chain(*allowed))
+      return [ id for id in candidates if id in keep ]
+    drop = set(itertools.chain(*other))
+    return [ id for id in candidates if id not in drop ]
+
+class LogFilter:
+  '''
+  The IDs of the records matching a query, kept up to date as records are appended
+  '''
+  def __init__(self):
+    self.query   = Query()
+    self.ids     = []   # IDs of the matching records, oldest first
+    self.scanned = 0    # ID of the next record to check
+    self.trimmed = None # ConsoleLog.trimmed when the IDs were last checked
+    self.key     = None # Query.key() the IDs were found for
+
+  def set_query(self, text = '', categories = None, severities = None):
+    self.query = Query(text, categories, severities)
+
+  def is_active(self):
+    return not self.query.is_empty()
+
+  def update(self, log):
+    '''
+    Bring the matching IDs up to date. The index is only searched if the query changed.
+    Returns True if matches were removed or replaced (rather than only added).
+    '''
+    key = self.query.key()
+    if key != self.key:
+      self.ids     = log.search(self.query)
+      self.key     = key
+      self.scanned = log.next_id
+      self.trimmed = log.trimmed
+      return True
+
+    for record in log.since(self.scanned):
+      if self.query.matches(record):
+        self.ids.append(record.id)
+    self.scanned = log.next_id
+
+    if self.trimmed != log.trimmed:
+      self.trimmed = log.trimmed
+      del self.ids[:bisect.bisect_left(self.ids, log.first_id)]
+      return True
+    return False
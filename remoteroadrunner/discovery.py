@@ -0,0 +1,201 @@
+'''
+Bluetooth device discovery.
+
+Advertisements from the scanner update a table of devices indexed by address
+(and by name, for fast-connect). Known devices are updated in place, their
+RSSI smoothed with an exponential moving average. Devices that have not been
+seen for a while are evicted, and the table never grows past a fixed size.
+
+Listeners are not called for every advertisement. Changes are collected and
+passed to the listeners at most every 'notify_interval' seconds by update(),
+so a busy area full of advertising devices does not flood the app.
+'''
+import asyncio
+import time
+
+class DiscoveredDevice:
+  def __init__(self, name, address, manufacturer, rssi, now):
+    self.name         = name.strip() if len(name.strip()) > 0 else "Unknown"
+    self.address      = address
+    self.manufacturer = manufacturer
+    self.rssi         = rssi # Smoothed signal strength in dBm, or None if unknown
+    self.last_rssi    = rssi
+    self.first_seen   = now
+    self.last_seen    = now
+    self.count        = 1    # Advertisements recieved
+
+  def detailed(self):
+    rssi = ' {0:.0f} dBm'.format(self.rssi) if self.rssi != None else ''
+    return "{0} [{1}][addr: {2}]{3}".format(self.name, self.manufacturer, self.address, rssi)
+
+  def matches(self, name = None, address = None):
+    '''
+    Check if the device matches a name and address filter (case insensitive substrings)
+    '''
+    if name != None and name.lower() not in self.name.lower():
+      return False
+    if address != None and address.lower() not in self.address.lower():
+      return False
+    return True
+
+class DeviceTable:
+  def __init__(self, smoothing = 0.3, ttl = 30.0, max_devices = 500, notify_interval = 0.25):
+    self.smoothing       = smoothing       # Weight of the newest RSSI in the average
+    self.ttl             = ttl             # Seconds a device is kept after it was last seen
+    self.max_devices     = max_devices
+    self.notify_interval = notify_interval # Minimum seconds between notifications
+    self.devices   = {} # Address -> DiscoveredDevice
+    self.names     = {} # Lower case name -> set of addresses
+    self.version   = 0  # Incremented when a device is added, removed or changed
+    self.listeners = [] # Functions called with (added, removed) lists of devices
+    self.waiters   = [] # [ name, address, future ] of wait_for calls
+    self.added     = [] # Devices added since the last notification
+    self.removed   = [] # Devices removed since the last notification
+    self.last_notify = 0
+    self.last_evict  = 0
+
+  def __len__(self):
+    return len(self.devices)
+
+  def __contains__(self, address):
+    return address in self.devices
+
+  def get(self, address):
+    return self.devices.get(address)
+
+  def find_name(self, name):
+    '''
+    Get the devices with a name (case insensitive)
+    '''
+    return [ self.devices[address] for address in self.names.get(name.lower(), ()) ]
+
+  def add_listener(self, listener):
+    self.listeners.append(listener)
+
+  def remove_listener(self, listener):
+    if listener in self.listeners:
+      self.listeners.remove(listener)
+
+  def observe(self, name, address, rssi = None, manufacturer = "Unknown", now = None):
+    '''
+    Record an advertisement. Returns the device.
+    '''
+    now    = now if now != None else time.time()
+    device = self.devices.get(address)
+    if device == None:
+      device = DiscoveredDevice(name, address, manufacturer, rssi, now)
+      if len(self.devices) >= self.max_devices:
+        self.__remove(min(self.devices.values(), key = lambda d: d.last_seen))
+      self.devices[address] = device
+      self.names.setdefault(device.name.lower(), set()).add(address)
+      self.added.append(device)
+      self.version += 1
+    else:
+      device.last_seen = now
+      device.count    += 1
+      device.last_rssi = rssi
+      if rssi != None:
+        device.rssi = rssi if device.rssi == None else device.rssi + (rssi - device.rssi) * self.smoothing
+      self.version += 1
+
+    self.__wake_waiters(device)
+    return device
+
+  def __remove(self, device):
+    del self.devices[device.address]
+    addresses = self.names.get(device.name.lower())
+    if addresses != None:
+      addresses.discard(device.address)
+      if len(addresses) == 0:
+        del self.names[device.name.lower()]
+    self.removed.append(device)
+    self.version += 1
+
+  def evict(self, now = None):
+    '''
+    Remove devices that have not been seen for 'ttl' seconds
+    '''
+    now   = now if now != None else time.time()
+    stale = [ device for device in self.devices.values() if now - device.last_seen > self.ttl ]
+    for device in stale:
+      self.__remove(device)
+    return stale
+
+  def clear(self):
+    for device in list(self.devices.values()):
+      self.__remove(device)
+
+  def update(self, now = None):
+    '''
+    Evict stale devices and notify the listeners of the changes since the
+    last notification, if 'notify_interval' has passed
+    '''
+    now = now if now != None else time.time()
+    if now - self.last_evict >= min(1.0, self.ttl):
+      self.last_evict = now
+      self.evict(now)
+
+    if now - self.last_notify < self.notify_interval:
+      return
+    if len(self.added) == 0 and len(self.removed) == 0:
+      return
+    self.last_notify = now
+    # Devices added and removed within the same batch are not reported
+    added   = [ device for device in self.added if self.devices.get(device.address) is device ]
+    new     = set([ id(device) for device in self.added ])
+    removed = [ device for device in self.removed if id(device) not in new ]
+    self.added, self.removed = [], []
+    for listener in self.listeners:
+      listener(added, removed)
+
+  def view(self, name = None, address = None):
+    '''
+    Get the devices matching a filter, strongest signal first
+    '''
+    devices = [ d for d in self.devices.values() if d.matches(name, address) ]
+    return sorted(devices, key = lambda d: -d.rssi if d.rssi != None else 0)
+
+  def wait_for(self, name = None, address = None, timeout = None):
+    '''
+    Wait until a device matching a filter is seen. A device already in the
+    table matches immediately. Returns the device, or None on timeout.
+    '''
+    for device in self.devices.values():
+      if self.__is_target(device, name, address):
+        return self.__done(device)
+
+    future = asyncio.get_event_loop().create_future()
+    waiter = [ name, address, future ]
+    self.waiters.append(waiter)
+    return self.__wait(waiter, timeout)
+
+  async def __done(self, device):
+    return device
+
+  async def __wait(self, waiter, timeout):
+    try:
+      return await asyncio.wait_for(waiter[2], timeout)
+    except asyncio.TimeoutError:
+      return None
+    finally:
+      if waiter in self.waiters:
+        self.waiters.remove(waiter)
+
+  def __is_target(self, device, name, address):
+    '''
+    Targets are matched exactly, so 'roadrunner' does not connect to 'roadrunner2'
+    '''
+    if name != None and device.name.lower() != name.lower():
+      return False
+    if address != None and device.address.lower() != address.lower():
+      return False
+    return True
+
+  def __wake_waiters(self, device):
+    if len(self.waiters) == 0:
+      return
+    for waiter in list(self.waiters):
+      name, address, future = waiter
+      if not future.done() and self.__is_target(device, name, address):
+        future.set_result(device)
+        self.waiters.remove(waiter)
@@ -0,0 +1,202 @@
+'''
+Automated experiments on the robot.
+
+An experiment applies each variable assignment in a matrix, drives a number
+of laps and records the lap and section times pushed by the device.
+
+Usage (console):
+  experiment experiment.json results.csv
+
+Where experiment.json looks like:
+  {
+    "matrix": { "srtSpd": [ 200, 240 ], "P": [ 4.0, 4.5 ] },
+    "laps": 3,
+    "repeats": 2,
+    "order": "random"
+  }
+'''
+import asyncio
+import csv
+import itertools
+import json
+import random
+import time
+import serial_interface
+
+SEQUENTIAL  = 'sequential'  # Run all repeats of a condition before the next condition
+INTERLEAVED = 'interleaved' # Run every condition once, then repeat
+RANDOM      = 'random'      # Like interleaved, but shuffled within each repeat
+ORDERS = [ SEQUENTIAL, INTERLEAVED, RANDOM ]
+
+def expand_matrix(matrix):
+  '''
+  Get the list of conditions (variable assignments) for a matrix.
+
+  The matrix is either a dict of variable name -> list of values, in which
+  case every combination is used, or a list of assignment dicts.
+  '''
+  if isinstance(matrix, dict):
+    names = list(matrix.keys())
+    return [ dict(zip(names, values)) for values in itertools.product(*[ matrix[name] for name in names ]) ]
+  return [ dict(condition) for condition in matrix ]
+
+def schedule(count, repeats, order = INTERLEAVED, seed = 0):
+  '''
+  Get the order to run 'count' conditions 'repeats' times in.
+  Returns a list of condition indices.
+
+  Interleaving (and randomising within each block) spreads the conditions
+  over the session so slow changes like battery drain affect them equally.
+  '''
+  if order == SEQUENTIAL:
+    return [ i for i in range(count) for _ in range(repeats) ]
+
+  rng    = random.Random(seed)
+  trials = []
+  for _ in range(repeats):
+    block = list(range(count))
+    if order == RANDOM:
+      rng.shuffle(block)
+    trials += block
+  return trials
+
+class LapResult:
+  def __init__(self, trial, condition, lap, lap_time, sections):
+    self.trial     = trial     # Index in the schedule
+    self.condition = condition # Index of the condition
+    self.lap       = lap       # Lap number within the trial
+    self.lap_time  = lap_time  # Seconds
+    self.sections  = sections  # List of [type, size] sections recorded during the lap
+
+class Experiment:
+  def __init__(self, context, matrix, laps = 3, repeats = 1, order = INTERLEAVED, seed = 0,
+               start_command = 'drive', stop_command = 'stop', lap_timeout = 120.0):
+    if order not in ORDERS:
+      raise ValueError("Unknown order '{0}'. Expected one of {1}".format(order, ORDERS))
+
+    self.context       = context
+    self.conditions    = expand_matrix(matrix)
+    self.laps          = laps
+    self.order         = schedule(len(self.conditions), repeats, order, seed)
+    self.start_command = start_command
+    self.stop_command  = stop_command
+    self.lap_timeout   = lap_timeout # Give up on a trial if a lap takes longer than this
+    self.results       = []
+    self.completed     = asyncio.Queue() # (lap time, sections) for each lap pushed by the device
+    self.on_progress   = None           # Called with a message after each lap
+
+  def __on_push(self, recieved):
+    if serial_interface.is_lap_time(recieved):
+      # The map pushed before the lap (in full or as a delta) has already been applied by the context
+      sections = [ list(section) for section in self.context.get_track_details() ]
+      self.completed.put_nowait((serial_interface.parse_lap_time(recieved), sections))
+
+  def __progress(self, text):
+    if self.on_progress != None:
+      self.on_progress(text)
+
+  async def __apply(self, condition):
+    '''
+    Send every assignment in one batch and wait for the device to accept them
+    '''
+    values = {}
+    for name, value in condition.items():
+      if name not in self.context.get_variables() or self.context.get_var_type(name) == None:
+        raise ValueError("Unknown variable '{0}'".format(name))
+      values[name] = self.context.get_var_type(name)(value) # e.g. JSON ints used for float variables
+
+    messages = self.context.set_vars(values)
+    if len(messages) != len(values):
+      raise ValueError("Cannot set {0}".format(condition))
+
+    responses = await asyncio.gather(*messages)
+    failed    = [ r for r in responses if not serial_interface.response_is_set(r) ]
+    if len(failed) > 0:
+      raise RuntimeError("Failed to apply {0}: {1}".format(condition, failed))
+
+  async def __call(self, name):
+    message = self.context.call_command(name)
+    if message == None:
+      raise RuntimeError("Not connected")
+    response = await message
+    if not serial_interface.response_is_call(response):
+      raise RuntimeError("Failed to call '{0}': {1}".format(name, response))
+
+  async def run_trial(self, trial, index):
+    condition = self.conditions[index]
+    await self.__apply(condition)
+
+    # Laps that finished before the condition was applied are not counted
+    while not self.completed.empty():
+      self.completed.get_nowait()
+
+    await self.__call(self.start_command)
+    try:
+      for lap in range(self.laps):
+        lap_time, sections = await asyncio.wait_for(self.completed.get(), self.lap_timeout)
+        self.results.append(LapResult(trial, index, lap, lap_time, sections))
+        self.__progress("Trial {0}/{1} lap {2}/{3}: {4:.3f}s {5}".format(
+          trial + 1, len(self.order), lap + 1, self.laps, lap_time, condition))
+    finally:
+      await self.__call(self.stop_command)
+
+  async def run(self):
+    '''
+    Run every trial in the schedule.
+    Returns the list of LapResults.
+    '''
+    self.context.add_push_listener(self.__on_push)
+    try:
+      for trial, index in enumerate(self.order):
+        await self.run_trial(trial, index)
+    finally:
+      self.context.remove_push_listener(self.__on_push)
+    return self.results
+
+  def variable_names(self):
+    names = []
+    for condition in self.conditions:
+      names += [ name for name in condition if name not in names ]
+    return names
+
+  def write_csv(self, path):
+    '''
+    Write one row per lap, with the assignment and section times
+    '''
+    names        = self.variable_names()
+    max_sections = max([ len(r.sections) for r in self.results ] + [ 0 ])
+    with open(path, 'w', newline = '') as csv_file:
+      writer = csv.writer(csv_file)
+      writer.writerow([ 'trial', 'condition' ] + names + [ 'lap', 'lap_time' ]
+        + [ 'sec{0}_{1}'.format(i, field) for i in range(max_sections) for field in [ 'type', 'size' ] ])
+      for r in self.results:
+        condition = self.conditions[r.condition]
+        writer.writerow([ r.trial, r.condition ] + [ condition.get(name, '') for name in names ]
+          + [ r.lap, '{0:.3f}'.format(r.lap_time) ] + [ value for section in r.sections for value in section ])
+
+  def summary(self):
+    '''
+    Get the mean and standard deviation of the lap time for each condition
+    '''
+    lines = []
+    for index, condition in enumerate(self.conditions):
+      times = [ r.lap_time for r in self.results if r.condition == index ]
+      if len(times) == 0:
+        continue
+      mean = sum(times) / len(times)
+      std  = (sum([ (t - mean) ** 2 for t in times ]) / max(len(times) - 1, 1)) ** 0.5
+      lines.append("{0}: {1:.3f}s +/- {2:.3f}s ({3} laps)".format(condition, mean, std, len(times)))
+    return '\n'.join(lines)
+
+def load_experiment(context, path):
+  '''
+  Load an experiment from a JSON file (see the module docstring)
+  '''
+  with open(path) as experiment_file:
+    desc = json.load(experiment_file)
+  return Experiment(context, desc['matrix'],
+    laps        = desc.get('laps', 3),
+    repeats     = desc.get('repeats', 1),
+    order       = desc.get('order', INTERLEAVED),
+    seed        = desc.get('seed', int(time.time())),
+    lap_timeout = desc.get('lap_timeout', 120.0))
@@ -0,0 +1,189 @@
+'''
+Gateway mode.
+
+Owns the single connection to the robot and shares it with several
+dashboards over TCP. Requests from every client are multiplexed into
+the one message queue of the connection, and packets pushed by the robot
+(newtrack, sec, mapd, lap) are fanned out to all clients.
+
+Each request from a client starts with a sequence number, and its response
+is sent back with the same number (see tcp_link.TCPConnection). If the
+robot does not answer, the client is sent tcp_link.TIMEOUT_ERROR. Pushes
+are tagged with tcp_link.PUSH_MARKER instead.
+
+Usage:
+  python gateway.py --ble 64:69:4E:7B:5E:0B
+  python gateway.py --serial /dev/ttyACM0 --host 0.0.0.0 --port 8765
+
+Dashboards connect with the 'connect_gateway <host> [port]' console command.
+'''
+import argparse
+import asyncio
+import collections
+from datetime import datetime
+
+import serial_link
+import tcp_link
+from commands import RoadRunnerContext
+from message import Message
+
+class GatewayClient:
+  '''
+  A dashboard connected to the gateway.
+
+  Outgoing packets are queued and written by a separate task so a slow
+  client never blocks the robot link. When the queue is full, the oldest
+  pushed packet is dropped. Responses to the clients own requests are never dropped.
+  '''
+  def __init__(self, gateway, reader, writer, max_queued):
+    self.gateway    = gateway
+    self.reader     = reader
+    self.writer     = writer
+    self.max_queued = max_queued
+    self.outgoing   = collections.deque() # Queued (is_push, packet) pairs
+    self.ready      = asyncio.Event()
+    self.running    = True
+    self.dropped    = 0                   # Number of pushed packets dropped for this client
+    self.name       = str(writer.get_extra_info('peername'))
+
+  def push(self, packet):
+    '''
+    Queue a packet pushed by the device
+    '''
+    if len(self.outgoing) >= self.max_queued:
+      self.__drop_oldest_push()
+    self.outgoing.append((True, packet))
+    self.ready.set()
+
+  def respond(self, sequence, packet):
+    '''
+    Queue the response to a request made by this client
+    '''
+    self.outgoing.append((False, '{0} {1}'.format(sequence, packet)))
+    self.ready.set()
+
+  def forward(self, sequence, packet):
+    '''
+    Send a request from the client to the device. The response, or an
+    error if the device does not answer, is tagged with 'sequence'.
+    '''
+    message = Message(packet).on_response(lambda sent, response: self.respond(sequence, response))
+    message.on_done(lambda done: self.respond(sequence, tcp_link.TIMEOUT_ERROR) if done.timed_out else None)
+    if self.gateway.context.send(message) == None:
+      self.respond(sequence, tcp_link.NOT_CONNECTED_ERROR)
+
+  def __drop_oldest_push(self):
+    for i, (is_push, _) in enumerate(self.outgoing):
+      if is_push:
+        del self.outgoing[i]
+        self.dropped += 1
+        return
+
+  async def read_task(self):
+    '''
+    Forward requests from the client to the device
+    '''
+    try:
+      while self.running:
+        packet = await self.reader.readuntil(b'\0')
+        sequence, _, packet = packet[:-1].decode('utf-8').partition(' ')
+        if not sequence.isdigit():
+          self.gateway.log("Dropped a request without a sequence number from {0}".format(self.name))
+          continue
+
+        self.forward(sequence, packet)
+    except (asyncio.IncompleteReadError, ConnectionError):
+      pass
+    self.close()
+
+  async def write_task(self):
+    '''
+    Write queued packets to the client
+    '''
+    try:
+      while self.running:
+        await self.ready.wait()
+        self.ready.clear()
+        while len(self.outgoing) > 0:
+          is_push, packet = self.outgoing.popleft()
+          if isinstance(packet, str):
+            packet = packet.encode('utf-8') # Sensor stream frames are already bytes
+          if is_push:
+            packet = tcp_link.PUSH_MARKER + packet
+          self.writer.write(packet + b'\0')
+          await self.writer.drain()
+    except ConnectionError:
+      pass
+    self.close()
+
+  def close(self):
+    if not self.running:
+      return
+    self.running = False
+    self.ready.set()
+    self.writer.close()
+    self.gateway.remove_client(self)
+
+class Gateway:
+  def __init__(self, max_queued = 256):
+    self.context    = RoadRunnerContext(self)
+    self.clients    = []
+    self.max_queued = max_queued # Max packets queued for a single client
+    self.running    = True
+    self.context.add_push_listener(self.__on_push)
+    self.context.add_frame_listener(self.__on_push)
+
+  def log(self, message, color=None):
+    if isinstance(message, list):
+      message = ' '.join([ str(part) for part in message ])
+    print("[{0}] {1}".format(datetime.now().time(), message))
+
+  def __on_push(self, packet):
+    for client in self.clients:
+      client.push(packet)
+
+  def remove_client(self, client):
+    if client in self.clients:
+      self.clients.remove(client)
+      self.log("Client disconnected: {0} ({1} pushes dropped)".format(client.name, client.dropped))
+
+  async def __on_client(self, reader, writer):
+    client = GatewayClient(self, reader, writer, self.max_queued)
+    self.clients.append(client)
+    self.log("Client connected: {0}".format(client.name))
+    await asyncio.gather(client.read_task(), client.write_task())
+
+  async def run(self, host, port):
+    server = await asyncio.start_server(self.__on_client, host, port)
+    self.log("Gateway listening on {0}:{1}".format(host, port))
+    async with server:
+      while self.running:
+        self.context.handle_incoming()
+        await asyncio.sleep(0.001)
+
+async def main():
+  parser = argparse.ArgumentParser(description = 'Share one robot connection between several dashboards')
+  parser.add_argument('--ble',    help = 'Bluetooth address of the robot')
+  parser.add_argument('--serial', help = 'Serial port connected to the robot')
+  parser.add_argument('--baud',   type = int, default = serial_link.DEFAULT_BAUDRATE)
+  parser.add_argument('--host',   default = '127.0.0.1')
+  parser.add_argument('--port',   type = int, default = tcp_link.DEFAULT_PORT)
+  parser.add_argument('--max-queued', type = int, default = 256, help = 'Pushed packets queued per client before the oldest are dropped')
+  args = parser.parse_args()
+
+  gateway = Gateway(args.max_queued)
+  if args.serial != None:
+    await gateway.context.connect_serial(args.serial, args.baud)
+  elif args.ble != None:
+    await gateway.context.connect(args.ble)
+  else:
+    parser.error('Either --ble or --serial is required')
+
+  if gateway.context.bt.connect_failed():
+    gateway.log("Failed to connect to the robot")
+    return
+
+  await gateway.run(args.host, args.port)
+
+if __name__=="__main__":
+  asyncio.run(main())
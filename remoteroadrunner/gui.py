@@ -1,11 +1,19 @@
+import bisect
 import math
 import sys
+import time
 from serial_interface import *
 import imgui
 import PIL
 from PIL import Image
 import numpy
 from OpenGL import GL, GLU
+import sensor_stream
+import metrics
+import profiler
+import console_log
+import sim.track
+from datetime import datetime
 
 class Texture:
   def __init__(self, path):
@@ -35,6 +43,241 @@ class Texture:
     GL.glBindTexture(GL.GL_TEXTURE_2D, 0)
 
 
+# Colour of each sensor value in the heat strip (dark blue -> red -> yellow)
+HEAT_COLOURS = numpy.stack([
+  numpy.clip(numpy.linspace(0, 3, 256), 0, 1),
+  numpy.clip(numpy.linspace(0, 3, 256) - 1.5, 0, 1),
+  numpy.clip(0.5 - numpy.linspace(0, 1, 256), 0, 1),
+  numpy.ones(256)
+], axis = 1)
+HEAT_COLOURS = (HEAT_COLOURS * 255).astype(numpy.uint8)
+
+class HeatStripTexture:
+  '''
+  A texture with one column per sensor sample and one row per sensor.
+
+  Columns are written in a ring, so new samples are uploaded with
+  glTexSubImage2D and the strip scrolls by offsetting the texture coordinates.
+  '''
+  def __init__(self, columns, rows):
+    self.columns  = columns
+    self.rows     = rows
+    self.uploaded = 0 # Number of samples uploaded
+    self.id = GL.glGenTextures(1)
+    GL.glPixelStorei(GL.GL_UNPACK_ALIGNMENT, 1)
+    GL.glBindTexture(GL.GL_TEXTURE_2D, self.id)
+    GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MAG_FILTER, GL.GL_NEAREST)
+    GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MIN_FILTER, GL.GL_LINEAR)
+    GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_WRAP_S, GL.GL_REPEAT)
+    GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_WRAP_T, GL.GL_CLAMP_TO_EDGE)
+    GL.glTexImage2D(GL.GL_TEXTURE_2D, 0, GL.GL_RGBA, columns, rows, 0,
+        GL.GL_RGBA, GL.GL_UNSIGNED_BYTE, numpy.zeros((rows, columns, 4), dtype = numpy.uint8))
+    GL.glBindTexture(GL.GL_TEXTURE_2D, 0)
+
+  def update(self, stream):
+    '''
+    Upload the samples recieved since the last update
+    '''
+    if stream.count < self.uploaded:
+      self.uploaded = 0 # The stream was cleared
+
+    count = min(stream.count - self.uploaded, self.columns)
+    if count <= 0:
+      return
+
+    samples = stream.latest(count)
+    first   = (stream.count - count) % self.columns
+    GL.glBindTexture(GL.GL_TEXTURE_2D, self.id)
+    while len(samples) > 0:
+      width  = min(len(samples), self.columns - first)
+      pixels = numpy.ascontiguousarray(HEAT_COLOURS[samples[:width].T]) # (rows, width, 4)
+      GL.glTexSubImage2D(GL.GL_TEXTURE_2D, 0, first, 0, width, self.rows, GL.GL_RGBA, GL.GL_UNSIGNED_BYTE, pixels)
+      samples = samples[width:]
+      first   = 0
+    GL.glBindTexture(GL.GL_TEXTURE_2D, 0)
+    self.uploaded = stream.count
+
+  def draw(self, width, height):
+    # The newest sample is on the right
+    start = (self.uploaded % self.columns) / self.columns
+    imgui.image(self.id, width, height, uv0=(start, 0), uv1=(start + 1, 1))
+
+class TrackMapView:
+  '''
+  Draws the centre line of the track, built from the track details.
+
+  Sections are added to the geometry as they arrive. Points are converted to
+  screen space once and cached, only the points of new sections are converted
+  each frame. Points closer together than 'min_spacing' pixels are skipped,
+  so the number of vertices drawn depends on the size of the view rather
+  than the length of the track.
+  '''
+  def __init__(self, min_spacing = 2.0, margin = 0.1):
+    self.min_spacing  = min_spacing
+    self.margin       = margin # Fraction of the view left empty around the track
+    self.geometry     = sim.track.TrackGeometry()
+    self.version      = -1     # Track version the geometry was built for
+    self.closed       = None   # Geometry of the last complete track, with the loop closed
+    self.closed_chunks   = []
+    self.closed_distance = None # Distance along the closed track of each point
+    self.vertices     = []     # Screen space points
+    self.vertex_starts = [ 0 ] # First vertex of each chunk
+    self.source       = None   # Chunks the vertices were made from
+    self.rect         = None   # Screen rectangle the vertices were made for
+    self.transform    = None   # (scale, x offset, y offset) from metres to pixels
+    self.bounds       = None   # Area of the track that fits in the view, in metres
+
+  def update(self, context):
+    '''
+    Bring the geometry up to date with the track details
+    '''
+    track = context.get_track_snapshot()
+    if self.version == track.version:
+      return
+    self.version = track.version
+
+    # Keep the sections that have not changed and add the rest
+    details = track.sections
+    built   = self.geometry.sections
+    common  = 0
+    while common < min(len(built), len(details)) and tuple(built[common]) == details[common]:
+      common += 1
+    if common < len(built):
+      self.geometry.truncate(common)
+      self.source = None # Converted vertices are out of date
+    for section in details[common:]:
+      self.geometry.append(list(section))
+
+    if track.complete:
+      self.closed = sim.track.build_track(self.geometry.sections, self.geometry.spacing)
+      points = self.closed.closed_points()
+      self.closed_chunks   = [ points ]
+      seg = numpy.linalg.norm(numpy.diff(points, axis = 0), axis = 1)
+      self.closed_distance = numpy.concatenate([ [ 0 ], numpy.cumsum(seg) ])
+
+  def is_closed(self):
+    '''
+    Check if the closed track is shown. It is still shown while the device
+    resends the same track, until a section is different.
+    '''
+    if self.closed is None:
+      return False
+    sections = self.geometry.sections
+    return sections == self.closed.sections[:len(sections)]
+
+  def __to_screen(self, points, stride):
+    scale, x, y = self.transform
+    picked = points[::stride]
+    if (len(points) - 1) % stride != 0:
+      picked = numpy.concatenate([ picked, points[-1:] ])
+    xs = x + picked[:, 0] * scale
+    ys = y - picked[:, 1] * scale # Screen y points down
+    return list(zip(xs.tolist(), ys.tolist()))
+
+  def __stride(self):
+    return max(1, int(self.min_spacing / (self.geometry.spacing * self.transform[0])))
+
+  def __fit(self, chunks, rect):
+    '''
+    Pick the transform so the track fits in the view.
+    An unfinished track is given room to grow so the view does not change with every section.
+    '''
+    points = numpy.concatenate(chunks)
+    low    = points.min(axis = 0)
+    high   = points.max(axis = 0)
+    size   = numpy.maximum(high - low, 0.1)
+    grow   = 0.0 if chunks is self.closed_chunks else 0.5
+    low    = low  - size * grow / 2
+    high   = high + size * grow / 2
+    self.bounds = (low, high)
+
+    x, y, width, height = rect
+    usable = (1 - 2 * self.margin)
+    scale  = min(width * usable / (high[0] - low[0]), height * usable / (high[1] - low[1]))
+    centre = (low + high) / 2
+    self.transform = (scale, x + width / 2 - centre[0] * scale, y + height / 2 + centre[1] * scale)
+
+  def __in_bounds(self, points):
+    low, high = self.bounds
+    return numpy.all(points.min(axis = 0) >= low) and numpy.all(points.max(axis = 0) <= high)
+
+  def update_vertices(self, rect):
+    chunks  = self.closed_chunks if self.is_closed() else self.geometry.chunks
+    done    = len(self.vertex_starts) - 1 # Chunks already converted
+    rebuild = chunks is not self.source or rect != self.rect or done > len(chunks)
+    if not rebuild:
+      for chunk in chunks[done:]:
+        rebuild = rebuild or not self.__in_bounds(chunk)
+
+    if rebuild:
+      self.__fit(chunks, rect)
+      self.source        = chunks
+      self.rect          = rect
+      self.vertices      = []
+      self.vertex_starts = [ 0 ]
+      done = 0
+
+    stride = self.__stride()
+    for chunk in chunks[done:]:
+      self.vertices += self.__to_screen(chunk, stride)
+      self.vertex_starts.append(len(self.vertices))
+
+  def section_vertices(self, index):
+    '''
+    Get the vertices of a section, or an empty list
+    '''
+    if self.source is self.closed_chunks:
+      # The closed track is one chunk, so use the point indices of the sections
+      starts = self.closed.starts
+      if index + 2 >= len(starts):
+        return []
+      stride = self.__stride()
+      return self.vertices[(starts[index + 1] - 1) // stride:(starts[index + 2] - 1) // stride + 2]
+    if index + 2 >= len(self.vertex_starts):
+      return []
+    return self.vertices[self.vertex_starts[index + 1] - 1:self.vertex_starts[index + 2]]
+
+  def position(self, context, now = None):
+    '''
+    Get the estimated screen position of the robot, from the time since the last lap finished.
+    Returns None if the position is unknown.
+    '''
+    last = context.get_lap_snapshot().last()
+    if not self.is_closed() or last == None:
+      return None
+    lap_time, stamp = last
+    if stamp == None or lap_time <= 0:
+      return None
+
+    now     = time.time() if now is None else now
+    elapsed = (now - stamp.host) / lap_time
+    if elapsed < 0 or elapsed > 2: # The robot has probably stopped
+      return None
+
+    distance = (elapsed % 1) * self.closed_distance[-1]
+    index    = min(int(numpy.searchsorted(self.closed_distance, distance)), len(self.closed_distance) - 1)
+    point    = self.closed_chunks[0][index]
+    scale, x, y = self.transform
+    return (x + point[0] * scale, y - point[1] * scale)
+
+  def draw(self, context, x, y, width, height, highlight = -1):
+    self.update(context)
+    if len(self.geometry.sections) == 0:
+      return
+    self.update_vertices((x, y, width, height))
+
+    draw_list = imgui.get_window_draw_list()
+    draw_list.add_polyline(self.vertices, imgui.get_color_u32_rgba(0.2, 0.2, 0.2, 1), closed = False, thickness = 3)
+    if highlight >= 0:
+      draw_list.add_polyline(self.section_vertices(highlight), imgui.get_color_u32_rgba(0.9, 0.5, 0.1, 1), closed = False, thickness = 5)
+
+    start = self.vertices[0]
+    draw_list.add_circle_filled(start[0], start[1], 5, imgui.get_color_u32_rgba(0.3, 0.8, 0.3, 1))
+    robot = self.position(context)
+    if robot != None:
+      draw_list.add_circle_filled(robot[0], robot[1], 7, imgui.get_color_u32_rgba(0.9, 0.2, 0.2, 1))
+
+
 class Window:
   def __init__(self, ui, x, y, width, height, name):
     self.name   = name
@@ -45,6 +288,8 @@ class Window:
     self.ui     = ui
     self.app    = ui.app
     self.flags  = 0
+    self.visible  = True
+    self.position_cond = imgui.ALWAYS # When the position and size are applied
 
   def add_flags(self, flags):
     self.flags = self.flags|flags
@@ -56,8 +301,8 @@ class Window:
     self.flags = self.flags & ~flags
 
   def __begin(self):
-    imgui.set_next_window_position(self.x, self.y)
-    imgui.set_next_window_size    (self.width, self.height)
+    imgui.set_next_window_position(self.x, self.y, self.position_cond)
+    imgui.set_next_window_size    (self.width, self.height, self.position_cond)
     imgui.begin(self.name, flags=self.flags)
 
   def __end(self):
@@ -67,9 +312,13 @@ class Window:
     pass
 
   def draw(self):
+    if not self.visible:
+      return
+    start = time.perf_counter()
     self.__begin()
     self.on_draw()
     self.__end()
+    self.ui.profile.add(self.name, time.perf_counter() - start, 'draw')
 
 class CommandWindow(Window):
   def __init__(self, ui, x, y, width, height):
@@ -95,24 +344,51 @@ class VariableWindow(Window):
   def __init__(self, ui, x, y, width, height):
     super(VariableWindow, self).__init__(ui, x, y, width, height, "Variables")
 
-  def show_var(self, name):
+  def show_staleness(self, entry):
+    '''
+    Draw a marker showing how up to date the cached value is
+    '''
+    if entry.is_pending():
+      imgui.text_colored('*', 0.9, 0.7, 0.0, 1)
+    elif entry.is_stale(self.app.context.variables.ttl):
+      imgui.text_colored('~', 0.8, 0.3, 0.3, 1)
+    else:
+      imgui.text_colored('o', 0.3, 0.8, 0.3, 1)
+
+    if imgui.is_item_hovered():
+      age = entry.age()
+      age_text = 'never fetched' if age is None else 'fetched {0:.1f}s ago'.format(age)
+      imgui.set_tooltip('{0} (v{1}, ack {2}, {3})'.format(age_text, entry.version, entry.ack_seq, entry.source))
+
+  def show_var(self, entry):
+    name = entry.name
     imgui.push_id(name)
+    self.show_staleness(entry)
+    imgui.same_line()
+
     force = imgui.button("resend")
 
     imgui.same_line()
+    if imgui.button("watch"):
+      self.app.watch_variable(name)
 
-    val = self.app.context.get_var(name)
+    imgui.same_line()
+
+    val = entry.value
     changed = False
+    new_val = val
     if isinstance(val, float):
       changed, new_val = imgui.input_float(name, val)
     elif isinstance(val, bool):
       changed, new_val = imgui.checkbox(name,    val)
     elif isinstance(val, int):
       changed, new_val = imgui.input_int(name,   val)
+    elif val is None:
+      imgui.text('Fetching: ' + name)
     else:
       imgui.text('Unknown: ' + name)
 
-    if not imgui.is_item_active():
+    if val is not None and not imgui.is_item_active():
       self.app.context.set_var(name, new_val, force)
 
     imgui.pop_id()
@@ -120,8 +396,8 @@ class VariableWindow(Window):
   def on_draw(self):
     style = imgui.get_style()
     imgui.begin_child("VarList", 0, -20 - style.item_spacing.y * 2, True)
-    for var_name in self.app.context.get_variables():
-      self.show_var(var_name)
+    for entry in self.app.context.get_variable_snapshot():
+      self.show_var(entry)
     imgui.end_child()
 
     width = imgui.get_window_content_region_width()
@@ -130,19 +406,216 @@ class VariableWindow(Window):
 
 
 
+class WatchWindow(Window):
+  '''
+  Live plots of the variables pushed by the device
+  '''
+  def __init__(self, ui, x, y, width, height):
+    super(WatchWindow, self).__init__(ui, x, y, width, height, "Watch")
+    self.history = 10.0 # Seconds of history to plot
+    self.plots   = {}   # Name -> (key, values) of the last decimated plot
+    self.position_cond = imgui.FIRST_USE_EVER
+    self.visible = False
+
+  def show_series(self, series):
+    imgui.push_id(series.name)
+    latest = series.latest()
+    if imgui.button("x"):
+      self.app.unwatch_variable(series.name)
+    imgui.same_line()
+    imgui.text("{0}: {1}".format(series.name, "-" if latest is None else "{0:.4f}".format(latest)))
+
+    width   = imgui.get_window_content_region_width()
+    samples = int(self.history * 1000 / max(series.period, 1))
+    buckets = max(1, int(width) // 2)
+
+    # Only decimate again when new samples arrive or the plot changes
+    key    = (series.total, samples, buckets)
+    cached = self.plots.get(series.name)
+    if cached != None and cached[0] == key:
+      values = cached[1]
+    else:
+      values = series.decimate(samples, buckets)
+      self.plots[series.name] = (key, values)
+    if len(values) > 0:
+      imgui.plot_lines("##plot", values, graph_size=(width, 60))
+    imgui.pop_id()
+
+  def on_draw(self):
+    _, self.history = imgui.slider_float("History (s)", self.history, 1, 600)
+    imgui.separator()
+    for name in list(self.app.context.watches.names()):
+      self.show_series(self.app.context.watches.get(name))
+
+
+class SensorWindow(Window):
+  '''
+  Scrolling heat strip of the sensor array stream
+  '''
+  def __init__(self, ui, x, y, width, height):
+    super(SensorWindow, self).__init__(ui, x, y, width, height, "Sensors")
+    self.position_cond = imgui.FIRST_USE_EVER
+    self.visible = False
+    self.period  = 10
+    self.strip   = None # Created when first drawn
+
+  def on_draw(self):
+    stream = self.app.context.sensors
+    if self.strip == None:
+      self.strip = HeatStripTexture(len(stream.samples), sensor_stream.SENSOR_COUNT)
+    self.strip.update(stream)
+
+    _, self.period = imgui.input_int("Period (ms)", self.period)
+    self.period = max(1, self.period)
+    for name, link in [ ("Off", sensor_stream.STREAM_OFF), ("Bluetooth", sensor_stream.STREAM_BLUETOOTH), ("Wired", sensor_stream.STREAM_WIRED) ]:
+      if imgui.button(name):
+        self.app.stream_sensors(link, self.period)
+      imgui.same_line()
+    imgui.new_line()
+
+    samples_per_sec, bytes_per_sec = stream.rates()
+    imgui.text("{0:.0f} samples/s  {1:.0f} B/s".format(samples_per_sec, bytes_per_sec))
+    imgui.text("Recieved: {0}  Dropped: {1} ({2:.1f}%)  Bad frames: {3}".format(
+      stream.count, stream.dropped, stream.drop_ratio() * 100, stream.bad))
+
+    width = imgui.get_window_content_region_width()
+    self.strip.draw(width, max(imgui.get_content_region_available()[1], 20))
+
+
+class MetricsWindow(Window):
+  '''
+  Overlay of the values in the metrics registry
+  '''
+  def __init__(self, ui, x, y, width, height):
+    super(MetricsWindow, self).__init__(ui, x, y, width, height, "Metrics")
+    self.position_cond = imgui.FIRST_USE_EVER
+    self.visible = False
+    self.add_flags(imgui.WINDOW_NO_FOCUS_ON_APPEARING)
+
+  def on_draw(self):
+    registry = metrics.REGISTRY
+    _, registry.enabled = imgui.checkbox("Enabled", registry.enabled)
+    if self.app.metrics_path != None:
+      imgui.same_line()
+      imgui.text("Writing to '{0}'".format(self.app.metrics_path))
+    imgui.separator()
+
+    imgui.columns(2)
+    for metric in list(registry.metrics.values()):
+      imgui.text(metric.name + metric.label_text())
+      imgui.next_column()
+      imgui.text(metric.summary())
+      imgui.next_column()
+    imgui.columns(1)
+
+
+class ProfilerWindow(Window):
+  '''
+  Time spent on each part of a frame, compared to the frame budget
+  '''
+  def __init__(self, ui, x, y, width, height):
+    super(ProfilerWindow, self).__init__(ui, x, y, width, height, "Profiler")
+    self.position_cond = imgui.FIRST_USE_EVER
+    self.visible = False
+
+  def show_timing(self, timing, indent):
+    profile = self.ui.profile
+    imgui.text(' ' * indent + timing.name)
+    imgui.next_column()
+    imgui.text("{0:.2f} ms (peak {1:.2f})".format(timing.average * 1000, timing.peak * 1000))
+    imgui.next_column()
+    imgui.progress_bar(min(1.0, timing.average / profile.budget), (-1, 0), "{0:.0f}%".format(timing.average / profile.budget * 100))
+    imgui.next_column()
+    for child in profile.children(timing.name):
+      self.show_timing(child, indent + 2)
+
+  def on_draw(self):
+    profile = self.ui.profile
+    frame   = profile.timings.get('frame')
+    if frame == None:
+      return
+
+    imgui.text("Budget: {0:.1f} ms  Frame: {1:.2f} ms (peak {2:.2f})".format(profile.budget * 1000, frame.average * 1000, frame.peak * 1000))
+    imgui.text("Over budget: {0} of {1} frames".format(profile.over_budget, profile.frames))
+    imgui.same_line()
+    if imgui.button("Reset"):
+      profile.reset_peaks()
+    imgui.separator()
+
+    imgui.columns(3)
+    for timing in profile.children():
+      if timing.name != 'frame':
+        self.show_timing(timing, 0)
+    imgui.columns(1)
+
+
 class ConnectionWindow(Window):
   def __init__(self, ui, x, y, width, height):
     super(ConnectionWindow, self).__init__(ui, x, y, width, height, "Device List")
+    self.rows          = [] # Devices listed, strongest signal first
+    self.rows_version  = -1 # DeviceTable.version the rows were built from
+    self.rows_filter   = None
+    self.rows_built    = 0
+    self.filter_text   = ""
+
+  def update_rows(self):
+    '''
+    Rebuild the device list when the table has changed, at most
+    once every notify interval
+    '''
+    devices = self.app.devices
+    now     = time.time()
+    if devices.version == self.rows_version and self.app.device_filter == self.rows_filter:
+      return
+    if now - self.rows_built < devices.notify_interval and self.app.device_filter == self.rows_filter:
+      return
+    self.rows         = devices.view(self.app.device_filter)
+    self.rows_version = devices.version
+    self.rows_filter  = self.app.device_filter
+    self.rows_built   = now
   
+  def show_link_stats(self):
+    '''
+    Show the round trip time and clock synchronisation state
+    '''
+    clock = self.app.context.get_clock()
+    if clock == None or clock.srtt == None:
+      imgui.text("Link: -")
+      return
+
+    imgui.text("RTT: {0:.1f} ms (min {1:.1f}) jitter: {2:.1f} ms".format(clock.srtt * 1000, clock.min_rtt * 1000, clock.jitter() * 1000))
+    imgui.text("Timeout: {0:.0f} ms".format(self.app.context.bt.response_timeout() * 1000))
+    if clock.is_synced():
+      imgui.text("Clock: {0:+.1f} ppm +/- {1:.1f} ms".format(clock.drift * 1e6, clock.uncertainty() * 1000))
+    else:
+      imgui.text("Clock: not synchronised")
+
   def on_draw(self):
     style = imgui.get_style()
-    imgui.begin_child("DeviceList", 0, -20 - style.item_spacing.y * 2, True)
-    for addr, device in self.app.devices.items():
-      changed, other = imgui.selectable(device.detailed(), addr == self.app.connected_device)
+    stats_height = 3 * imgui.get_text_line_height_with_spacing()
+    changed, self.filter_text = imgui.input_text("Filter", self.filter_text, 64)
+    if changed:
+      self.app.device_filter = self.filter_text if self.filter_text != "" else None
+
+    imgui.begin_child("DeviceList", 0, -20 - style.item_spacing.y * 2 - stats_height, True)
+
+    # Only draw the devices that are scrolled into view
+    self.update_rows()
+    line_height = imgui.get_text_line_height_with_spacing()
+    first = max(0, int(imgui.get_scroll_y() / line_height))
+    last  = min(len(self.rows), first + int(imgui.get_window_height() / line_height) + 1)
+    if first > 0:
+      imgui.dummy(1, first * line_height)
+    for device in self.rows[first:last]:
+      changed, other = imgui.selectable(device.detailed(), device.address == self.app.connected_device)
       if changed:
-        self.app.connect(addr)
+        self.app.connect(device.address)
+    if last < len(self.rows):
+      imgui.dummy(1, (len(self.rows) - last) * line_height)
     imgui.end_child()
 
+    self.show_link_stats()
+
     width = imgui.get_window_content_region_width()
     if self.app.is_scanning:
       if imgui.button("stop scanning", width):
@@ -161,17 +634,80 @@ class ConsoleWindow(Window):
     self.auto_scroll = True
     self.last_log_count = 0
     self.grab_focus = take_focus
+    self.filter      = console_log.LogFilter()
+    self.filter_text = ""
+    self.categories  = { category: True for category in console_log.CATEGORIES } # Categories shown
+    self.severities  = { severity: True for severity in console_log.SEVERITIES }
+    self.line_starts = [ 0 ] # First line of each row, plus the total line count
+    self.filtered    = False # True if the rows are the filter matches rather than every record
+    self.line_trims  = 0     # ConsoleLog.trimmed when line_starts was built
   
   def take_focus(self):
     self.grab_focus = True
 
+  def show_filter(self):
+    '''
+    Draw the search box and the category and severity facets
+    '''
+    log = self.app.console_log
+    imgui.push_item_width(200)
+    _, self.filter_text = imgui.input_text("Filter", self.filter_text, 128)
+    imgui.pop_item_width()
+    for facets, count in [ (self.categories, log.category_count), (self.severities, log.severity_count) ]:
+      for name in facets:
+        imgui.same_line()
+        _, facets[name] = imgui.checkbox("{0} ({1})##{0}".format(name, count(name)), facets[name])
+
+    categories = None if all(self.categories.values()) else [ name for name, shown in self.categories.items() if shown ]
+    severities = None if all(self.severities.values()) else [ name for name, shown in self.severities.items() if shown ]
+    self.filter.set_query(self.filter_text, categories, severities)
+
+  def update_line_starts(self):
+    '''
+    Count the lines of the rows added since the last frame.
+    Only the records matching the filter are rows.
+    '''
+    log   = self.app.console_log
+    reset = self.line_trims != log.trimmed or self.filtered != self.filter.is_active()
+    if self.filter.is_active():
+      reset |= self.filter.update(log)
+    if reset:
+      self.line_starts = [ 0 ] # The log was cleared or trimmed, or the filter changed
+      self.line_trims  = log.trimmed
+      self.filtered    = self.filter.is_active()
+
+    if self.filtered:
+      for id in self.filter.ids[len(self.line_starts) - 1:]:
+        self.line_starts.append(self.line_starts[-1] + log.get(id).lines)
+    else:
+      for record in log.records[len(self.line_starts) - 1:]:
+        self.line_starts.append(self.line_starts[-1] + record.lines)
+
+  def row(self, index):
+    log = self.app.console_log
+    return log.get(self.filter.ids[index]) if self.filtered else log.records[index]
+
   def on_draw(self):
     style = imgui.get_style()
+    self.show_filter()
     imgui.begin_child("ConsoleLog", 0, -20 - imgui.get_text_line_height_with_spacing() - style.item_spacing.y * 2, True)
-    # Draw all the log entries
-    for entry in self.app.console_log:
+
+    # Only draw the rows that are scrolled into view
+    self.update_line_starts()
+    row_count   = len(self.line_starts) - 1
+    line_height = imgui.get_text_line_height_with_spacing()
+    first_line  = int(imgui.get_scroll_y() / line_height)
+    last_line   = first_line + int(imgui.get_window_height() / line_height) + 1
+    first = max(0, bisect.bisect_right(self.line_starts, first_line) - 1)
+    last  = min(row_count, bisect.bisect_right(self.line_starts, last_line))
+    total_lines = self.line_starts[-1]
+
+    if first > 0:
+      imgui.dummy(1, self.line_starts[first] * line_height)
+
+    for index in range(first, last):
       # Each log consists of multiple parts, so that bits can be coloured differently
-      for part in entry:
+      for part in self.row(index).parts:
         # Try apply the colour
         has_col = "col" in part and part["col"] != None
         if has_col:
@@ -185,9 +721,11 @@ class ConsoleWindow(Window):
           imgui.pop_style_color()
         imgui.same_line()
       imgui.new_line()
-          
 
-    log_count = len(self.app.console_log)
+    if last < row_count:
+      imgui.dummy(1, (total_lines - self.line_starts[last]) * line_height)
+
+    log_count = self.app.console_log.next_id
     if self.auto_scroll and self.last_log_count != log_count:
       imgui.set_scroll_here()
     self.last_log_count = log_count
@@ -249,59 +787,50 @@ class TrackMapWindow(Window):
 
     self.hovered_track  = -1
     self.selected_track = -1
-    self.full_loop = False;
-    self.leftTex     = Texture('assets/left-turn.png')
-    self.rightTex    = Texture('assets/right-turn.png')
-    self.straightTex = Texture('assets/straight.png')
-
-  def draw_section_bt(self, name, texture, time):
-    window_width = imgui.get_window_content_region_width()
-
-    # Draw the background button
-    pos = imgui.get_cursor_pos()
-    imgui.button(' ', width=window_width, height=84)
-    next_pos = imgui.get_cursor_pos()
-
-    # Draw the button internal bits
-    imgui.set_cursor_pos((pos.x + 10, pos.y + 10))
-    imgui.image(texture.id, 64, 64, uv0=(0, 1), uv1=(1, 0))
-    imgui.same_line()
-    imgui.text(name)
-
-    # Set the cursor to the correct position after the button
-    imgui.set_cursor_pos(next_pos)
+    self.map_view = TrackMapView()
 
   def on_draw(self):
-    # Get the draw list so we can do some custom drawing
-    pos    = imgui.get_window_position()
-    size   = imgui.get_window_size()
-    center = imgui.Vec2(pos.x + size.x / 2, pos.y + size.y / 2)
-
-    imgui.begin_child('map-preview', 0, size.y * 0.7)
-
-    count = 0;
-    for section in self.app.context.get_track_details():
-      imgui.push_id(str(count))
-      if section[0] == STRAIGHT: self.draw_section_bt('Straight',   self.straightTex, section[1])
-      elif section[0] == RTURN:  self.draw_section_bt('Right Turn', self.rightTex,    section[1])
-      elif section[0] == LTURN:  self.draw_section_bt('Left Turn',  self.leftTex,     section[1])
-      imgui.pop_id()
-      count = count + 1
-
+    size = imgui.get_window_size()
+
+    # Draw the track map in a child window
+    imgui.begin_child('map-preview', 0, size.y * 0.7, True)
+    pos  = imgui.get_window_position()
+    area = imgui.get_window_size()
+    highlight = self.hovered_track if self.hovered_track >= 0 else self.selected_track
+    self.map_view.draw(self.app.context, pos.x, pos.y, area.x, area.y, highlight)
     imgui.end_child()
 
     imgui.new_line()
     
     imgui.separator()
+    track = self.app.context.current_track
+    if track != None:
+      imgui.text('Track: ' + track.summary())
+
+    # Speed targets for the (possibly edited) track details
+    if imgui.button('Optimise Profile'):
+      self.app.process_console('optimise_profile')
+    imgui.same_line()
+    if imgui.button('Upload Profile'):
+      self.app.process_console('upload_profile')
+    imgui.same_line()
+    if imgui.button('React to Track'):
+      self.app.process_console('follow_profile 0')
     imgui.columns(2)
     imgui.text('Lap Times')
     imgui.begin_child('lap-times', 0.5, 0, True)
     counter = 1
     imgui.columns(2)
-    for time in self.app.context.get_lap_times():
+    laps = self.app.context.get_lap_snapshot()
+    lap_stamps = laps.stamps
+    for i, lap_time in enumerate(laps.times):
       imgui.text(str(counter))
       imgui.next_column()
-      imgui.text(str(time) + 's')
+      imgui.text(str(lap_time) + 's')
+      if imgui.is_item_hovered() and i < len(lap_stamps) and lap_stamps[i] != None:
+        stamp = lap_stamps[i]
+        device_text = '' if stamp.device is None else ' (device {0:.3f}s)'.format(stamp.device)
+        imgui.set_tooltip('Finished at {0}{1}'.format(datetime.fromtimestamp(stamp.host).time(), device_text))
       imgui.next_column()
       counter = counter + 1
     imgui.columns(1)
@@ -314,7 +843,8 @@ class TrackMapWindow(Window):
     imgui.columns(2)
 
     self.hovered_track = -1
-    for i, detail in enumerate(self.app.context.get_track_details()):
+    # Edits are sent back to the context, the snapshot is never changed
+    for i, detail in enumerate(self.app.context.get_track_snapshot().sections):
       imgui.push_id(str(i))
       start_pos = imgui.get_cursor_screen_pos()
 
@@ -324,10 +854,12 @@ class TrackMapWindow(Window):
 
       imgui.next_column()
 
-      _, detail[0] = imgui.listbox(TRACK_TYPE_NAME[detail[0]], detail[0], TRACK_TYPE_NAME, 1)
-      _, detail[1] = imgui.input_float('size', detail[1])
+      type_changed, kind = imgui.listbox(TRACK_TYPE_NAME[detail[0]], detail[0], TRACK_TYPE_NAME, 1)
+      size_changed, size = imgui.input_float('size', detail[1])
+      if type_changed or size_changed:
+        self.app.context.set_section(i, kind, size)
       if imgui.button('Remove'):
-        self.app.context.get_track_details().remove(detail)
+        self.app.context.remove_section(i)
       end_pos = imgui.get_cursor_screen_pos()
       max_x   = imgui.get_window_position().x + imgui.get_window_size().x
       imgui.pop_id()
@@ -340,7 +872,7 @@ class TrackMapWindow(Window):
       imgui.separator()
 
     if imgui.button('Add'):
-      self.app.context.get_track_details().append([ STRAIGHT, 1 ])
+      self.app.context.add_section(STRAIGHT, 1)
 
     imgui.columns(1)
     imgui.end_child()
@@ -348,10 +880,23 @@ class TrackMapWindow(Window):
 class GUI:
   def __init__(self, app): 
     self.app = app
+    self.profile = profiler.FrameProfile()
+    self.layout_dirty = True
     self.create_windows()
     self.setup_style()
 
+  def invalidate_layout(self):
+    '''
+    Position the windows again on the next update (e.g. after a resize)
+    '''
+    self.layout_dirty = True
+
   def update(self):
+    if self.layout_dirty:
+      self.layout()
+      self.layout_dirty = False
+
+  def layout(self):
     self.var_wnd.x      = self.app.window.width() * 6 / 10
     self.var_wnd.width  = self.app.window.width() * 4 / 10
     self.var_wnd.height = (self.app.window.height() - self.console_height) / 2
@@ -380,6 +925,10 @@ class GUI:
     self.console.draw()
     self.conn.draw()
     self.map.draw()
+    self.watch.draw()
+    self.sensors.draw()
+    self.metrics.draw()
+    self.profiler.draw()
 
   def create_windows(self):
     self.console_height = 250
@@ -413,6 +962,30 @@ class GUI:
       self.app.window.width() * 4 / 10, self.app.window.height() - self.console_height
     )
     
+    self.watch = WatchWindow(
+      self,
+      self.app.window.width() * 1 / 5, 0,
+      self.app.window.width() * 4 / 10, self.app.window.height() / 2
+    )
+
+    self.sensors = SensorWindow(
+      self,
+      self.app.window.width() * 1 / 5, self.app.window.height() / 2,
+      self.app.window.width() * 4 / 10, 200
+    )
+
+    self.metrics = MetricsWindow(
+      self,
+      self.app.window.width() * 3 / 5, 0,
+      self.app.window.width() * 2 / 5, 300
+    )
+
+    self.profiler = ProfilerWindow(
+      self,
+      self.app.window.width() * 3 / 5, 300,
+      self.app.window.width() * 2 / 5, 250
+    )
+
     wnd_flags = imgui.WINDOW_NO_RESIZE|imgui.WINDOW_NO_MOVE|imgui.WINDOW_NO_SCROLLBAR|imgui.WINDOW_NO_COLLAPSE
     self.command_wnd.add_flags(wnd_flags)
     self.var_wnd.add_flags    (wnd_flags)
@@ -0,0 +1,315 @@
+import queue
+import asyncio
+import time
+import imgui
+import metrics
+import serial_interface
+import sensor_stream
+from clock_sync import ClockSync
+from message import Message
+
+def handler_time(packet_type):
+  '''
+  Get the histogram of the time spent handling packets of a type
+  '''
+  return metrics.histogram('context_handler_seconds', 'Time spent handling packets by type', type = packet_type)
+
+MAX_OUTGOING    = 1024    # Messages waiting to be sent
+MAX_INCOMING    = 4096    # Packets waiting to be handled
+MAX_PACKET_SIZE = 1 << 16 # Bytes recieved without a terminator before the data is dropped
+
+UNKNOWN_COMMAND = 'ERR+Unknown Command Token' # Response of SerialCommands to a request it does not know
+
+# Requests with long responses. The adaptive timeout is measured on short
+# packets, so these always wait at least BULK_TIMEOUT seconds.
+BULK_REQUESTS = [ 'lscmd', 'lsvar', 'map' ]
+BULK_TIMEOUT  = 5.0
+
+class Link:
+  '''
+  Base class for a connection to the robot.
+
+  Packets are terminated by a 0 byte in both directions.
+  Messages are sent one at a time and each one waits for its response.
+  Packets recieved while no message is waiting are treated as pushes
+  from the device and given to the response handler. An OK response of
+  the wrong kind for the waiting message is a late response to an
+  earlier request, and is dropped.
+
+  Derived classes implement _connect() and _write().
+  '''
+  LOG_NAME = 'Link'
+
+  def __init__(self, app):
+    self.messages_out    = queue.Queue(MAX_OUTGOING) # Outgoing messages
+    self.messages_in     = queue.Queue(MAX_INCOMING) # Incoming packets that are not responses
+    self.handler         = None
+    self.frame_handler   = None          # Called with binary sensor stream frames
+    self._connect_failed = False         # Flag to indicate if the connection was successfuly
+    self.accum_buffer    = bytearray()   # Temp buffer to accumulate incoming packets in
+    self.connected       = False         # Is the connection active
+    self.running         = True          # Is the worker task running
+    self.timeout         = 5.0           # Response timeout used until the round trip time is known
+    self.adaptive_timeout = True         # Pick the timeout from the measured round trip times
+    self.clock           = ClockSync(max_timeout = self.timeout)
+    self.sync_interval   = 5.0           # Seconds between clock synchronisation requests
+    self.sync_supported  = True          # Set to False if the device does not understand 'time'
+    self.current_msg     = None          # The current message awaiting a response
+    self.app             = app
+    self.connect_task    = None
+    self.worker          = None
+    self.sync_worker     = None
+
+    # Metrics, labelled with the type of link
+    self.queue_depth     = metrics.gauge('link_queue_depth', 'Messages waiting to be sent', link = self.LOG_NAME)
+    self.bytes_sent      = metrics.counter('link_bytes_sent_total', 'Bytes written to the device', link = self.LOG_NAME)
+    self.bytes_recieved  = metrics.counter('link_bytes_recieved_total', 'Bytes recieved from the device', link = self.LOG_NAME)
+    self.timeouts        = metrics.counter('link_timeouts_total', 'Messages that timed out', link = self.LOG_NAME)
+    self.rtt_histogram   = metrics.histogram('link_rtt_seconds', 'Round trip time of messages', link = self.LOG_NAME)
+    self.dropped         = metrics.counter('link_dropped_total', 'Packets and messages dropped because a queue or buffer was full', link = self.LOG_NAME)
+
+  def start(self):
+    '''
+    Start connecting to the device and start the worker task
+    '''
+    self.connect_task = asyncio.create_task(self._connect())
+    self.worker       = asyncio.create_task(self.worker_task())
+    self.sync_worker  = asyncio.create_task(self.sync_task())
+
+  def get_connect_task(self):
+    return self.connect_task
+
+  def connect_failed(self):
+    return self._connect_failed
+
+  def handle_messages(self):
+    while True:
+      try:
+        message = self.messages_in.get(False, None)
+      except:
+        break
+
+      packet, stamp = message
+      self.handler(packet, stamp)
+
+  def set_response_handler(self, handler):
+    self.handler = handler
+
+  def set_frame_handler(self, handler):
+    self.frame_handler = handler
+
+  def enqueue_message(self, message):
+    '''
+    Add a message to be sent to the device
+
+    A message should have a response handler set which will get
+    called when a response is available.
+    If too many messages are waiting the message times out straight away.
+    '''
+    try:
+      self.messages_out.put_nowait(message)
+    except queue.Full:
+      self.dropped.inc()
+      message.set_timed_out()
+    self.queue_depth.set(self.messages_out.qsize())
+
+  def _on_data(self, data):
+    '''
+    Recieves incoming data from the connection and assembles packets.
+    '''
+    try:
+      self.bytes_recieved.inc(len(data))
+      self.accum_buffer += data
+      end = self.accum_buffer.find(0)
+      while end >= 0:
+        # Construct a packet from the data
+        packet = bytes(self.accum_buffer[:end])
+        del self.accum_buffer[:end + 1]
+        self._on_packet(packet)
+        end = self.accum_buffer.find(0)
+
+      # Drop data that will never be terminated (e.g. the wrong baud rate)
+      if len(self.accum_buffer) > MAX_PACKET_SIZE:
+        self.dropped.inc()
+        self.accum_buffer.clear()
+    except Exception as e:
+      print("Notfy failed: " + str(e))
+
+  def close(self):
+    '''
+    Stop the worker task. Derived classes also release the device.
+    '''
+    self.running   = False
+    self.connected = False
+
+  def _on_packet(self, packet):
+    if sensor_stream.is_frame(packet):
+      self._on_frame(packet)
+      return
+    self._dispatch(packet.decode('utf-8'))
+
+  def _on_frame(self, packet):
+    '''
+    Binary frames are decoded straight away rather than
+    queued with the text packets (and are not logged).
+    '''
+    if self.frame_handler != None:
+      self.frame_handler(packet)
+
+  def _dispatch(self, recieved, push = None):
+    '''
+    The packet is either given to the current message as a response,
+    or added to the incoming packet queue. 'push' is True or False if
+    the link knows whether the packet was pushed, otherwise it is
+    worked out from the packet.
+    '''
+    if push == None:
+      push = serial_interface.is_push(recieved)
+    stamp = self.clock.stamp()
+    self.app.log([self.LOG_NAME + ' Recv:', recieved], [imgui.Vec4(0.3, 0.8, 0.3, 1), None])
+
+    # If a message is waiting for a response, set it.
+    # The device can push packets at any time (e.g. when a lap finishes),
+    # so they must not be mistaken for the response.
+    if self.current_msg != None and not push:
+      if not serial_interface.response_matches(self.current_msg.packet, recieved):
+        # A late response to a request that timed out, it must not answer this one
+        self.app.log([self.LOG_NAME + ' Stale:', recieved], [imgui.Vec4(0.8, 0.3, 0.3, 1), None])
+        self.dropped.inc()
+        return
+      start = metrics.clock()
+      self.current_msg.stamp = stamp
+      self.current_msg.set_response(recieved)
+      if start != 0:
+        handler_time(serial_interface.packet_type(self.current_msg.packet)).observe_since(start)
+      self.current_msg = None
+    else: # Otherwise add the packet to the incoming queue
+      self.put_incoming((recieved, stamp))
+
+  def put_incoming(self, message):
+    '''
+    Add a packet to the incoming queue. If the queue is full
+    (packets are not being handled) the oldest packet is dropped.
+    '''
+    while True:
+      try:
+        self.messages_in.put_nowait(message)
+        return
+      except queue.Full:
+        self.dropped.inc()
+        try:
+          self.messages_in.get_nowait()
+        except queue.Empty:
+          pass
+
+  async def worker_task(self):
+    '''
+    Sends messages placed in the message queue.
+    Only sends 1 message at a time and always expects a response for a message.
+    Response will timeout after 'timeout' seconds
+    '''
+    while (self.running):
+      try:
+        next_message = None
+        try:
+          next_message = self.messages_out.get(False, None)
+        except Exception as e:
+          await asyncio.sleep(0.001) # Sleep for 1ms
+          continue
+
+        # If there was a message, send it and wait for the response
+        try:
+          # Set the current message before sending the command
+          self.current_msg = next_message
+          self.current_msg.sent = True
+          self.current_msg.sent_time = time.time()
+
+          data = self._encode(next_message)
+          self.queue_depth.set(self.messages_out.qsize())
+          await self._write(data)
+          self.bytes_sent.inc(len(data))
+        except Exception as e:
+          print("Failed to send command: " + str(e))
+          next_message.set_timed_out()
+          self.current_msg = None
+          continue
+
+        # Record the time the packet was sent so we can test for a timeout
+        send_time = time.time()
+        timeout   = self.response_timeout(next_message)
+
+        # Wait for the messages response packet to be set
+        # (or for the link to time the message out, see TCPConnection)
+        while not next_message.is_complete():
+          # Check if the response has timed out
+          if time.time() - send_time > timeout:
+            next_message.set_timed_out() # Signal the timeout was reached
+            self.clock.backoff()
+            self.timeouts.inc()
+            break
+
+          await asyncio.sleep(0.001) # Sleep for 1ms
+
+        if next_message.has_response() and next_message.stamp != None:
+          self.clock.add_rtt(next_message.stamp.host - next_message.sent_time)
+          self.rtt_histogram.observe(next_message.stamp.host - next_message.sent_time)
+
+        self.current_msg = None
+      except Exception as e:
+        print("Worker Exception: " + str(e))
+
+  def response_timeout(self, message = None):
+    '''
+    Get the time to wait for the response to 'message'
+    '''
+    timeout = self.clock.timeout() if self.adaptive_timeout else self.timeout
+    if message != None and serial_interface.packet_type(message.packet).lower() in BULK_REQUESTS:
+      timeout = max(timeout, BULK_TIMEOUT)
+    return timeout
+
+  async def sync_task(self):
+    '''
+    Periodically request the device time to keep the clocks synchronised.
+    Requests are sent quickly at first so an estimate is available soon after connecting.
+    '''
+    while self.running and self.sync_supported:
+      if not self.connected:
+        await asyncio.sleep(0.1)
+        continue
+
+      message = Message(serial_interface.get_time())
+      message.on_response(lambda packet, response: self.__on_time(message, response))
+      self.enqueue_message(message)
+      while self.running and not message.is_complete():
+        await asyncio.sleep(0.01)
+
+      await asyncio.sleep(0.25 if len(self.clock.samples) < 8 else self.sync_interval)
+
+  def __on_time(self, message, response):
+    if not serial_interface.response_is_time(response):
+      # Older firmware does not know 'time'. Anything else (e.g. a late response
+      # to an earlier request) only loses this sample.
+      if response == UNKNOWN_COMMAND:
+        self.sync_supported = False
+      return
+    self.clock.add_sample(message.sent_time, serial_interface.parse_response_time(response), message.stamp.host)
+
+  def _encode(self, message):
+    '''
+    Get the bytes written to send a message
+    '''
+    # The leading 0 flushes previous data,
+    # which helps stop failed messages from cascading
+    return b'\0' + message.packet.encode('utf-8') + b'\0'
+
+  async def _connect(self):
+    '''
+    Open the connection to the device
+    '''
+    raise NotImplementedError()
+
+  async def _write(self, data):
+    '''
+    Write a framed packet to the device
+    '''
+    raise NotImplementedError()
@@ -1,3 +1,4 @@
+import asyncio
 
 class Message:
   def __init__(self, packet):
@@ -8,11 +9,17 @@ class Message:
     self.response = None
     self.response_handler = None
     self.timed_out = False
+    self.sent      = False # Has the packet been written to the device
+    self.attached  = []    # Identical messages waiting on this messages response
+    self.future    = None  # Created when the message is awaited
+    self.sent_time = None  # Host time the packet was written
+    self.stamp     = None  # PacketStamp of the response
+    self.done_callbacks = [] # Functions called with the message when it completes
 
   def set_response(self, response):
     '''
     Set the response data.
-    
+
     This will call the response handler if it exists
     '''
     # Set the response
@@ -22,19 +29,87 @@ class Message:
     if self.response_handler != None:
       self.response_handler(self.packet, self.response)
 
+    if self.future != None and not self.future.done():
+      self.future.set_result(response)
+
+    # Share the response with any attached messages
+    for message in self.attached:
+      message.set_response(response)
+
+    self.__done()
+
+  def set_timed_out(self):
+    '''
+    Signal that no response was recieved for this message
+    '''
+    self.timed_out = True
+    if self.future != None and not self.future.done():
+      self.future.set_exception(self.__timeout_error())
+
+    for message in self.attached:
+      message.set_timed_out()
+
+    self.__done()
+
   def on_response(self, handler):
     '''
     Set the response handler
     '''
     self.response_handler = handler
-    
+
+    return self
+
+  def on_done(self, callback):
+    '''
+    Add a function that is called with the message when it
+    recieves a response or times out
+    '''
+    self.done_callbacks.append(callback)
     return self
-    
+
+  def __done(self):
+    for callback in self.done_callbacks:
+      callback(self)
+
+  def attach(self, message):
+    '''
+    Attach an identical message to this one.
+
+    The attached message is not sent, instead it recieves
+    the response (or timeout) of this message.
+    '''
+    self.attached.append(message)
+
+  def wait(self):
+    '''
+    Get a future that is resolved with the response.
+    The future raises a TimeoutError if no response is recieved.
+    '''
+    if self.future == None:
+      self.future = asyncio.get_event_loop().create_future()
+      if self.has_response():
+        self.future.set_result(self.response)
+      elif self.timed_out:
+        self.future.set_exception(self.__timeout_error())
+    return self.future
+
+  def __await__(self):
+    return self.wait().__await__()
+
+  def __timeout_error(self):
+    return TimeoutError("No response to '{0}'".format(self.packet))
+
   def has_response(self):
     '''
     Check if the message has recieved a response
     '''
     return self.response != None
 
+  def is_complete(self):
+    '''
+    Check if the message has either recieved a response or timed out
+    '''
+    return self.has_response() or self.timed_out
+
   def timeout_reached(self):
-    return self.timed_out
\ No newline at end of file
+    return self.timed_out
@@ -0,0 +1,209 @@
+'''
+Lightweight metrics: counters, gauges and latency histograms.
+
+Metrics are created once and kept in a Registry. When the registry is
+disabled every update returns straight away, so instrumented code costs
+one attribute check. Use clock() to time code, it returns 0 when disabled:
+
+  start = metrics.clock()
+  ...
+  histogram.observe_since(start)
+
+The registry can be written in the Prometheus text format.
+'''
+import os
+import time
+
+class Metric:
+  TYPE = 'untyped'
+
+  def __init__(self, registry, name, help, labels):
+    self.registry = registry
+    self.name     = name
+    self.help     = help
+    self.labels   = labels # Tuple of (name, value) pairs
+
+  def label_text(self, extra = ()):
+    labels = self.labels + tuple(extra)
+    if len(labels) == 0:
+      return ''
+    return '{' + ','.join([ '{0}="{1}"'.format(k, v) for k, v in labels ]) + '}'
+
+class Counter(Metric):
+  TYPE = 'counter'
+
+  def __init__(self, registry, name, help, labels):
+    super(Counter, self).__init__(registry, name, help, labels)
+    self.value = 0
+
+  def inc(self, amount = 1):
+    if self.registry.enabled:
+      self.value += amount
+
+  def samples(self):
+    return [ (self.name + self.label_text(), self.value) ]
+
+  def summary(self):
+    return str(self.value)
+
+class Gauge(Metric):
+  TYPE = 'gauge'
+
+  def __init__(self, registry, name, help, labels):
+    super(Gauge, self).__init__(registry, name, help, labels)
+    self.value = 0
+
+  def set(self, value):
+    if self.registry.enabled:
+      self.value = value
+
+  def samples(self):
+    return [ (self.name + self.label_text(), self.value) ]
+
+  def summary(self):
+    return '{0:.6g}'.format(self.value)
+
+class Histogram(Metric):
+  '''
+  A log-linear histogram, like HdrHistogram.
+
+  Values are counted in integer multiples of 'unit'. Each power of two
+  is split into 2^(SUB_BITS - 1) buckets, so the relative error of a
+  recorded value is at most 1 / 2^(SUB_BITS - 1).
+  '''
+  TYPE     = 'histogram'
+  SUB_BITS = 5
+  SUB      = 1 << SUB_BITS
+  MAX_EXP  = 48
+
+  def __init__(self, registry, name, help, labels, unit = 1e-6):
+    super(Histogram, self).__init__(registry, name, help, labels)
+    self.unit   = unit # Smallest value that can be told apart from 0
+    self.counts = [ 0 ] * (self.SUB * (self.MAX_EXP + 1))
+    self.count  = 0
+    self.sum    = 0.0
+    self.max    = 0.0
+
+  def observe(self, value):
+    if not self.registry.enabled:
+      return
+    units    = max(0, int(value / self.unit))
+    exponent = max(0, units.bit_length() - self.SUB_BITS)
+    index    = min(exponent, self.MAX_EXP) * self.SUB + ((units >> exponent) & (self.SUB - 1))
+    self.counts[index] += 1
+    self.count += 1
+    self.sum   += value
+    if value > self.max:
+      self.max = value
+
+  def observe_since(self, start):
+    if self.registry.enabled and start != 0:
+      self.observe(time.perf_counter() - start)
+
+  def bucket_upper(self, index):
+    exponent, mantissa = divmod(index, self.SUB)
+    return ((mantissa + 1) << exponent) * self.unit
+
+  def percentile(self, p):
+    '''
+    Get an upper bound of the p'th percentile (0-100)
+    '''
+    if self.count == 0:
+      return 0.0
+    target = max(1, int(round(self.count * p / 100)))
+    seen = 0
+    for index, count in enumerate(self.counts):
+      seen += count
+      if seen >= target:
+        return min(self.bucket_upper(index), self.max)
+    return self.max
+
+  def mean(self):
+    return self.sum / self.count if self.count > 0 else 0.0
+
+  def samples(self):
+    # Export one bucket per power of two, up to the largest value recorded
+    result = []
+    seen   = 0
+    last   = max([ i for i, c in enumerate(self.counts) if c > 0 ] + [ 0 ])
+    for exponent in range(last // self.SUB + 1):
+      seen += sum(self.counts[exponent * self.SUB:(exponent + 1) * self.SUB])
+      upper = self.bucket_upper(exponent * self.SUB + self.SUB - 1)
+      result.append((self.name + '_bucket' + self.label_text([ ('le', '{0:.6g}'.format(upper)) ]), seen))
+    result.append((self.name + '_bucket' + self.label_text([ ('le', '+Inf') ]), self.count))
+    result.append((self.name + '_sum' + self.label_text(), self.sum))
+    result.append((self.name + '_count' + self.label_text(), self.count))
+    return result
+
+  def summary(self):
+    if self.count == 0:
+      return '-'
+    return 'p50 {0:.3f}ms p99 {1:.3f}ms max {2:.3f}ms n {3}'.format(
+      self.percentile(50) * 1000, self.percentile(99) * 1000, self.max * 1000, self.count)
+
+class Registry:
+  def __init__(self, enabled = False):
+    self.enabled = enabled
+    self.metrics = {} # (name, labels) -> Metric, in creation order
+
+  def __get(self, metric_type, name, help, labels, **kwargs):
+    labels = tuple(sorted(labels.items()))
+    key    = (name, labels)
+    metric = self.metrics.get(key)
+    if metric is None:
+      metric = metric_type(self, name, help, labels, **kwargs)
+      self.metrics[key] = metric
+    return metric
+
+  def counter(self, name, help = '', **labels):
+    return self.__get(Counter, name, help, labels)
+
+  def gauge(self, name, help = '', **labels):
+    return self.__get(Gauge, name, help, labels)
+
+  def histogram(self, name, help = '', unit = 1e-6, **labels):
+    return self.__get(Histogram, name, help, labels, unit = unit)
+
+  def clock(self):
+    return time.perf_counter() if self.enabled else 0
+
+  def to_prometheus(self):
+    '''
+    Get the metrics in the Prometheus text exposition format
+    '''
+    lines = []
+    described = set()
+    for metric in self.metrics.values():
+      if metric.name not in described:
+        described.add(metric.name)
+        if metric.help != '':
+          lines.append('# HELP {0} {1}'.format(metric.name, metric.help))
+        lines.append('# TYPE {0} {1}'.format(metric.name, metric.TYPE))
+      for sample_name, value in metric.samples():
+        lines.append('{0} {1}'.format(sample_name, value))
+    return '\n'.join(lines) + '\n'
+
+  def dump(self, path):
+    '''
+    Write the metrics to a file. The file is replaced atomically
+    so a scraper never reads a partial file.
+    '''
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w') as metrics_file:
+      metrics_file.write(self.to_prometheus())
+    os.replace(temp_path, path)
+
+# The registry used by the app
+REGISTRY = Registry()
+
+def clock():
+  return REGISTRY.clock()
+
+def counter(name, help = '', **labels):
+  return REGISTRY.counter(name, help, **labels)
+
+def gauge(name, help = '', **labels):
+  return REGISTRY.gauge(name, help, **labels)
+
+def histogram(name, help = '', unit = 1e-6, **labels):
+  return REGISTRY.histogram(name, help, unit, **labels)
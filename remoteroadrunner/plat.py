@@ -39,18 +39,26 @@ class Window:
       print("Warning: Unable to set VSync! SDL Error: " + SDL_GetError().decode("utf-8"))
       exit(1)
 
+    self.update_size()
+
   def title(self):
     pass
 
-  def width(self):
+  def update_size(self):
+    '''
+    Read the size of the window. The size is cached because it is
+    used many times a frame, so call this when the window is resized.
+    '''
     w = c_int()
-    SDL_GetWindowSize(self.sdl_window, ctypes.byref(w), None)
-    return w.value
+    h = c_int()
+    SDL_GetWindowSize(self.sdl_window, ctypes.byref(w), ctypes.byref(h))
+    self.size = (w.value, h.value)
+
+  def width(self):
+    return self.size[0]
 
   def height(self):
-    h = c_int()
-    SDL_GetWindowSize(self.sdl_window, None, ctypes.byref(h))
-    return h.value
+    return self.size[1]
 
   def x(self):
     x = c_int()
@@ -0,0 +1,76 @@
+'''
+Smoothed timings of the parts of a frame, shown in the Profiler window.
+'''
+import time
+import metrics
+
+class Timing:
+  def __init__(self, name, parent = None):
+    self.name    = name
+    self.parent  = parent # Name of the timing this one is part of
+    self.average = 0.0    # Exponential moving average, in seconds
+    self.peak    = 0.0    # Longest time since the peaks were reset
+    self.last    = 0.0
+    self.count   = 0
+
+class FrameProfile:
+  def __init__(self, budget = 1 / 60, smoothing = 0.05):
+    self.budget    = budget    # Seconds available per frame
+    self.smoothing = smoothing # Weight of the newest time in the average
+    self.timings   = {}        # Name -> Timing, in the order they were first added
+    self.frames    = 0
+    self.over_budget = 0       # Frames that took longer than the budget
+
+  def add(self, name, seconds, parent = None):
+    timing = self.timings.get(name)
+    if timing == None:
+      timing = Timing(name, parent)
+      self.timings[name] = timing
+
+    if timing.count == 0:
+      timing.average = seconds
+    else:
+      timing.average += (seconds - timing.average) * self.smoothing
+    timing.peak   = max(timing.peak, seconds)
+    timing.last   = seconds
+    timing.count += 1
+
+    if metrics.REGISTRY.enabled:
+      metrics.histogram('frame_part_seconds', 'Time spent in each part of a frame', part = name).observe(seconds)
+
+  def end_frame(self, seconds):
+    '''
+    Record the total time spent on a frame (excluding waiting for vsync)
+    '''
+    self.add('frame', seconds)
+    self.frames += 1
+    if seconds > self.budget:
+      self.over_budget += 1
+
+  def children(self, parent = None):
+    return [ t for t in self.timings.values() if t.parent == parent ]
+
+  def reset_peaks(self):
+    for timing in self.timings.values():
+      timing.peak = timing.last
+    self.frames      = 0
+    self.over_budget = 0
+
+class Timer:
+  '''
+  Time a block and add it to a profile:
+
+    with Timer(profile, 'update'):
+      ...
+  '''
+  def __init__(self, profile, name, parent = None):
+    self.profile = profile
+    self.name    = name
+    self.parent  = parent
+
+  def __enter__(self):
+    self.start = time.perf_counter()
+    return self
+
+  def __exit__(self, *args):
+    self.profile.add(self.name, time.perf_counter() - self.start, self.parent)
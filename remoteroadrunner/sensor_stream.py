@@ -0,0 +1,119 @@
+'''
+Decoder for the binary sensor array stream (see updateSensorStream in the sketch).
+
+Each packet is:
+  [FRAME_MARKER] [sequence number of the first sample] [SENSOR_COUNT bytes per sample]...
+
+Sequence numbers count from 1 to 255 (0 cannot be sent), so gaps show
+samples that were lost on the link.
+'''
+import collections
+import time
+import numpy
+
+FRAME_MARKER = 0xFE # Never the first byte of a text packet (not valid UTF-8)
+SENSOR_COUNT = 6    # IR_SENSOR_COUNT
+SEQ_MODULUS  = 255  # Sequence numbers are 1-255
+
+# Stream settings exposed by the sketch (see cmdVars)
+STREAM_LINK_VAR   = 'strm'
+STREAM_PERIOD_VAR = 'strmPer'
+STREAM_OFF       = 0
+STREAM_BLUETOOTH = 1
+STREAM_WIRED     = 2
+
+def is_frame(packet):
+  return len(packet) > 0 and packet[0] == FRAME_MARKER
+
+def find_frame_start(packet):
+  '''
+  Find the start of a binary frame in a packet that may begin with debug text.
+  Returns -1 if the packet is not a frame.
+  '''
+  return packet.find(FRAME_MARKER)
+
+def decode_frame(packet):
+  '''
+  Decode a frame into the sequence number of the first sample
+  and a (samples, SENSOR_COUNT) uint8 array. The array is a view of the packet.
+  '''
+  count = (len(packet) - 2) // SENSOR_COUNT
+  samples = numpy.frombuffer(packet, dtype = numpy.uint8, count = count * SENSOR_COUNT, offset = 2)
+  return packet[1], samples.reshape(count, SENSOR_COUNT)
+
+class SensorStream:
+  '''
+  Recent samples from the sensor stream, with drop and throughput counters
+  '''
+  def __init__(self, capacity = 512, rate_window = 1.0):
+    self.samples  = numpy.zeros((capacity, SENSOR_COUNT), dtype = numpy.uint8)
+    self.head     = 0    # Row the next sample is written to
+    self.count    = 0    # Total samples recieved
+    self.dropped  = 0    # Total samples lost (from gaps in the sequence numbers)
+    self.frames   = 0    # Total frames recieved
+    self.bad      = 0    # Frames with an invalid length
+    self.bytes    = 0    # Total bytes recieved, including the terminator
+    self.next_seq = None # Expected sequence number of the next sample
+    self.version  = 0    # Incremented when samples are added
+    self.rate_window = rate_window
+    self.history  = collections.deque() # (time, samples, bytes) for recent frames
+
+  def clear(self):
+    self.head     = 0
+    self.count    = 0
+    self.dropped  = 0
+    self.frames   = 0
+    self.bad      = 0
+    self.bytes    = 0
+    self.next_seq = None
+    self.history.clear()
+    self.samples[:] = 0
+    self.version += 1
+
+  def add_frame(self, packet, now = None):
+    now = time.time() if now is None else now
+    if (len(packet) - 2) % SENSOR_COUNT != 0 or len(packet) < 2 + SENSOR_COUNT:
+      self.bad += 1
+      return
+
+    seq, samples = decode_frame(packet)
+    if self.next_seq != None:
+      self.dropped += (seq - self.next_seq) % SEQ_MODULUS
+    self.next_seq = (seq - 1 + len(samples)) % SEQ_MODULUS + 1
+
+    # Copy into the ring of recent samples
+    capacity = len(self.samples)
+    rows = (self.head + numpy.arange(len(samples))) % capacity
+    self.samples[rows] = samples
+    self.head = (self.head + len(samples)) % capacity
+
+    self.count  += len(samples)
+    self.frames += 1
+    self.bytes  += len(packet) + 1
+    self.version += 1
+
+    self.history.append((now, len(samples), len(packet) + 1))
+    while len(self.history) > 0 and now - self.history[0][0] > self.rate_window:
+      self.history.popleft()
+
+  def latest(self, count):
+    '''
+    Get the newest 'count' samples, oldest first
+    '''
+    count = min(count, len(self.samples), self.count)
+    rows  = (self.head - count + numpy.arange(count)) % len(self.samples)
+    return self.samples[rows]
+
+  def rates(self, now = None):
+    '''
+    Get the samples per second and bytes per second over the rate window
+    '''
+    now = time.time() if now is None else now
+    recent = [ h for h in self.history if now - h[0] <= self.rate_window ]
+    if len(recent) == 0:
+      return 0.0, 0.0
+    return sum([ h[1] for h in recent ]) / self.rate_window, sum([ h[2] for h in recent ]) / self.rate_window
+
+  def drop_ratio(self):
+    total = self.count + self.dropped
+    return self.dropped / total if total > 0 else 0.0
@@ -1,114 +1,222 @@
-from enum import Enum
+import codec
 
 STRAIGHT = 0
 LTURN    = 1
 RTURN    = 2
 
 def call_command(name):
-  return "call {0}".format(name)
+  return codec.encode_call(name)
 
 def set_var(name, value):
-  if isinstance(value, float): # Special case for floats
-    return "set {0} {1:.4f}".format(name, value)
-  else:
-    return "set {0} {1}".format(name, value)
+  return codec.encode_set(name, value)
 
 def get_var(name):
-  return "get {0}".format(name)
+  return codec.encode_get(name)
+
+def call_command_id(index):
+  return codec.encode_call_id(index)
+
+def set_var_id(index, value):
+  return codec.encode_set_id(index, value)
+
+def get_var_id(index):
+  return codec.encode_get_id(index)
 
 def get_type(name):
-  return "type {0}".format(name)
+  return codec.encode_type(name)
 
 def list_commands():
-  return "lscmd"
+  return codec.encode_lscmd()
 
 def list_vars():
-  return "lsvar"
+  return codec.encode_lsvar()
+
+def watch_var(name, period_ms):
+  return codec.encode_watch(name, period_ms)
+
+def unwatch_var(name = None):
+  return codec.encode_unwatch(name)
+
+def get_time():
+  return codec.encode_time()
+
+def upload_map(targets):
+  return codec.encode_map(targets)
+
+def request_key(packet):
+  '''
+  Get the key used to identify duplicate requests.
+
+  Sets to the same variable share a key so that a newer
+  value can replace one that has not been sent yet.
+  Returns None for requests that should never be merged (e.g. calls).
+  '''
+  args = packet.split(' ')
+  if args[0] == 'call' or args[0] == 'c':
+    return None
+  if (args[0] == 'set' or args[0] == 's') and len(args) > 1:
+    return args[0] + ' ' + args[1]
+  return packet
+
+def packet_type(packet):
+  '''
+  Get the first word of a packet (e.g. 'get', 'lap' or 'watch')
+  '''
+  return packet.split('\n', 1)[0].split(' ', 1)[0]
+
+def is_set_request(packet):
+  return packet.startswith('set ') or packet.startswith('s ')
 
 def get_var_type(name):
-  if name == 'f32':
-    return float
-  elif name == 'f64':
-    return float
-  elif name == 'i32':
-    return int
-  elif name == 'b':
-    return bool
-  return None
+  return codec.TYPES.get(name)
 
 def response_is_error(response):
-  return response.startswith('ERR+') 
+  return response.startswith('ERR+')
 
 def response_is_get(response):
-  return response.startswith('OK+GET')
+  return codec.packet_kind(response) in ('GET', 'G')
 
 def response_is_set(response):
-  return response.startswith('OK+SET')
+  return codec.packet_kind(response) == 'SET'
 
 def response_is_call(response):
-  return response.startswith('OK+CALL')
+  return codec.packet_kind(response) == 'CALL'
 
 def response_is_type(response):
-  return response.startswith('OK+TYPE')
+  return codec.packet_kind(response) == 'TYPE'
 
 def response_is_lscmd(response):
-  return response.startswith('OK+LSCMD')
+  return codec.packet_kind(response) == 'LSCMD'
 
 def response_is_lsvar(response):
-  return response.startswith('OK+LSVAR')
+  return codec.packet_kind(response) == 'LSVAR'
 
-def parse_response_lscmd(response):
-  if (not response_is_lscmd(response)):
-    return []
-    
-  lines = response.split('\n')[1:]
-  count = int(lines[0])
-  return lines[1:1+count]
+def response_is_time(response):
+  return codec.packet_kind(response) == 'TIME'
 
-def parse_response_lsvar(response):
-  if (not response_is_lsvar(response)):
-    return []
+def parse_response_time(response):
+  '''
+  Get the device time (millis()) from a time response
+  '''
+  return codec.decode_response(response, 'TIME')
 
-  lines = response.split('\n')[1:]
-  count = int(lines[0])
-  var_list = []
-  for var in lines[1:1+count]:
-    desc = var.split(' ')
-    var_list.append({ 'name': desc[0], 'type': get_var_type(desc[1])})
+def response_is_map(response):
+  return codec.packet_kind(response) == 'MAP'
 
-  return var_list
+def parse_response_map(response):
+  '''
+  Get the number of sections loaded from a map response
+  '''
+  return codec.decode_response(response, 'MAP')
 
-def parse_response_type(response):
-  if (not response_is_type(response)):
-    return None
+def response_is_watch(response):
+  return codec.packet_kind(response) == 'WATCH'
 
-  return get_var_type(response.split('\n')[1])
+def response_is_unwatch(response):
+  return codec.packet_kind(response) == 'UNWATCH'
+
+def parse_response_lscmd(response):
+  names = codec.decode_response(response, 'LSCMD')
+  return names if names != None else []
+
+def parse_response_lsvar(response):
+  '''
+  Get the list of codec.VarSpec(name, type) from an lsvar response
+  '''
+  specs = codec.decode_response(response, 'LSVAR')
+  return specs if specs != None else []
+
+def parse_response_type(response):
+  return codec.decode_response(response, 'TYPE')
 
 def parse_response_get(response):
-  if (not response_is_get(response)):
-    return None
-  
-  desc = response.split('\n')[1].split(' ')
-  var_name = desc[0]
-  var_type = get_var_type(desc[1])
+  '''
+  Get the (name, value) from a get response, or None
+  '''
+  return codec.decode_response(response, 'GET')
 
-  if var_type is bool:
-    return True if var_type != '0' else False
-  return var_name, var_type(desc[2])
+def parse_response_get_id(response):
+  '''
+  Get the (index, value text) from an index addressed get response, or None
+  '''
+  return codec.decode_response(response, 'G')
 
   
+# Every packet sent by the device starts with one of these
+FRAME_PREFIXES = ('OK+', 'ERR+', 'newtrack', 'sec ', 'mapd ', 'lap ', 'watch ')
+
+def find_frame_start(recieved):
+  '''
+  Find where the packet starts in data recieved from the device.
+  Anything before it is debug output from the device.
+  Returns -1 if the data does not contain a packet.
+  '''
+  starts = [ recieved.find(prefix) for prefix in FRAME_PREFIXES ]
+  starts = [ i for i in starts if i >= 0 ]
+  return min(starts) if len(starts) > 0 else -1
+
+def is_push(recieved):
+  '''
+  Check if a packet was pushed by the device rather than sent as a response
+  '''
+  return codec.is_push(recieved)
+
+def response_matches(packet, recieved):
+  '''
+  Check if a packet recieved can be the response to a request packet
+  '''
+  return codec.response_matches(packet, recieved)
+
 def is_new_track(recieved):
-  return recieved.startswith('newtrack')
+  return codec.packet_kind(recieved) == 'newtrack'
 
 def is_track_section(recieved):
-  return recieved.startswith('sec')
+  return codec.packet_kind(recieved) == 'sec'
+
+def is_map_delta(recieved):
+  return codec.packet_kind(recieved) == 'mapd'
+
+def parse_new_track(recieved):
+  '''
+  Get the version of a full track map, or None if the device did not send one
+  '''
+  return codec.decode(recieved).value
+
+def parse_map_delta(recieved):
+  return codec.decode(recieved).value
+
+def apply_map_delta(sections, delta):
+  '''
+  Patch a list of [type, size] sections in place with a codec.MapDelta.
+  Raises ValueError if the delta does not fit the sections (e.g. a section
+  is added past the end of the map).
+  '''
+  del sections[delta.count:]
+  for index, section in delta.changes:
+    if index < len(sections):
+      sections[index] = section
+    elif index == len(sections):
+      sections.append(section)
+    else:
+      raise ValueError('Section {0} added to a map of {1} sections'.format(index, len(sections)))
+  if len(sections) != delta.count:
+    raise ValueError('Map has {0} sections after the delta, expected {1}'.format(len(sections), delta.count))
 
 def is_lap_time(recieved):
-  return recieved.startswith('lap')
+  return codec.packet_kind(recieved) == 'lap'
 
 def parse_track_section(recieved):
-  track_detail = recieved.split(' ')[1:]
-  return [int(track_detail[0]), int(track_detail[1])]
+  return codec.decode(recieved).value
 
 def parse_lap_time(recieved):
-  return float(recieved.split(' ')[1]) / 1000
+  return codec.decode(recieved).value
+
+def is_watch(recieved):
+  return codec.packet_kind(recieved) == 'watch'
+
+def parse_watch(recieved):
+  '''
+  Parse the values pushed for watched variables.
+  Returns the device time in milliseconds and a list of (name, value)
+  '''
+  return codec.decode(recieved).value
@@ -0,0 +1,110 @@
+import asyncio
+import os
+import imgui
+import serial
+import serial_interface
+import sensor_stream
+from link import Link
+
+DEFAULT_BAUDRATE = 115200
+
+class SerialConnection(Link):
+  '''
+  Wired connection to the robot over a USB serial port.
+
+  Uses the same packet framing as the bluetooth connection,
+  but packets are written in a single bulk write and reads are
+  driven by the event loop instead of byte by byte notifications.
+  '''
+  LOG_NAME = 'Serial'
+
+  def __init__(self, app, port, baudrate = DEFAULT_BAUDRATE):
+    super(SerialConnection, self).__init__(app)
+    self.port     = port     # Device path or name of the serial port (e.g. /dev/ttyACM0, COM3)
+    self.baudrate = baudrate
+    self.serial   = None
+    self.reader   = None     # Polling task used when the port cannot be watched by the event loop
+    self.watching = False    # Is the port file descriptor registered with the event loop
+
+    # Try to open the serial port and start the worker task
+    self.start()
+
+  def close(self):
+    super(SerialConnection, self).close()
+    if self.watching:
+      asyncio.get_event_loop().remove_reader(self.serial.fileno())
+      self.watching = False
+    if self.serial != None:
+      self.serial.close()
+
+  def __on_readable(self):
+    '''
+    Called by the event loop when data is available on the port
+    '''
+    try:
+      data = self.serial.read(max(1, self.serial.in_waiting))
+    except serial.SerialException as e:
+      print("Serial read failed: " + str(e))
+      self.close()
+      return
+
+    if len(data) > 0:
+      self._on_data(data)
+
+  async def __poll_task(self):
+    '''
+    Reads available data from the port. Used on platforms where the
+    port cannot be added to the event loop (e.g. Windows).
+    '''
+    while self.running:
+      waiting = self.serial.in_waiting
+      if waiting > 0:
+        self._on_data(self.serial.read(waiting))
+      else:
+        await asyncio.sleep(0.001) # Sleep for 1ms
+
+  def _on_packet(self, packet):
+    # Binary frames may also follow debug output
+    frame_start = sensor_stream.find_frame_start(packet)
+    if frame_start >= 0:
+      self.__log_debug(packet[:frame_start].decode('utf-8', errors='replace'))
+      self._on_frame(packet[frame_start:])
+      return
+
+    recieved = packet.decode('utf-8', errors='replace')
+
+    # The device also writes debug output to the serial port.
+    # Strip it from the start of the packet.
+    start = serial_interface.find_frame_start(recieved)
+    if start != 0:
+      self.__log_debug(recieved if start < 0 else recieved[:start])
+      if start < 0:
+        return
+      recieved = recieved[start:]
+
+    self._dispatch(recieved)
+
+  def __log_debug(self, debug):
+    if len(debug.strip()) > 0:
+      self.app.log(['Device:', debug.strip()], [imgui.Vec4(0.6, 0.6, 0.6, 1), None])
+
+  async def _write(self, data):
+    await asyncio.get_running_loop().run_in_executor(None, self.serial.write, data)
+
+  async def _connect(self):
+    '''
+    Opens the serial port and starts listening for incoming data.
+    '''
+    try:
+      self.serial = serial.Serial(self.port, self.baudrate, timeout=0)
+    except serial.SerialException as e:
+      print("Failed to open serial port: " + str(e))
+      self._connect_failed = True
+      return
+
+    if os.name == 'posix':
+      asyncio.get_running_loop().add_reader(self.serial.fileno(), self.__on_readable)
+      self.watching = True
+    else:
+      self.reader = asyncio.create_task(self.__poll_task())
+    self.connected = True
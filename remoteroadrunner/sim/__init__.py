@@ -0,0 +1,7 @@
+'''
+Offline simulation of the line following robot.
+
+Used to evaluate PID gains on a recorded track without track time.
+'''
+from sim.track import Track, TrackGeometry, build_track, track_hash
+from sim.model import RobotConfig, SimResult, simulate, SIM_VERSION
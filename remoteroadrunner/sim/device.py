@@ -0,0 +1,600 @@
+'''
+Simulated robot for testing the app without hardware.
+
+SimulatedDevice answers packets the same way SerialCommands does in the
+sketch, and SimulatedConnection plugs it into the app as a Link. Values are
+parsed and printed the way the AVR does it (32 bit floats and 16 bit ints), so
+the responses match the golden transcript byte for byte (see conformance.py).
+While driving, the device pushes the track map (in full, or the sections that
+changed as a delta) and the lap time after every lap.
+'''
+import asyncio
+import math
+import random
+import struct
+import time
+import speed_profile
+from link import Link
+
+# Variables and commands exposed by the sketch (see cmdVars and cmdList)
+DEFAULT_VARIABLES = [
+  [ 'P',          'f64', 4.5 ],
+  [ 'I',          'f64', 0.0 ],
+  [ 'D',          'f64', 110.0 ],
+  [ 'PIDsf',      'f64', 4.0 ],
+  [ 'srtSpd',     'i32', 240 ],
+  [ 'crnSpd',     'i32', 160 ],
+  [ 'slwSpd',     'i32', 40 ],
+  [ 'acl',        'i32', 200 ],
+  [ 'spdUpThr',   'f64', 0.35 ],
+  [ 'stopDelay',  'i32', 0 ],
+  [ 'sampleFreq', 'none', 500 ], # unsigned int has no type name in the sketch
+  [ 'colDtcLps',  'i32', 4 ],
+  [ 'colMin',     'i32', 200 ],
+  [ 'colMax',     'i32', 700 ],
+  [ 'ssDetct',    'i32', 10 ],
+  [ 'err',        'f32', 0.0 ],
+  [ 'crr',        'f32', 0.0 ],
+  [ 'motSpd',     'i32', 160 ],
+  [ 'lapDst',     'f64', 0.0 ],
+  [ 'prof',       'b',   False ],
+  [ 'mapTol',     'f64', 0.1 ],
+  [ 'strm',       'i32', 0 ],
+  [ 'strmPer',    'i32', 10 ],
+]
+
+DEFAULT_COMMANDS = [ 'startCalib', 'endCalib', 'drive', 'stop', 'syncTrack' ]
+
+# Sections of the default simulated track as [type, size]
+DEFAULT_TRACK = [ [ 0, 400 ], [ 1, 300 ], [ 0, 400 ], [ 1, 300 ], [ 0, 400 ], [ 1, 300 ], [ 0, 400 ], [ 1, 300 ] ]
+
+WHITESPACE = ' \n\r\t'
+
+# Types that can be read and written with get/set
+VALUE_TYPES = [ 'f32', 'f64', 'i32', 'b' ]
+
+# STREAM_MARKER, STREAM_BATCH and IR_SENSOR_COUNT in the sketch
+STREAM_MARKER = 0xFE
+STREAM_BATCH  = 8
+SENSOR_COUNT  = 6
+
+# Distance between the points a lap following a speed profile is simulated at
+PROFILE_STEP = 5
+
+# Sizes of int and long on the AVR
+INT_BITS  = 16
+LONG_BITS = 32
+
+# SerialCommands::MaxWatches and SerialCommands::MinWatchPeriod
+MAX_WATCHES      = 8
+MIN_WATCH_PERIOD = 10
+
+def float32(value):
+  '''
+  Round a value to a 32 bit float. double is the same as float on the AVR.
+  '''
+  return struct.unpack('<f', struct.pack('<f', value))[0] if abs(value) < 3.4e38 else value
+
+def wrap(value, bits):
+  '''
+  Wrap an integer to a signed integer of 'bits' bits, like a cast in C
+  '''
+  value &= (1 << bits) - 1
+  return value - (1 << bits) if value >= 1 << (bits - 1) else value
+
+def print_float(value, digits):
+  '''
+  Format a float the way Print::printFloat does, with the same 32 bit rounding
+  '''
+  if math.isnan(value):
+    return 'nan'
+  if math.isinf(value):
+    return 'inf' # Also for -inf
+  if value > 4294967040.0 or value < -4294967040.0:
+    return 'ovf'
+
+  text   = ''
+  number = float32(value)
+  if number < 0.0:
+    text   = '-'
+    number = -number
+  rounding = 0.5
+  for _ in range(digits):
+    rounding = float32(rounding / 10.0)
+  number    = float32(number + rounding)
+  int_part  = int(number)
+  remainder = float32(number - int_part)
+  text     += str(int_part)
+  if digits > 0:
+    text += '.'
+  for _ in range(digits):
+    remainder = float32(remainder * 10.0)
+    digit     = int(remainder)
+    text     += str(digit)
+    remainder = float32(remainder - digit)
+  return text
+
+def format_value(type_name, value):
+  '''
+  Format a value the way Arduino's Print does
+  '''
+  if type_name == 'f32' or type_name == 'f64':
+    return print_float(value, 2)
+  elif type_name == 'b':
+    return '1' if value else '0'
+  return str(wrap(int(value), INT_BITS))
+
+def format_watch_value(type_name, value):
+  '''
+  Format a value the way SerialCommands::printValue does
+  '''
+  if type_name == 'f32' or type_name == 'f64':
+    return print_float(value, 4)
+  elif type_name in VALUE_TYPES:
+    return format_value(type_name, value)
+  return 'nan'
+
+def next_number(text, decimal):
+  '''
+  Get the text from the start of a number on, like Stream::peekNextDigit with SKIP_WHITESPACE.
+  Returns None if something other than whitespace comes first (the stream functions return 0).
+  '''
+  text = text.lstrip(WHITESPACE)
+  if len(text) == 0 or not (text[0].isdigit() or text[0] == '-' or (decimal and text[0] == '.')):
+    return None
+  return text
+
+def parse_long(text):
+  '''
+  Parse an integer the way Stream::parseInt does (a 32 bit long)
+  '''
+  text = next_number(text, False)
+  if text == None:
+    return 0
+  negative = text[0] == '-'
+  value    = 0
+  for c in text[1:] if negative else text:
+    if not c.isdigit():
+      break
+    value = wrap(value * 10 + int(c), LONG_BITS)
+  return wrap(-value, LONG_BITS) if negative else value
+
+def parse_float(text):
+  '''
+  Parse a float the way Stream::parseFloat does. The digits are read into a
+  long and scaled by a fraction that is divided by ten for each decimal place.
+  '''
+  text = next_number(text, True)
+  if text == None:
+    return 0.0
+  negative = False
+  fraction = None
+  value    = 0
+  for i, c in enumerate(text):
+    if c == '-' and i == 0:
+      negative = True
+    elif c == '.' and fraction == None:
+      fraction = 1.0
+    elif c.isdigit():
+      value = wrap(value * 10 + int(c), LONG_BITS)
+      if fraction != None:
+        fraction = float32(fraction * float32(0.1))
+    else:
+      break
+  value = -value if negative else value
+  return float32(value * fraction) if fraction != None else float32(value)
+
+def parse_value(type_name, text):
+  '''
+  Parse a value the way SerialCommands::executeSet does
+  '''
+  if type_name in [ 'f32', 'f64' ]:
+    return parse_float(text)
+  if type_name == 'b':
+    return parse_long(text) != 0
+  return wrap(parse_long(text), INT_BITS)
+
+def profile_section_time(device, start, section_type, size, corner):
+  '''
+  Get the time to drive a section following the uploaded speed profile.
+  Turns taken faster than device.max_corner_speed make the robot run wide.
+  '''
+  time     = 0.0
+  distance = 0.0
+  while distance < size:
+    step  = min(PROFILE_STEP, size - distance)
+    speed = max(speed_profile.target_speed(device.profile, start + distance, corner), 1)
+    time += step / speed
+    if section_type != 0 and speed > device.max_corner_speed:
+      time += step / speed * 4 * (speed - device.max_corner_speed) / device.max_corner_speed
+    distance += step
+  return time
+
+def simple_lap_model(device, lap):
+  '''
+  A cheap lap model. Faster motor speeds give faster laps, and gains away
+  from a nominal value make the robot weave. Includes noise and a slow drift
+  (e.g. a draining battery) so experiment ordering matters.
+
+  Without a profile the robot drives the start of each straight at the corner
+  speed until it detects the straight (like straightLoops in the sketch).
+  '''
+  straight = max(device.get('srtSpd'), 1)
+  corner   = max(device.get('crnSpd'), 1)
+  weave    = abs(device.get('P') - 4.5) * 0.05 + abs(device.get('D') - 110) * 0.001
+  follow   = device.get('prof') and len(device.profile) > 0
+  sections = []
+  lap_time = 0
+  distance = 0
+  for section_type, size in device.track:
+    if follow:
+      time = profile_section_time(device, distance, section_type, size, corner)
+    elif section_type == 0:
+      slow = min(size, speed_profile.STRAIGHT_DETECT_DISTANCE)
+      time = slow / corner + (size - slow) / straight
+    else:
+      time = size / corner
+    if device.size_noise > 0:
+      size = max(1, int(size * (1 + device.rng.gauss(0, device.size_noise))))
+    sections.append([ section_type, size ])
+    lap_time += time * (1 + weave)
+    distance += size
+  lap_time *= 1 + device.drift * lap + device.rng.gauss(0, device.noise)
+  return lap_time, sections
+
+class SimulatedDevice:
+  def __init__(self, variables = DEFAULT_VARIABLES, commands = DEFAULT_COMMANDS,
+               track = DEFAULT_TRACK, lap_model = simple_lap_model, seed = 0):
+    self.var_names  = [ v[0] for v in variables ]
+    self.var_types  = { v[0]: v[1] for v in variables }
+    self.values     = { v[0]: v[2] for v in variables }
+    self.commands   = list(commands)
+    self.track      = [ list(section) for section in track ]
+    self.lap_model  = lap_model
+    self.rng        = random.Random(seed)
+    self.noise      = 0.01    # Relative standard deviation of lap times
+    self.drift      = 0.0005  # Relative increase in lap time per lap
+    self.allow_drive = False
+    self.laps       = 0
+    self.runs       = 0       # Number of times driving was started
+    self.calls      = {}      # Number of times each command was called
+    self.watches    = []      # [ name, period, last sent ] for each watched variable
+    self.stream_seq     = 1
+    self.stream_samples = []
+    self.last_stream_sample = 0
+    self.stream_drop_rate   = 0.0 # Fraction of stream packets lost on the link
+    self.start_time = time.time()
+    self.clock_rate = 1.0     # Speed of the device clock relative to the host clock
+    self.profile    = []      # speed_profile.SectionTarget of each section uploaded with 'map'
+    self.max_corner_speed = 200 # Fastest speed turns can be taken without running wide
+    self.size_noise  = 0.0    # Relative standard deviation of the section sizes the robot measures
+    self.sent_map    = []     # The map as the host has it (sentMap in the sketch)
+    self.map_version = 0
+    self.resync      = False  # The host asked for the full map with 'syncTrack'
+
+  def get(self, name):
+    return self.values[name]
+
+  def millis(self):
+    '''
+    Milliseconds since the device started, like millis() in the sketch
+    '''
+    return int((time.time() - self.start_time) * self.clock_rate * 1000)
+
+  def execute(self, packet):
+    '''
+    Execute a packet and return the response.
+    Returns None if the packet is ignored.
+    '''
+    if len(packet) <= 1:
+      return None # Bluetooth::update only executes packets longer than 1 character
+
+    tokens = packet.split()
+    if len(tokens) == 0:
+      return None
+
+    action = tokens[0].lower()
+    name   = tokens[1] if len(tokens) > 1 else ''
+
+    # Index addressed forms (c, s and g)
+    if action in [ 'c', 's', 'g' ]:
+      index = parse_value('i32', name)
+      names = self.commands if action == 'c' else self.var_names
+      if index < 0 or index >= len(names):
+        return 'ERR+Command Not Found' if action == 'c' else 'ERR+Unknown Variable'
+      if action == 'c':
+        action, name = 'call', names[index]
+      elif self.var_types[names[index]] not in VALUE_TYPES:
+        return 'ERR+Unknown Variable'
+      elif action == 's':
+        rest = packet.lstrip(WHITESPACE)[len(tokens[0]):].lstrip(WHITESPACE)[len(name):]
+        self.values[names[index]] = parse_value(self.var_types[names[index]], rest)
+        return 'OK+SET'
+      else:
+        type_name = self.var_types[names[index]]
+        return 'OK+G\n{0} {1}'.format(index, format_watch_value(type_name, self.values[names[index]]))
+
+    if action == 'call':
+      if name not in self.commands:
+        return 'ERR+Command Not Found'
+      self.call(name)
+      return 'OK+CALL'
+    elif action == 'set':
+      if self.var_types.get(name) not in VALUE_TYPES:
+        return 'ERR+Unknown Variable'
+      rest = packet.lstrip(WHITESPACE)[len(tokens[0]):].lstrip(WHITESPACE)[len(name):]
+      self.values[name] = parse_value(self.var_types[name], rest)
+      return 'OK+SET'
+    elif action == 'get':
+      if self.var_types.get(name) not in VALUE_TYPES:
+        return 'ERR+Unknown Variable'
+      type_name = self.var_types[name]
+      return 'OK+GET\n{0} {1} {2}'.format(name, type_name, format_value(type_name, self.values[name]))
+    elif action == 'type':
+      return 'OK+TYPE\n{0}'.format(self.var_types.get(name, 'none'))
+    elif action == 'lscmd':
+      return 'OK+LSCMD\n{0}\n{1}'.format(len(self.commands), ''.join([ c + '\n' for c in self.commands ]))
+    elif action == 'lsvar':
+      lines = ''.join([ '{0} {1}\n'.format(n, self.var_types[n]) for n in self.var_names ])
+      return 'OK+LSVAR\n{0}\n{1}'.format(len(self.var_names), lines)
+    elif action == 'time':
+      return 'OK+TIME\n{0}'.format(self.millis())
+    elif action == 'watch':
+      return self.watch(name, parse_long(packet.lstrip(WHITESPACE)[len(tokens[0]):].lstrip(WHITESPACE)[len(name):]))
+    elif action == 'unwatch':
+      return self.unwatch(name)
+    elif action == 'map':
+      return self.load_map(tokens[1:])
+    return 'ERR+Unknown Command Token'
+
+  def load_map(self, tokens):
+    '''
+    Load a map with speed targets, like SerialCommands::executeMap
+    '''
+    values = [ parse_long(token) for token in tokens ]
+    count  = values[0] if len(values) > 0 else 0
+    if count < 0 or count > speed_profile.MAX_SECTIONS:
+      return 'ERR+Too Many Sections'
+
+    self.profile = []
+    for i in range(count):
+      section = values[1 + i * 4:5 + i * 4]
+      section += [ 0 ] * (4 - len(section)) # A truncated packet reads as 0
+      kind, size, speed, brake = section
+      if kind < 0 or kind > 2 or size <= 0 or speed < 0 or speed > 255 or brake < 0 or brake > size or brake > speed_profile.MAX_BRAKE:
+        self.profile = []
+        return 'ERR+Bad Map'
+      self.profile.append(speed_profile.SectionTarget(kind, size, speed, brake))
+    return 'OK+MAP\n{0}'.format(count)
+
+  def watch(self, name, period):
+    if name not in self.var_types:
+      return 'ERR+Unknown Variable'
+    period = max(MIN_WATCH_PERIOD, period)
+    for watch in self.watches:
+      if watch[0] == name:
+        watch[1] = period
+        return 'OK+WATCH'
+    if len(self.watches) >= MAX_WATCHES:
+      return 'ERR+Too Many Watches'
+    self.watches.append([ name, period, 0 ])
+    return 'OK+WATCH'
+
+  def unwatch(self, name):
+    if name == '':
+      self.watches = []
+      return 'OK+UNWATCH'
+    for watch in self.watches:
+      if watch[0] == name:
+        self.watches.remove(watch)
+        return 'OK+UNWATCH'
+    return 'ERR+Not Watched'
+
+  def update_watches(self, time):
+    '''
+    Get the packet pushing the watched variables that are due at 'time' milliseconds.
+    Returns None if nothing is due.
+    '''
+    lines = []
+    for watch in self.watches:
+      name, period, last_sent = watch
+      if time - last_sent < period:
+        continue
+      lines.append('{0} {1}'.format(name, format_watch_value(self.var_types[name], self.values[name])))
+      watch[2] = time
+    if len(lines) == 0:
+      return None
+    return 'watch {0}\n{1}'.format(time, '\n'.join(lines))
+
+  def update_telemetry(self, time):
+    '''
+    Update the live values exposed by the sketch (err, crr and motSpd)
+    '''
+    if not self.allow_drive:
+      self.values['err'] = 0.0
+      self.values['crr'] = 0.0
+      return
+    speed = self.values['crnSpd']
+    error = 0.1 * math.sin(time / 300) + self.rng.gauss(0, 0.02)
+    self.values['err']    = error
+    self.values['crr']    = error * self.values['P'] * speed * self.values['PIDsf']
+    self.values['motSpd'] = speed
+
+  def sensor_sample(self):
+    '''
+    Get the sensor values for the current line position (err)
+    '''
+    centre = (0.5 - self.values['err']) * (SENSOR_COUNT - 1)
+    values = []
+    for i in range(SENSOR_COUNT):
+      value = 1024 * (1 - math.exp(-0.5 * ((i - centre) / 0.8) ** 2)) + self.rng.gauss(0, 10)
+      values.append(min(255, max(1, int(value) // 4))) # streamByte()
+    return values
+
+  def update_stream(self, time):
+    '''
+    Like updateSensorStream in the sketch.
+    Returns the packet to send, or None.
+    '''
+    if self.values['strm'] == 0:
+      self.stream_samples = []
+      return None
+    if time - self.last_stream_sample < self.values['strmPer']:
+      return None
+    self.last_stream_sample = time
+
+    if len(self.stream_samples) == 0:
+      self.stream_samples = [ STREAM_MARKER, self.stream_seq ]
+    self.stream_samples += self.sensor_sample()
+    self.stream_seq = 1 if self.stream_seq == 255 else self.stream_seq + 1
+    if len(self.stream_samples) < 2 + STREAM_BATCH * SENSOR_COUNT:
+      return None
+
+    packet = bytes(self.stream_samples)
+    self.stream_samples = []
+    if self.rng.random() < self.stream_drop_rate:
+      return None
+    return packet
+
+  def call(self, name):
+    self.calls[name] = self.calls.get(name, 0) + 1
+    if name == 'drive':
+      if not self.allow_drive:
+        self.runs += 1
+      self.allow_drive = True
+    elif name == 'stop':
+      self.allow_drive = False
+    elif name == 'syncTrack':
+      self.resync = True
+
+  def next_lap(self):
+    '''
+    Simulate a lap. Returns the lap time in seconds and the sections measured.
+    '''
+    lap_time, sections = self.lap_model(self, self.laps)
+    self.laps += 1
+    return lap_time, sections
+
+  def section_changed(self, sections, index):
+    '''
+    Check if a section is different to the map the host has, like sectionChanged in the sketch
+    '''
+    if index >= len(self.sent_map) or sections[index][0] != self.sent_map[index][0]:
+      return True
+    sent = self.sent_map[index][1]
+    return abs(sections[index][1] - sent) > sent * self.get('mapTol')
+
+  def full_map_packets(self, sections):
+    packets  = [ 'newtrack {0}'.format(self.map_version) ]
+    packets += [ 'sec {0} {1}'.format(int(t), int(size)) for t, size in sections ]
+    return packets
+
+  def track_packets(self, lap_time, sections):
+    '''
+    Get the packets pushed at the end of a lap, like sendTrackInfo in the sketch
+    '''
+    self.map_version += 1
+    if len(self.sent_map) == 0:
+      packets = self.full_map_packets(sections)
+      changed = list(range(len(sections)))
+    else:
+      changed = [ i for i in range(len(sections)) if self.section_changed(sections, i) ]
+      lines   = [ 'mapd {0} {1}'.format(self.map_version, len(sections)) ]
+      lines  += [ '{0} {1} {2}'.format(i, int(sections[i][0]), int(sections[i][1])) for i in changed ]
+      packets = [ '\n'.join(lines) ]
+    packets.append('lap {0}'.format(int(lap_time * 1000)))
+
+    for i in changed:
+      if i < len(self.sent_map):
+        self.sent_map[i] = list(sections[i])
+      else:
+        self.sent_map.append(list(sections[i]))
+    del self.sent_map[len(sections):]
+    return packets
+
+  def resync_packets(self):
+    '''
+    Get the full map packets if the host asked for them, otherwise None
+    '''
+    if not self.resync:
+      return None
+    self.resync = False
+    return self.full_map_packets(self.sent_map)
+
+class SimulatedConnection(Link):
+  '''
+  Connects the app to a SimulatedDevice.
+
+  'latency' is the round trip time in seconds, split evenly between the request and the response.
+  'time_scale' scales the simulated lap times, so tests can run faster than real time.
+  '''
+  LOG_NAME = 'Sim'
+
+  def __init__(self, app, device = None, latency = 0.0, time_scale = 1.0):
+    super(SimulatedConnection, self).__init__(app)
+    self.device     = device if device != None else SimulatedDevice()
+    self.latency    = latency
+    self.time_scale = time_scale
+    self.drive_task = None
+    self.watch_task = None
+    self.start()
+
+  def close(self):
+    super(SimulatedConnection, self).close()
+    for task in [ self.drive_task, self.watch_task ]:
+      if task != None:
+        task.cancel()
+
+  def millis(self):
+    return self.device.millis()
+
+  async def __watch_task(self):
+    '''
+    Pushes watched variables and the sensor stream, like loop() in the sketch
+    '''
+    while self.running:
+      now = self.millis()
+      self.device.update_telemetry(now)
+      packet = self.device.update_watches(now)
+      if packet != None:
+        self._on_data(packet.encode('utf-8') + b'\0')
+      for packet in self.device.resync_packets() or []:
+        self._on_data(packet.encode('utf-8') + b'\0')
+      frame = self.device.update_stream(now)
+      if frame != None:
+        self._on_data(frame + b'\0')
+      await asyncio.sleep(0.001)
+
+  async def __drive_task(self):
+    '''
+    Pushes the track details after every lap while the device is driving
+    '''
+    while self.running:
+      if not self.device.allow_drive:
+        await asyncio.sleep(0.001)
+        continue
+      run = self.device.runs
+      lap_time, sections = self.device.next_lap()
+      await asyncio.sleep(lap_time * self.time_scale)
+
+      # The lap is abandoned if the robot was stopped
+      if not self.device.allow_drive or run != self.device.runs:
+        continue
+      for packet in self.device.track_packets(lap_time, sections):
+        self._on_data(packet.encode('utf-8') + b'\0')
+
+  async def _write(self, data):
+    if self.latency > 0:
+      await asyncio.sleep(self.latency / 2)
+    for packet in data.split(b'\0'):
+      response = self.device.execute(packet.decode('utf-8'))
+      if response == None:
+        continue
+      if self.latency > 0:
+        await asyncio.sleep(self.latency / 2)
+      self._on_data(response.encode('utf-8') + b'\0')
+
+  async def _connect(self):
+    self.drive_task = asyncio.create_task(self.__drive_task())
+    self.watch_task = asyncio.create_task(self.__watch_task())
+    self.connected  = True
@@ -0,0 +1,186 @@
+'''
+Vectorized model of the line following robot.
+
+Every array in the simulation has one entry per parameter set, so
+thousands of PID gains are evaluated in lockstep over the same track.
+The sensor, line position and PID logic mirror SensorArray, PIDController
+and drive() in the sketch.
+'''
+import numpy
+from sim import track as track_geometry
+
+# Increment when a change to the model changes the results
+SIM_VERSION = 1
+
+SENSOR_COUNT = 6    # IR_SENSOR_COUNT
+SENSOR_MIN   = 0
+SENSOR_MAX   = 1024
+
+class RobotConfig:
+  def __init__(self):
+    self.dt              = 0.004 # Seconds per loop() iteration
+    self.max_time        = 60.0  # Give up on a lap after this many seconds
+    self.motor_speed     = 160   # cornerSpeed in the sketch
+    self.pid_scale       = 4.0   # PIDScaleFactor in the sketch
+    self.max_wheel_speed = track_geometry.MAX_WHEEL_SPEED # m/s at full motor speed
+    self.wheel_base      = 0.12  # Distance between the wheels in metres
+    self.sensor_forward  = 0.08  # Distance of the sensor bar in front of the axle
+    self.sensor_spacing  = 0.012 # Distance between sensors
+    self.line_width      = 0.018 # Width of the line on the track
+    self.detect_threshold = 150  # SensorConfig.detectThreshold
+    self.sensor_falloff   = 0.25 # SensorConfig.sensorFalloff
+    self.sensor_noise     = 10   # Standard deviation of the sensor noise
+    self.line_lost_time   = 0.1  # The robot stops if the line is missing for this long
+    self.search_window    = 0.06 # Distance either side of the sensor bar to search for the line in metres
+
+class SimResult:
+  def __init__(self, lap_time, cost, completed):
+    self.lap_time  = lap_time  # Seconds to complete a lap. inf if the lap was not completed
+    self.cost      = cost      # Mean squared PID error per millisecond, as used by PIDTrainer
+    self.completed = completed # True for parameter sets that completed the lap
+
+def sensor_offsets(config):
+  '''
+  Get the (forward, lateral) offset of each sensor from the robot.
+  Sensor 0 is on the right, lateral offsets are positive to the left.
+  '''
+  lateral = (numpy.arange(SENSOR_COUNT) - (SENSOR_COUNT - 1) / 2) * config.sensor_spacing
+  return numpy.full(SENSOR_COUNT, config.sensor_forward), lateral
+
+def read_sensors(dist, config, rng):
+  '''
+  Get the sensor values for the distance of each sensor from the line.
+  The line is dark, so sensors over the line read low values.
+  '''
+  sigma  = config.line_width / 2
+  values = SENSOR_MAX * (1 - numpy.exp(-0.5 * (dist / sigma) ** 2))
+  if config.sensor_noise > 0:
+    values = values + rng.normal(0, config.sensor_noise, values.shape)
+  return numpy.clip(values, SENSOR_MIN, SENSOR_MAX)
+
+def line_position(values, config):
+  '''
+  Calculate the line position and line detection the same way as SensorArray.
+  Returns the line position in the range [0, 1] and if a line was detected.
+  '''
+  detected = values.std(axis = 1) > config.detect_threshold
+  dist     = numpy.abs(values / SENSOR_MAX)
+  weight   = 1.0 - dist ** config.sensor_falloff
+  total    = numpy.maximum(weight.sum(axis = 1), 1e-9)
+  position = (weight * numpy.arange(SENSOR_COUNT)).sum(axis = 1) / total / (SENSOR_COUNT - 1)
+  return position, detected
+
+def simulate(track, kp, ki, kd, config = None, seed = 0):
+  '''
+  Simulate one lap of the track for each set of PID gains.
+
+  kp, ki and kd are arrays (or scalars) with one entry per parameter set.
+  Returns a SimResult with arrays of lap times and costs.
+  '''
+  config = RobotConfig() if config is None else config
+  rng    = numpy.random.default_rng(seed)
+  kp, ki, kd = numpy.broadcast_arrays(
+    numpy.asarray(kp, dtype = float), numpy.asarray(ki, dtype = float), numpy.asarray(kd, dtype = float))
+  kp, ki, kd = kp.ravel(), ki.ravel(), kd.ravel()
+  n = kp.shape[0]
+  m = len(track)
+
+  # Robot state
+  x        = numpy.full(n, track.points[0, 0])
+  y        = numpy.full(n, track.points[0, 1])
+  heading  = numpy.full(n, track.headings[0])
+  index    = numpy.zeros(n, dtype = int) # Closest track point
+  progress = numpy.zeros(n)              # Distance travelled along the track
+  missing  = numpy.zeros(n)              # Time the line has been missing
+  active   = numpy.ones(n, dtype = bool)
+  lap_time = numpy.full(n, numpy.inf)
+  cost     = numpy.zeros(n)
+
+  # PIDController state
+  accum      = numpy.zeros(n)
+  last_error = numpy.zeros(n)
+  is_first   = True
+  dt_ms      = max(int(config.dt * 1000), 1)
+
+  forward, lateral = sensor_offsets(config)
+  track_x = track.points[:, 0].copy()
+  track_y = track.points[:, 1].copy()
+  spacing = track.length / m
+  speed   = config.motor_speed
+
+  # Track points searched for the line under the sensors (ahead of the robot),
+  # and for the closest point to the robot. The robot moves less than
+  # one point per step, so only the neighbouring points are checked for it.
+  ahead         = int(round(config.sensor_forward / spacing))
+  search        = int(numpy.ceil(config.search_window / spacing))
+  sensor_window = numpy.arange(ahead - search, ahead + search + 1)
+  robot_window  = numpy.arange(-3, 4)
+
+  t = 0.0
+  while t < config.max_time and active.any():
+    t += config.dt
+
+    # Position of each sensor
+    cos_h = numpy.cos(heading)[:, None]
+    sin_h = numpy.sin(heading)[:, None]
+    sx = x[:, None] + forward * cos_h - lateral * sin_h
+    sy = y[:, None] + forward * sin_h + lateral * cos_h
+
+    # Distance from each sensor to the nearest track point near the sensor bar
+    candidates = (index[:, None] + sensor_window) % m
+    px = track_x[candidates][:, None, :]
+    py = track_y[candidates][:, None, :]
+    dist = numpy.sqrt(((sx[:, :, None] - px) ** 2 + (sy[:, :, None] - py) ** 2).min(axis = 2))
+
+    # SensorArray
+    position, detected = line_position(read_sensors(dist, config, rng), config)
+    position = numpy.where(detected, position, 0.5)
+
+    # PIDController::addSample
+    error = 0.5 - position
+    if not is_first:
+      accum += error * dt_ms
+      rate   = (error - last_error) / dt_ms
+    else:
+      rate   = numpy.zeros(n)
+    is_first   = False
+    last_error = error
+    correction = (kp * error + ki * accum + kd * rate) * speed * config.pid_scale
+
+    # drive()
+    right = numpy.where(correction > 0, speed - correction, speed)
+    left  = numpy.where(correction < 0, speed + correction, speed)
+    right = numpy.clip(right, 0, speed).astype(int)
+    left  = numpy.clip(left,  0, speed).astype(int)
+
+    # Differential drive kinematics
+    v_left  = left  / 255 * config.max_wheel_speed
+    v_right = right / 255 * config.max_wheel_speed
+    v       = (v_left + v_right) / 2
+    omega   = (v_right - v_left) / config.wheel_base
+    x       = numpy.where(active, x + v * numpy.cos(heading) * config.dt, x)
+    y       = numpy.where(active, y + v * numpy.sin(heading) * config.dt, y)
+    heading = numpy.where(active, heading + omega * config.dt, heading)
+
+    # Track the closest point to the robot and the distance travelled
+    candidates = (index[:, None] + robot_window) % m
+    nearest    = ((track_x[candidates] - x[:, None]) ** 2 + (track_y[candidates] - y[:, None]) ** 2).argmin(axis = 1)
+    new_index  = candidates[numpy.arange(n), nearest]
+    step       = (new_index - index + m // 2) % m - m // 2
+    progress  += numpy.where(active, step * spacing, 0)
+    index      = new_index
+
+    # Accumulate the cost like PIDTrainer::update
+    cost += numpy.where(active, error ** 2, 0)
+
+    # The robot stops driving if the line is missing for too long
+    missing = numpy.where(detected, 0, missing + config.dt)
+    failed  = active & (missing > config.line_lost_time)
+    done    = active & (progress >= track.length)
+    lap_time[done] = t
+    active &= ~(failed | done)
+
+  completed = numpy.isfinite(lap_time)
+  elapsed   = numpy.where(completed, lap_time, config.max_time) * 1000
+  cost      = numpy.where(completed, cost / elapsed, numpy.inf)
+  return SimResult(lap_time, cost, completed)
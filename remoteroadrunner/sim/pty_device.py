@@ -0,0 +1,100 @@
+'''
+Serves a SimulatedDevice on a pseudo terminal, so the serial transport
+(serial_link.SerialConnection and conformance.SerialTransport) can be tested
+without the robot. POSIX only.
+
+  python -m sim.pty_device    # Prints the port to connect to
+
+Watched variables, the sensor stream and track resyncs are pushed like they
+are by SimulatedConnection. Laps are not driven.
+'''
+import os
+import select
+import threading
+import time
+import tty
+from sim.device import SimulatedDevice
+
+class PtyDevice:
+  '''
+  Answers the packets written to 'port' with a SimulatedDevice,
+  from a background thread. Use start() and close(), or 'with'.
+
+  'debug_output' is written before every response, the way debug prints
+  from the sketch end up in front of packets on the serial port.
+  '''
+  def __init__(self, device = None, debug_output = b''):
+    self.device       = device if device != None else SimulatedDevice()
+    self.debug_output = debug_output
+    self.master, self.slave = os.openpty()
+    tty.setraw(self.slave)
+    self.port     = os.ttyname(self.slave) # Path of the serial port to open
+    self.recieved = b''
+    self.running  = False
+    self.thread   = None
+
+  def start(self):
+    self.running = True
+    self.thread  = threading.Thread(target = self.__serve, daemon = True)
+    self.thread.start()
+    return self
+
+  def close(self):
+    self.running = False
+    if self.thread != None:
+      self.thread.join()
+      self.thread = None
+    for fd in [ self.master, self.slave ]:
+      os.close(fd)
+    self.master = self.slave = None
+
+  def __enter__(self):
+    return self.start()
+
+  def __exit__(self, *args):
+    self.close()
+
+  def __serve(self):
+    while self.running:
+      readable, _, _ = select.select([ self.master ], [], [], 0.001)
+      if len(readable) > 0:
+        try:
+          self.recieved += os.read(self.master, 4096)
+        except OSError:
+          return # The port was closed
+        self.__execute()
+      self.__push()
+
+  def __execute(self):
+    '''
+    Execute the complete packets recieved so far, like CommandLink::update
+    '''
+    while b'\0' in self.recieved:
+      packet, self.recieved = self.recieved.split(b'\0', 1)
+      response = self.device.execute(packet.decode('utf-8', errors='replace'))
+      if response != None:
+        self.__write(self.debug_output + response.encode('utf-8'))
+
+  def __push(self):
+    now = self.device.millis()
+    self.device.update_telemetry(now)
+    packet = self.device.update_watches(now)
+    if packet != None:
+      self.__write(packet.encode('utf-8'))
+    for packet in self.device.resync_packets() or []:
+      self.__write(packet.encode('utf-8'))
+    frame = self.device.update_stream(now)
+    if frame != None:
+      self.__write(frame)
+
+  def __write(self, packet):
+    os.write(self.master, packet + b'\0')
+
+if __name__ == '__main__':
+  with PtyDevice() as device:
+    print(device.port, flush = True)
+    try:
+      while True:
+        time.sleep(1)
+    except KeyboardInterrupt:
+      pass
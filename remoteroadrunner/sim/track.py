@@ -0,0 +1,167 @@
+import hashlib
+import math
+import numpy
+
+STRAIGHT = 0
+LTURN    = 1
+RTURN    = 2
+
+# The robot records section sizes as (average motor speed * seconds).
+# This converts them to metres, assuming full motor speed is MAX_WHEEL_SPEED m/s.
+MAX_WHEEL_SPEED = 0.8
+SIZE_TO_METRES  = MAX_WHEEL_SPEED / 255
+
+# Radius of the turns on the track in metres
+TURN_RADIUS = 0.25
+
+def section_length(section):
+  '''
+  Get the length of a [type, size] track section in metres
+  '''
+  return max(float(section[1]), 1) * SIZE_TO_METRES
+
+def section_turn(section):
+  '''
+  Get the change in heading over a [type, size] track section in radians
+  '''
+  if section[0] == LTURN:
+    return section_length(section) / TURN_RADIUS
+  elif section[0] == RTURN:
+    return -section_length(section) / TURN_RADIUS
+  return 0.0
+
+def closure_turn_scale(sections):
+  '''
+  Get the factor applied to every turn so that the total change in
+  heading over the track is a whole number of revolutions.
+  '''
+  total = sum([ section_turn(section) for section in sections ])
+  loops = round(total / (2 * math.pi))
+  if loops == 0 or total == 0:
+    return 1.0
+  return loops * 2 * math.pi / total
+
+class TrackGeometry:
+  '''
+  Builds the centre line of a track from a list of [type, size] sections.
+
+  Straights become line segments and turns become arcs. Sections can be
+  appended one at a time, only the new section is computed.
+  '''
+  def __init__(self, spacing = 0.01, turn_scale = 1.0):
+    self.spacing    = spacing    # Distance between points in metres
+    self.turn_scale = turn_scale # Applied to every turn (see closure_turn_scale)
+    self.sections   = []
+    self.starts     = [ 0 ]      # Index of the first point of each section
+    self.chunks     = [ numpy.zeros((1, 2)) ]
+    self.x          = 0.0
+    self.y          = 0.0
+    self.heading    = 0.0
+    self.length     = 0.0
+    self.count      = 1
+    self.cached     = None
+    self.states     = [ (0.0, 0.0, 0.0, 0.0) ] # (x, y, heading, length) at the start of each section
+
+  def append(self, section):
+    '''
+    Add a section to the end of the track
+    '''
+    length = section_length(section)
+    turn   = section_turn(section) * self.turn_scale
+    steps  = max(1, int(math.ceil(length / self.spacing)))
+    s      = numpy.arange(1, steps + 1) * (length / steps)
+
+    if turn == 0:
+      xs = self.x + s * math.cos(self.heading)
+      ys = self.y + s * math.sin(self.heading)
+    else:
+      # Arc about the turn centre
+      radius = length / turn
+      angles = self.heading + s / radius
+      xs = self.x + radius * (numpy.sin(angles) - math.sin(self.heading))
+      ys = self.y - radius * (numpy.cos(angles) - math.cos(self.heading))
+
+    self.chunks.append(numpy.stack([ xs, ys ], axis = 1))
+    self.sections.append(section)
+    self.starts.append(self.count)
+    self.count   += steps
+    self.x        = float(xs[-1])
+    self.y        = float(ys[-1])
+    self.heading += turn
+    self.length  += length
+    self.cached   = None
+    self.states.append((self.x, self.y, self.heading, self.length))
+
+  def truncate(self, count):
+    '''
+    Remove all but the first 'count' sections
+    '''
+    if count >= len(self.sections):
+      return
+    del self.sections[count:]
+    del self.chunks[count + 1:]
+    del self.starts[count + 1:]
+    del self.states[count + 1:]
+    self.x, self.y, self.heading, self.length = self.states[-1]
+    self.count  = sum([ len(chunk) for chunk in self.chunks ])
+    self.cached = None
+
+  def points(self):
+    '''
+    Get the (N, 2) array of points along the centre line
+    '''
+    if self.cached is None:
+      self.cached = numpy.concatenate(self.chunks)
+    return self.cached
+
+  def closed_points(self):
+    '''
+    Get the points with the loop closure error removed.
+    The gap between the end and the start of the track is distributed
+    along the track in proportion to the distance travelled.
+    '''
+    pts = self.points()
+    if len(pts) < 2:
+      return pts
+    seg  = numpy.linalg.norm(numpy.diff(pts, axis = 0), axis = 1)
+    dist = numpy.concatenate([ [ 0 ], numpy.cumsum(seg) ])
+    gap  = pts[-1] - pts[0]
+    return pts - numpy.outer(dist / max(dist[-1], 1e-9), gap)
+
+def build_track(sections, spacing = 0.01, close_loop = True):
+  '''
+  Build the track geometry for a list of [type, size] sections
+  '''
+  geometry = TrackGeometry(spacing, closure_turn_scale(sections) if close_loop else 1.0)
+  for section in sections:
+    geometry.append(section)
+  return geometry
+
+def track_hash(sections):
+  '''
+  Get a hash identifying a list of [type, size] sections
+  '''
+  text = ';'.join([ '{0},{1}'.format(int(section[0]), int(round(float(section[1])))) for section in sections ])
+  return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+class Track:
+  '''
+  A closed track used by the simulator.
+  Points are (approximately) evenly spaced along the closed centre line.
+  '''
+  def __init__(self, sections, spacing = 0.005):
+    self.sections = [ [ int(section[0]), float(section[1]) ] for section in sections ]
+    self.hash     = track_hash(self.sections)
+    geometry      = build_track(self.sections, spacing)
+    self.points   = geometry.closed_points()[:-1] # Last point is the same as the first
+    self.spacing  = spacing
+
+    # Heading of the track at each point, and distance along the track
+    delta = numpy.roll(self.points, -1, axis = 0) - self.points
+    seg   = numpy.linalg.norm(delta, axis = 1)
+    self.headings = numpy.arctan2(delta[:, 1], delta[:, 0])
+    self.distance = numpy.concatenate([ [ 0 ], numpy.cumsum(seg[:-1]) ])
+    self.length   = float(seg.sum())
+
+  def __len__(self):
+    return len(self.points)
@@ -0,0 +1,250 @@
+'''
+Host side PID tuner.
+
+Searches gain space using the simulator instead of track time.
+Evaluations are sharded across CPU cores and cached on disk, so repeated
+sweeps only simulate gains that have not been evaluated before.
+
+Usage:
+  python -m sim.tuner track.json --mode grid --samples 10
+  python -m sim.tuner track.json --mode random --samples 2000
+  python -m sim.tuner track.json --mode descent --start 4.5 0 110
+'''
+import argparse
+import concurrent.futures
+import hashlib
+import itertools
+import json
+import os
+import sqlite3
+import numpy
+
+from sim.model import RobotConfig, SIM_VERSION, simulate
+from sim.track import Track
+
+# Indices into Parameters.coeff. Matches PIDTrainer in the sketch.
+kP     = 0
+kI     = 1
+kD     = 2
+kCount = 3
+
+# Names of the gain variables exposed by the sketch (see cmdVars)
+GAIN_VARIABLES = [ 'P', 'I', 'D' ]
+
+# Default search bounds for each gain
+DEFAULT_BOUNDS = [ (0.0, 10.0), (0.0, 0.01), (0.0, 200.0) ]
+
+# Default step size for each gain. Matches PIDTrainer in the sketch.
+DEFAULT_STEPS = [ 0.1, 0.0001, 1.0 ]
+
+DEFAULT_CACHE = os.path.join(os.path.expanduser('~'), '.remoteroadrunner', 'tuner-cache.sqlite')
+
+class Parameters:
+  def __init__(self, coeff, cost = float('inf'), lap_time = float('inf')):
+    self.coeff    = [ float(c) for c in coeff ]
+    self.cost     = cost     # Value being minimised
+    self.lap_time = lap_time
+
+  def __repr__(self):
+    return 'PID({0:.4f}, {1:.6f}, {2:.4f}) cost: {3:.6g} lap: {4:.3f}s'.format(
+      self.coeff[kP], self.coeff[kI], self.coeff[kD], self.cost, self.lap_time)
+
+def config_hash(config):
+  '''
+  Get a hash of the simulation settings
+  '''
+  text = json.dumps(vars(config), sort_keys = True)
+  return hashlib.sha1(text.encode('utf-8')).hexdigest()[:12]
+
+class EvaluationCache:
+  '''
+  Stores simulation results keyed by (gains, track hash, sim version, config).
+  '''
+  def __init__(self, path = DEFAULT_CACHE):
+    if path != ':memory:':
+      os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok = True)
+    self.db = sqlite3.connect(path)
+    self.db.execute('CREATE TABLE IF NOT EXISTS evaluations (key TEXT PRIMARY KEY, lap_time REAL, cost REAL)')
+
+  @staticmethod
+  def key(coeff, track_hash, config_key):
+    gains = ','.join([ '{0:.9g}'.format(c) for c in coeff ])
+    return '{0}:{1}:{2}:{3}'.format(SIM_VERSION, track_hash, config_key, gains)
+
+  def get(self, keys):
+    '''
+    Get the cached (lap_time, cost) for each key that has been evaluated
+    '''
+    found = {}
+    for start in range(0, len(keys), 500):
+      chunk = keys[start:start + 500]
+      rows  = self.db.execute(
+        'SELECT key, lap_time, cost FROM evaluations WHERE key IN ({0})'.format(','.join('?' * len(chunk))), chunk)
+      for key, lap_time, cost in rows:
+        found[key] = (lap_time, cost)
+    return found
+
+  def put(self, results):
+    '''
+    Store a list of (key, lap_time, cost)
+    '''
+    self.db.executemany('INSERT OR REPLACE INTO evaluations VALUES (?, ?, ?)', results)
+    self.db.commit()
+
+def _evaluate_shard(track, gains, config):
+  '''
+  Evaluate a block of gains in a worker process
+  '''
+  result = simulate(track, gains[:, kP], gains[:, kI], gains[:, kD], config)
+  return result.lap_time, result.cost
+
+class Tuner:
+  def __init__(self, sections, config = None, cache = None, workers = None, objective = 'cost'):
+    self.track     = Track(sections)
+    self.config    = RobotConfig() if config is None else config
+    self.cache     = cache
+    self.workers   = workers if workers != None else (os.cpu_count() or 1)
+    self.objective = objective # 'cost' or 'lap_time'
+    self.config_key = config_hash(self.config)
+    self.evaluated  = 0    # Number of gains simulated (excludes cache hits)
+    self.pool       = None # Worker processes, created when first needed
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *args):
+    self.close()
+
+  def close(self):
+    if self.pool != None:
+      self.pool.shutdown()
+      self.pool = None
+
+  def evaluate(self, candidates):
+    '''
+    Evaluate a list of gain triples.
+    Returns a list of Parameters in the same order.
+    '''
+    gains   = numpy.asarray(candidates, dtype = float).reshape(-1, kCount)
+    keys    = [ EvaluationCache.key(g, self.track.hash, self.config_key) for g in gains ]
+    results = self.cache.get(keys) if self.cache != None else {}
+
+    missing = [ i for i, key in enumerate(keys) if key not in results ]
+    if len(missing) > 0:
+      todo   = gains[missing]
+      shards = [ shard for shard in numpy.array_split(todo, min(self.workers, len(todo))) if len(shard) > 0 ]
+      if len(shards) > 1:
+        if self.pool == None:
+          self.pool = concurrent.futures.ProcessPoolExecutor(self.workers)
+        outputs = list(self.pool.map(_evaluate_shard, itertools.repeat(self.track), shards, itertools.repeat(self.config)))
+      else:
+        outputs = [ _evaluate_shard(self.track, shards[0], self.config) ]
+
+      lap_times = numpy.concatenate([ out[0] for out in outputs ])
+      costs     = numpy.concatenate([ out[1] for out in outputs ])
+      new_results = [ (keys[i], float(lap_times[j]), float(costs[j])) for j, i in enumerate(missing) ]
+      for key, lap_time, cost in new_results:
+        results[key] = (lap_time, cost)
+      if self.cache != None:
+        self.cache.put(new_results)
+      self.evaluated += len(missing)
+
+    params = []
+    for g, key in zip(gains, keys):
+      lap_time, cost = results[key]
+      params.append(Parameters(g, lap_time if self.objective == 'lap_time' else cost, lap_time))
+    return params
+
+  def grid(self, bounds = DEFAULT_BOUNDS, samples = 10):
+    '''
+    Evaluate every combination of 'samples' evenly spaced values for each gain
+    '''
+    axes = [ numpy.linspace(lo, hi, samples) if hi > lo else [ lo ] for lo, hi in bounds ]
+    return self.evaluate(list(itertools.product(*axes)))
+
+  def random(self, bounds = DEFAULT_BOUNDS, samples = 1000, seed = 0):
+    '''
+    Evaluate 'samples' gains chosen uniformly at random within the bounds
+    '''
+    rng = numpy.random.default_rng(seed)
+    lo  = numpy.array([ b[0] for b in bounds ])
+    hi  = numpy.array([ b[1] for b in bounds ])
+    return self.evaluate(lo + rng.random((samples, kCount)) * (hi - lo))
+
+  def coordinate_descent(self, start, steps = DEFAULT_STEPS, iterations = 50, min_scale = 1 / 64):
+    '''
+    Coordinate descent like PIDTrainer, but every step in both directions
+    for all gains is evaluated in one batch.
+
+    The step sizes are halved when no step improves the cost.
+    Returns the list of best Parameters after each iteration.
+    '''
+    best    = self.evaluate([ start ])[0]
+    history = [ best ]
+    scale   = 1.0
+    for _ in range(iterations):
+      candidates = []
+      for param in range(kCount):
+        for direction in [ -1, 1 ]:
+          coeff = list(best.coeff)
+          coeff[param] = max(0.0, coeff[param] + direction * steps[param] * scale)
+          candidates.append(coeff)
+
+      step_best = min(self.evaluate(candidates), key = lambda p: p.cost)
+      if step_best.cost < best.cost:
+        best = step_best
+      else:
+        scale /= 2
+        if scale < min_scale:
+          break
+      history.append(best)
+    return history
+
+def best(params, count = 1):
+  '''
+  Get the 'count' distinct parameters with the lowest cost
+  '''
+  unique = { tuple(p.coeff): p for p in params }
+  return sorted(unique.values(), key = lambda p: p.cost)[:count]
+
+def push_gains(context, params):
+  '''
+  Send the gains to the robot as one batch of set messages.
+  Returns the list of sent messages.
+  '''
+  return context.set_vars({ name: float(params.coeff[i]) for i, name in enumerate(GAIN_VARIABLES) })
+
+def load_track(path):
+  '''
+  Load a list of [type, size] sections saved with the 'save_track' console command
+  '''
+  with open(path) as track_file:
+    return json.load(track_file)
+
+def main():
+  parser = argparse.ArgumentParser(description = 'Tune PID gains in the simulator')
+  parser.add_argument('track', help = 'JSON file containing a list of [type, size] sections')
+  parser.add_argument('--mode', choices = [ 'grid', 'random', 'descent' ], default = 'grid')
+  parser.add_argument('--samples', type = int, default = 10, help = 'Values per gain for grid, total for random')
+  parser.add_argument('--start', type = float, nargs = 3, default = [ 4.5, 0, 110 ], help = 'Start gains for descent')
+  parser.add_argument('--objective', choices = [ 'cost', 'lap_time' ], default = 'cost')
+  parser.add_argument('--workers', type = int, default = None)
+  parser.add_argument('--cache', default = DEFAULT_CACHE)
+  parser.add_argument('--top', type = int, default = 5)
+  args = parser.parse_args()
+
+  with Tuner(load_track(args.track), cache = EvaluationCache(args.cache),
+             workers = args.workers, objective = args.objective) as tuner:
+    if args.mode == 'grid':
+      params = tuner.grid(samples = args.samples)
+    elif args.mode == 'random':
+      params = tuner.random(samples = args.samples)
+    else:
+      params = tuner.coordinate_descent(args.start)
+
+  print('Simulated {0} new gains'.format(tuner.evaluated))
+  for p in best(params, args.top):
+    print(p)
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,85 @@
+'''
+Immutable snapshots of the state shared by the connection handlers and the UI.
+
+The state of a RoadRunnerContext is published as snapshots. A handler that
+changes the state builds a new snapshot from the current one (copy on write)
+and replaces it, so a snapshot is never changed once it has been published.
+Readers take the current snapshot once and use it without locks. It stays
+consistent even if a newer one is published while it is being read.
+
+Each snapshot has a version, incremented every time one is published, so
+readers can skip work (e.g. rebuilding the track geometry) when nothing changed.
+Unchanged parts are shared between snapshots rather than copied.
+
+Readers must not change a snapshot. Edits go through the context (e.g.
+RoadRunnerContext.set_section), which publishes a new one.
+'''
+import collections
+
+def freeze_sections(sections):
+  '''
+  Get a tuple of (type, size) tuples from a list of sections
+  '''
+  return tuple([ (section[0], section[1]) for section in sections ])
+
+class TrackSnapshot(collections.namedtuple('TrackSnapshot', [ 'version', 'sections', 'complete', 'map_version' ])):
+  '''
+  The track map. 'sections' is a tuple of (type, size) tuples, 'complete' is
+  set when a lap finished after the map was sent, and 'map_version' is the
+  version of the map on the device (None until a full map is recieved).
+  '''
+  __slots__ = ()
+
+  def publish(self, **changes):
+    '''
+    Get the next snapshot with some fields changed
+    '''
+    return self._replace(version = self.version + 1, **changes)
+
+class LapSnapshot(collections.namedtuple('LapSnapshot', [ 'version', 'times', 'stamps' ])):
+  '''
+  The lap times in seconds, and the PacketStamp of each (when the lap ended, in both clocks)
+  '''
+  __slots__ = ()
+
+  def add(self, lap_time, stamp, max_laps):
+    '''
+    Get the next snapshot with a lap added, keeping at most 'max_laps' laps
+    '''
+    return LapSnapshot(self.version + 1, (self.times + (lap_time,))[-max_laps:], (self.stamps + (stamp,))[-max_laps:])
+
+  def last(self):
+    '''
+    Get the (time, stamp) of the last lap, or None
+    '''
+    return (self.times[-1], self.stamps[-1]) if len(self.times) > 0 else None
+
+class VariableSnapshot(collections.namedtuple('VariableSnapshot', [ 'version', 'entries', 'index' ])):
+  '''
+  The cached variables. 'entries' is a tuple of variables.VariableView in the
+  order the device lists them, 'index' maps names to positions in 'entries'.
+  '''
+  __slots__ = ()
+
+  def __contains__(self, name):
+    return name in self.index
+
+  def __iter__(self):
+    return iter(self.entries)
+
+  def __len__(self):
+    return len(self.entries)
+
+  def get(self, name):
+    '''
+    Get the VariableView of a variable, or None
+    '''
+    position = self.index.get(name)
+    return self.entries[position] if position != None else None
+
+  def names(self):
+    return [ entry.name for entry in self.entries ]
+
+EMPTY_TRACK     = TrackSnapshot(0, (), False, None)
+EMPTY_LAPS      = LapSnapshot(0, (), ())
+EMPTY_VARIABLES = VariableSnapshot(0, (), {})
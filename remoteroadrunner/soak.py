@@ -0,0 +1,213 @@
+'''
+Soak test of the host against the simulated device.
+
+Drives a RoadRunnerContext as fast as it will go for a long time: concurrent
+get/set requests, a watched variable, the sensor stream and laps pushed by the
+simulated robot. Memory is traced with tracemalloc and the round trip time of
+requests is measured over each interval.
+
+The test fails if memory grows more than --max-growth MB after the warm up,
+or the p99 round trip time of the last interval is more than --max-rtt-ratio
+times the first (plus --rtt-slack ms, so tiny round trips are not flagged).
+
+Usage:
+  python soak.py --duration 3600 --interval 60
+  python soak.py --duration 120 --interval 10 --time-scale 0.01
+'''
+import argparse
+import asyncio
+import collections
+import random
+import time
+import tracemalloc
+
+import metrics
+import sensor_stream
+from commands import RoadRunnerContext
+
+class SoakApp:
+  '''
+  Stands in for App. Log entries are counted and the most recent are kept.
+  '''
+  def __init__(self, keep = 100):
+    self.console_log = collections.deque(maxlen = keep)
+    self.logged      = 0
+
+  def log(self, message, color = None):
+    self.console_log.append(message)
+    self.logged += 1
+
+class Interval:
+  def __init__(self, start):
+    self.start    = start
+    self.rtts     = metrics.Histogram(metrics.Registry(True), 'soak_rtt_seconds', '', ()) # Fixed size, so it does not add to the memory growth
+    self.requests = 0
+    self.timeouts = 0
+    self.memory   = 0 # Bytes traced at the end of the interval
+
+  def percentile(self, p):
+    return self.rtts.percentile(p)
+
+  def summary(self, elapsed):
+    return '{0:7.0f}s {1:6.0f} req/s  rtt p50 {2:6.2f} p99 {3:6.2f} max {4:6.2f} ms  timeouts {5:3}  memory {6:8.2f} MB'.format(
+      elapsed, self.requests / max(time.time() - self.start, 1e-9), self.percentile(50) * 1000, self.percentile(99) * 1000,
+      self.rtts.max * 1000, self.timeouts, self.memory / 1e6)
+
+class Soak:
+  def __init__(self, duration = 600, interval = 30, warmup = None, concurrency = 4, time_scale = 0.01,
+      latency = 0.0, max_growth = 5.0, max_rtt_ratio = 2.0, rtt_slack = 2.0, top = 10):
+    self.duration      = duration      # Seconds
+    self.interval      = interval      # Seconds between reports
+    self.warmup        = warmup if warmup != None else interval # Seconds before the memory baseline is taken
+    self.concurrency   = concurrency   # Requests in flight at once
+    self.time_scale    = time_scale    # Scale of the simulated lap times
+    self.latency       = latency       # Simulated round trip latency in seconds
+    self.max_growth    = max_growth    # MB
+    self.max_rtt_ratio = max_rtt_ratio
+    self.rtt_slack     = rtt_slack     # ms
+    self.top           = top           # Number of growth sites to report
+    self.app           = SoakApp()
+    self.context       = RoadRunnerContext(self.app)
+    self.intervals     = []
+    self.baseline      = None # tracemalloc snapshot after the warm up
+    self.final         = None # tracemalloc snapshot at the end of the run
+    self.baseline_memory = 0
+    self.running       = True
+
+  async def run(self):
+    '''
+    Run the soak test. Returns True if it passed.
+    '''
+    tracemalloc.start()
+    try:
+      await self.context.connect_sim(time_scale = self.time_scale)
+      self.context.bt.latency = self.latency
+      tasks = [ asyncio.create_task(self.pump()) ]
+      await asyncio.gather(self.context.sync_command_list(), self.context.sync_variable_list())
+
+      names = [ name for name in self.context.get_variables() if self.context.get_var_entry(name).type != None ]
+      await self.context.watch_var('err', 10)
+      await asyncio.gather(*self.context.stream_sensors(sensor_stream.STREAM_BLUETOOTH, 10))
+      await self.context.call_command('drive')
+
+      tasks += [ asyncio.create_task(self.requester(names, seed)) for seed in range(self.concurrency) ]
+      await self.sample()
+
+      self.running = False
+      await asyncio.gather(*tasks[1:])
+      await self.context.call_command('stop')
+      tasks[0].cancel()
+    finally:
+      tracemalloc.stop()
+    return self.report()
+
+  async def pump(self):
+    while True:
+      self.context.handle_incoming()
+      await asyncio.sleep(0.001)
+
+  async def requester(self, names, seed):
+    '''
+    Send gets and sets back to back
+    '''
+    rng = random.Random(seed)
+    while self.running:
+      name = rng.choice(names)
+      if rng.random() < 0.5:
+        message = self.context.sync_var(name)
+      else: # Set the variable to the value it already has
+        message = self.context.set_var(name, self.context.get_var(name), True)
+      if message == None:
+        await asyncio.sleep(0.001)
+        continue
+
+      interval = self.intervals[-1]
+      interval.requests += 1
+      try:
+        await message
+      except TimeoutError:
+        interval.timeouts += 1
+        continue
+      if message.sent_time != None and message.stamp != None:
+        interval.rtts.observe(message.stamp.host - message.sent_time)
+
+  async def sample(self):
+    '''
+    Record the statistics of each interval until the duration has passed
+    '''
+    start = time.time()
+    self.intervals.append(Interval(start))
+    while time.time() - start < self.duration:
+      await asyncio.sleep(min(self.interval, self.duration - (time.time() - start)))
+      now = time.time()
+      self.intervals[-1].memory = tracemalloc.get_traced_memory()[0]
+      print(self.intervals[-1].summary(now - start))
+
+      if self.baseline == None and now - start >= self.warmup:
+        self.baseline        = tracemalloc.take_snapshot()
+        self.baseline_memory = self.intervals[-1].memory
+      self.intervals.append(Interval(now))
+    self.intervals[-1].memory = tracemalloc.get_traced_memory()[0]
+    self.final = tracemalloc.take_snapshot()
+
+  def top_growth(self):
+    '''
+    Get the lines that allocated the most memory since the baseline
+    '''
+    if self.baseline == None or self.final == None:
+      return [] # The run has not finished
+    filters = [ tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, '<frozen *>') ]
+    final   = self.final.filter_traces(filters)
+    stats   = final.compare_to(self.baseline.filter_traces(filters), 'lineno')
+    return [ stat for stat in stats if stat.size_diff > 0 ][:self.top]
+
+  def report(self):
+    measured = [ i for i in self.intervals if i.rtts.count > 0 ]
+    passed   = True
+    print('Requests: {0}  Timeouts: {1}  Laps: {2}  Sensor samples: {3} (dropped {4})  Log entries: {5}'.format(
+      sum([ i.requests for i in self.intervals ]), sum([ i.timeouts for i in self.intervals ]),
+      len(self.context.get_lap_times()), self.context.sensors.count, self.context.sensors.dropped, self.app.logged))
+
+    if self.baseline != None:
+      growth = (self.intervals[-1].memory - self.baseline_memory) / 1e6
+      print('Memory growth after warm up: {0:.2f} MB (limit {1:.2f} MB)'.format(growth, self.max_growth))
+      print('Top growth:')
+      for stat in self.top_growth():
+        print('  ' + str(stat))
+      if growth > self.max_growth:
+        print('FAIL: memory grew by {0:.2f} MB'.format(growth))
+        passed = False
+    else:
+      print('The test was shorter than the warm up, memory growth was not checked')
+
+    if len(measured) >= 2:
+      first = measured[0].percentile(99) * 1000
+      last  = measured[-1].percentile(99) * 1000
+      print('RTT p99: first interval {0:.2f} ms, last interval {1:.2f} ms'.format(first, last))
+      if last > first * self.max_rtt_ratio + self.rtt_slack:
+        print('FAIL: round trip time drifted from {0:.2f} ms to {1:.2f} ms'.format(first, last))
+        passed = False
+
+    print('PASS' if passed else 'FAIL')
+    return passed
+
+def main():
+  parser = argparse.ArgumentParser(description = 'Soak test the host against the simulated device')
+  parser.add_argument('--duration', type = float, default = 600, help = 'Seconds to run for')
+  parser.add_argument('--interval', type = float, default = 30, help = 'Seconds between reports')
+  parser.add_argument('--warmup', type = float, default = None, help = 'Seconds before the memory baseline (default: one interval)')
+  parser.add_argument('--concurrency', type = int, default = 4)
+  parser.add_argument('--time-scale', type = float, default = 0.01, help = 'Scale of simulated lap times')
+  parser.add_argument('--latency', type = float, default = 0.0, help = 'Simulated round trip latency in seconds')
+  parser.add_argument('--max-growth', type = float, default = 5.0, help = 'MB of memory growth allowed')
+  parser.add_argument('--max-rtt-ratio', type = float, default = 2.0)
+  parser.add_argument('--rtt-slack', type = float, default = 2.0, help = 'ms added to the allowed round trip time')
+  parser.add_argument('--top', type = int, default = 10)
+  args = parser.parse_args()
+
+  soak = Soak(args.duration, args.interval, args.warmup, args.concurrency, args.time_scale,
+    args.latency, args.max_growth, args.max_rtt_ratio, args.rtt_slack, args.top)
+  exit(0 if asyncio.run(soak.run()) else 1)
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,164 @@
+'''
+Speed profiles for following a mapped track.
+
+Without a profile the robot reacts to the track as it drives: it runs at the
+corner speed until it has been straight for a while (straightLoops in the
+sketch), then speeds up, and only slows down once it sees the corner marker.
+With a profile it knows where it is on the map (the distance travelled into
+the lap), so it can run at full speed from the start of each straight and
+brake before the next turn instead of after entering it.
+
+Distances are in the units the robot records section sizes in: average motor
+speed * seconds. So a section of size s takes s / v seconds at motor speed v,
+and slowing from v1 to v2 at a constant deceleration a (motor speed per second)
+covers (v1^2 - v2^2) / (2a).
+'''
+import collections
+import math
+
+STRAIGHT = 0
+LTURN    = 1
+RTURN    = 2
+
+MAX_SECTIONS  = 32  # MAX_SECTIONS in TrackMap.h
+MAX_SPEED     = 255 # Largest motor speed (analogWrite)
+MAX_BRAKE     = 0xFFFF # Largest braking distance the sketch stores
+MIN_SECTION_SIZE = 20 # Smaller sections are merged into the section before them
+
+DEFAULT_DECELERATION = 600 # Motor speed per second the robot can slow by without losing the line
+
+# Distance the reactive controller drives at the corner speed before it
+# decides it is on a straight (straightLoops > 50 at the corner speed)
+STRAIGHT_DETECT_DISTANCE = 100
+
+# A section of an uploaded map. 'brake' is the distance before the end of the
+# section where the speed starts changing to the next section's speed.
+SectionTarget = collections.namedtuple('SectionTarget', [ 'type', 'size', 'speed', 'brake' ])
+
+def braking_distance(from_speed, to_speed, deceleration):
+  '''
+  Get the distance needed to slow from one speed to another
+  '''
+  if to_speed >= from_speed:
+    return 0.0
+  return (from_speed ** 2 - to_speed ** 2) / (2 * deceleration)
+
+def entry_speed_limit(exit_speed, distance, deceleration):
+  '''
+  Get the fastest speed that can be braked to 'exit_speed' within 'distance'
+  '''
+  return math.sqrt(exit_speed ** 2 + 2 * deceleration * distance)
+
+def merge_sections(sections):
+  '''
+  Merge neighbouring sections of the same type and fold tiny sections into the
+  section before them. Unlike track_library.normalise the total length is kept,
+  so distances along the merged map match the distance the robot travels.
+  '''
+  result = []
+  for section in sections:
+    kind, size = int(section[0]), int(round(float(section[1])))
+    if len(result) > 0 and (result[-1][0] == kind or size < MIN_SECTION_SIZE):
+      result[-1][1] += size
+    else:
+      result.append([ kind, size ])
+  return result
+
+def optimise(sections, straight_speed, corner_speed, deceleration = DEFAULT_DECELERATION):
+  '''
+  Get the SectionTarget of each section of a [type, size] map.
+
+  Straights are driven at 'straight_speed' and turns at 'corner_speed'.
+  Each section brakes so that it ends at the speed of the next section.
+  Straights too short to brake from the straight speed are given the fastest
+  speed they can still brake from. Raises ValueError if the map has more than
+  MAX_SECTIONS sections once merged.
+  '''
+  merged = merge_sections(sections)
+  if len(merged) > MAX_SECTIONS:
+    raise ValueError('The map has {0} sections, the robot can store {1}'.format(len(merged), MAX_SECTIONS))
+
+  speeds = [ straight_speed if kind == STRAIGHT else corner_speed for kind, size in merged ]
+  speeds = [ int(min(MAX_SPEED, max(1, speed))) for speed in speeds ]
+
+  # Work backwards so every section can slow to the speed of the one after it.
+  # The last section ends the lap, the robot stops after it.
+  for i in range(len(merged) - 2, -1, -1):
+    limit = entry_speed_limit(speeds[i + 1], merged[i][1], deceleration)
+    speeds[i] = int(min(speeds[i], limit))
+
+  targets = []
+  for i, (kind, size) in enumerate(merged):
+    following = speeds[i + 1] if i + 1 < len(merged) else speeds[i]
+    brake     = int(math.ceil(braking_distance(speeds[i], following, deceleration)))
+    targets.append(SectionTarget(kind, size, speeds[i], min(brake, size, MAX_BRAKE)))
+  return targets
+
+def target_speed(targets, distance, default_speed):
+  '''
+  Get the target speed at a distance into the lap, like TrackMap::targetSpeed
+  '''
+  start = 0
+  for i, target in enumerate(targets):
+    end = start + target.size
+    if distance < end:
+      if target.speed == 0:
+        return default_speed
+      brake_start = end - target.brake
+      if i + 1 < len(targets) and targets[i + 1].speed != 0 and distance > brake_start and target.brake > 0:
+        t = (distance - brake_start) / target.brake
+        return target.speed + int((targets[i + 1].speed - target.speed) * t)
+      return target.speed
+    start = end
+  return default_speed
+
+def profile_lap_time(targets):
+  '''
+  Predict the lap time following a profile. The braking part of each section
+  is driven at the average of the section speed and the next.
+  '''
+  total = 0.0
+  for i, target in enumerate(targets):
+    following = targets[i + 1].speed if i + 1 < len(targets) else target.speed
+    total += (target.size - target.brake) / target.speed
+    total += target.brake / ((target.speed + following) / 2)
+  return total
+
+def reactive_lap_time(sections, straight_speed, corner_speed, detect_distance = STRAIGHT_DETECT_DISTANCE):
+  '''
+  Predict the lap time reacting to the track without a profile
+  '''
+  total = 0.0
+  for kind, size in merge_sections(sections):
+    if kind == STRAIGHT:
+      slow   = min(size, detect_distance)
+      total += slow / corner_speed + (size - slow) / straight_speed
+    else:
+      total += size / corner_speed
+  return total
+
+class ProfileReport:
+  '''
+  The predicted effect of a profile. Lap times recorded on the track (if it is
+  in the track library) are scaled by the predicted improvement, since the
+  model ignores how the robot actually accelerates.
+  '''
+  def __init__(self, targets, sections, straight_speed, corner_speed, record = None):
+    self.targets  = targets
+    self.profile  = profile_lap_time(targets)
+    self.reactive = reactive_lap_time(sections, straight_speed, corner_speed)
+    self.best     = None
+    if record != None and len(record.best_laps(1)) > 0:
+      self.best = record.best_laps(1)[0]
+
+  def ratio(self):
+    return self.profile / self.reactive if self.reactive > 0 else 1.0
+
+  def summary(self):
+    lines = [ '{0} sections, predicted lap {1:.3f}s following the profile, {2:.3f}s reacting ({3:+.1f}%)'.format(
+      len(self.targets), self.profile, self.reactive, (self.ratio() - 1) * 100) ]
+    if self.best != None:
+      lines.append('Best recorded lap {0:.3f}s, expected {1:.3f}s'.format(self.best, self.best * self.ratio()))
+    for i, target in enumerate(self.targets):
+      lines.append('  {0:2} type {1} size {2:5} speed {3:3} brake {4:4}'.format(i, target.type, target.size, target.speed, target.brake))
+    return '\n'.join(lines)
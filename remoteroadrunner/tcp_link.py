@@ -0,0 +1,109 @@
+import asyncio
+import sensor_stream
+from link import Link
+
+DEFAULT_PORT = 8765
+
+# The gateway starts packets pushed by the device with this byte, so they are
+# never taken for the response to a request. Text packets and sensor stream
+# frames from the device never start with it.
+PUSH_MARKER = b'\x01'
+
+# Sent by the gateway when the robot does not answer a request in time
+TIMEOUT_ERROR = 'ERR+Gateway Timeout'
+
+# Sent by the gateway when it is not connected to the robot
+NOT_CONNECTED_ERROR = 'ERR+Gateway Not Connected'
+
+# Seconds a client waits for a response. The gateway answers requests the
+# robot does not with TIMEOUT_ERROR, but requests from other clients can be
+# queued in front of this one, so this is much longer than its timeout.
+RESPONSE_TIMEOUT = 30.0
+
+class TCPConnection(Link):
+  '''
+  Connection to a gateway (see gateway.py) that owns the link to the robot.
+
+  Packets use the same framing as a direct connection. Requests start
+  with a sequence number ('<sequence> <packet>'), and the gateway starts
+  the response with the same number. A response with any other number
+  is a late answer to an earlier request and is dropped. Pushes are
+  tagged with PUSH_MARKER instead.
+  '''
+  LOG_NAME = 'Gateway'
+
+  def __init__(self, app, host, port = DEFAULT_PORT):
+    super(TCPConnection, self).__init__(app)
+    self.host   = host
+    self.port   = port
+    self.reader = None
+    self.writer = None
+    self.read_task = None
+    self.sequence  = 0 # Sequence number of the last request sent
+    self.adaptive_timeout = False
+    self.timeout   = RESPONSE_TIMEOUT
+
+    # Try to connect to the gateway and start the worker task
+    self.start()
+
+  def close(self):
+    super(TCPConnection, self).close()
+    if self.writer != None:
+      self.writer.close()
+
+  async def __read_task(self):
+    '''
+    Reads incoming data from the gateway
+    '''
+    while self.running:
+      data = await self.reader.read(4096)
+      if len(data) == 0:
+        self.app.log("Gateway closed the connection")
+        self.close()
+        break
+      self._on_data(data)
+
+  def _on_packet(self, packet):
+    if packet.startswith(PUSH_MARKER):
+      packet = packet[len(PUSH_MARKER):]
+      if sensor_stream.is_frame(packet):
+        self._on_frame(packet)
+      else:
+        self._dispatch(packet.decode('utf-8'), True)
+      return
+
+    sequence, _, response = packet.decode('utf-8').partition(' ')
+    message = self.current_msg
+    if message == None or sequence != str(self.sequence):
+      self.app.log("Dropped a late response from the gateway: " + response)
+      self.dropped.inc()
+      return
+
+    if response == TIMEOUT_ERROR:
+      self.current_msg = None
+      self.timeouts.inc()
+      message.set_timed_out()
+    else:
+      self._dispatch(response, False)
+
+  def _encode(self, message):
+    self.sequence += 1
+    return '{0} {1}'.format(self.sequence, message.packet).encode('utf-8') + b'\0'
+
+  async def _write(self, data):
+    self.writer.write(data)
+    await self.writer.drain()
+
+  async def _connect(self):
+    '''
+    Opens the connection to the gateway and starts listening for incoming data.
+    '''
+    try:
+      self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+    except OSError as e:
+      print("Failed to connect to gateway: " + str(e))
+      self._connect_failed = True
+      return
+
+    self.read_task = asyncio.create_task(self.__read_task())
+    self.connected = True
@@ -0,0 +1,61 @@
+'''
+Shared fixtures. The modules of the app import each other by name, so the
+app directory is put on the path (run 'python -m pytest' from remoteroadrunner).
+'''
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+class FakeApp:
+  '''
+  Stands in for App, keeping the text of everything logged
+  '''
+  def __init__(self):
+    self.logged = []
+
+  def log(self, message, color = None):
+    self.logged.append(message if isinstance(message, str) else ' '.join([ str(part) for part in message ]))
+
+class FakeLink:
+  '''
+  A link that keeps the messages sent to it, so tests can answer them
+  '''
+  def __init__(self):
+    self.sent      = []
+    self.connected = True
+
+  def enqueue_message(self, message):
+    self.sent.append(message)
+
+  def set_response_handler(self, handler):
+    self.handler = handler
+
+  def set_frame_handler(self, handler):
+    self.frame_handler = handler
+
+  def get_connect_task(self):
+    return None
+
+  def handle_messages(self):
+    pass
+
+  def close(self):
+    self.connected = False
+
+@pytest.fixture
+def app():
+  return FakeApp()
+
+@pytest.fixture
+def link():
+  return FakeLink()
+
+@pytest.fixture
+def context(app, link):
+  from commands import RoadRunnerContext
+  context = RoadRunnerContext(app)
+  context.use_link(link)
+  return context
@@ -0,0 +1,38 @@
+'''
+Tests for the console command helpers in app.py
+'''
+import pytest
+
+from app import parse_switch
+
+@pytest.mark.parametrize('text', [ '1', 'true', 'on', 'On', 'TRUE' ])
+def test_switch_on(text):
+  assert parse_switch(text) is True
+
+@pytest.mark.parametrize('text', [ '0', 'false', 'off', 'Off', 'FALSE' ])
+def test_switch_off(text):
+  assert parse_switch(text) is False
+
+@pytest.mark.parametrize('text', [ '', '2', 'yes', 'enabled' ])
+def test_switch_rejects_other_text(text):
+  with pytest.raises(ValueError):
+    parse_switch(text)
+
+def test_tasks_are_kept_until_done():
+  import asyncio
+  from app import AppCommands
+  commands = AppCommands(None)
+  async def run():
+    started = asyncio.Event()
+    finish  = asyncio.Event()
+    async def command():
+      started.set()
+      await finish.wait()
+    task = commands.keep_task(asyncio.create_task(command()))
+    await started.wait()
+    assert task in commands.tasks
+    finish.set()
+    await task
+    await asyncio.sleep(0)
+    assert len(commands.tasks) == 0
+  asyncio.run(run())
@@ -0,0 +1,58 @@
+import math
+import random
+
+import pytest
+
+import codec
+from codec_bench import random_packet, random_value, mutate, same
+
+SEED       = 1
+ITERATIONS = 20000
+
+def test_round_trip():
+  '''
+  Every form printed the way the sketch prints it decodes to the values used to print it
+  '''
+  rng = random.Random(SEED)
+  for _ in range(ITERATIONS):
+    packet, expected = random_packet(rng)
+    decoded = codec.decode(packet)
+    assert decoded.kind == expected.kind, packet
+    assert same(decoded.value, expected.value), packet
+    assert codec.packet_kind(packet) == expected.kind, packet
+
+def test_mutated_packets():
+  '''
+  Truncated, spliced or changed packets decode or raise ValueError, never anything else
+  '''
+  rng = random.Random(SEED)
+  for _ in range(ITERATIONS):
+    packet, _ = random_packet(rng)
+    mutated   = mutate(rng, packet)
+    try:
+      codec.decode(mutated)
+    except ValueError:
+      pass
+
+def test_encoded_values_parse_back():
+  rng = random.Random(SEED)
+  for _ in range(ITERATIONS // 10):
+    for type_name in codec.TYPES.keys():
+      value, _ = random_value(rng, type_name)
+      if isinstance(value, float) and (math.isnan(value) or math.isinf(value)):
+        continue
+      text = codec.encode_set('x', value).split(' ')[2]
+      if type_name == 'b':
+        assert text == ('1' if value else '0')
+      else:
+        assert abs(float(text) - value) <= 1e-4
+
+@pytest.mark.parametrize('packet', [ 'OK+GET', 'OK+GET\nP f64', 'OK+LSVAR\nx\n', 'mapd 1', 'sec 0', 'lap', 'OK+NOPE', 'hello' ])
+def test_malformed(packet):
+  with pytest.raises(ValueError):
+    codec.decode(packet)
+
+def test_special_floats():
+  assert codec.decode('OK+GET\nerr f32 ovf').value == ('err', float('inf'))
+  assert codec.decode('watch 10\nerr ovf').value == (10, [ ('err', float('inf')) ])
+  assert math.isnan(codec.decode('watch 10\nerr nan').value[1][0][1])
@@ -0,0 +1,55 @@
+'''
+Tests for how RoadRunnerContext handles pushed packets and de-duplicates requests
+'''
+from message import Message
+
+def test_bad_push_is_dropped(app, link, context):
+  link.handler('lap abc')
+  link.handler('sec x 400')
+  assert len(context.get_lap_times()) == 0
+  assert len([ text for text in app.logged if text.startswith('Dropped bad BT Message') ]) == 2
+
+def test_push_after_bad_push_is_handled(app, link, context):
+  link.handler('lap abc')
+  link.handler('lap 15000')
+  assert len(context.get_lap_times()) == 1
+
+def test_identical_gets_are_sent_once(link, context):
+  first  = context.send(Message('get P'))
+  second = context.send(Message('get P'))
+  assert link.sent == [ first ]
+  first.set_response('OK+GET\nP f64 1.00')
+  assert second.response == 'OK+GET\nP f64 1.00'
+
+def test_unsent_set_is_replaced(link, context):
+  first  = context.send(Message('set P 1'))
+  second = context.send(Message('set P 2'))
+  assert link.sent == [ first ]
+  assert first.packet == 'set P 2'
+  first.set_response('OK+SET')
+  assert first.response == 'OK+SET'
+  assert second.response == 'OK+SET'
+
+def test_sent_set_is_not_replaced(link, context):
+  first = context.send(Message('set P 1'))
+  first.sent = True
+  second = context.send(Message('set P 2'))
+  assert link.sent == [ first, second ]
+  assert first.packet == 'set P 1'
+
+def test_in_flight_is_empty_after_response(context):
+  message = context.send(Message('get P'))
+  assert len(context.in_flight) == 1
+  message.set_response('OK+GET\nP f64 1.00')
+  assert context.in_flight == {}
+
+def test_in_flight_is_empty_after_timeout(context):
+  message = context.send(Message('set P 1'))
+  assert len(context.in_flight) == 1
+  message.set_timed_out()
+  assert context.in_flight == {}
+
+def test_request_after_completion_is_sent(link, context):
+  context.send(Message('get P')).set_response('OK+GET\nP f64 1.00')
+  context.send(Message('get P'))
+  assert len(link.sent) == 2
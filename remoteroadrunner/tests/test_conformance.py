@@ -0,0 +1,42 @@
+'''
+Replays the golden transcript against the SimulatedDevice, both in process
+and over the serial transport (see sim/pty_device.py)
+'''
+import os
+
+import pytest
+
+import conformance
+from sim.pty_device import PtyDevice
+
+@pytest.fixture(scope = 'module')
+def entries():
+  return conformance.load_transcript(conformance.DEFAULT_TRANSCRIPT)
+
+def failures(results):
+  return [ result.failure() for result in results if result.failure() != None ]
+
+def test_transcript_decodes(entries):
+  assert conformance.check_decoding(entries) == []
+
+def test_sim_matches_transcript(entries):
+  results = conformance.replay(entries, conformance.SimTransport())
+  assert len(results) > 0
+  assert failures(results) == []
+
+@pytest.mark.skipif(os.name != 'posix', reason = 'needs a pseudo terminal')
+@pytest.mark.parametrize('debug_output', [ b'', b'Read Token\r\n' ])
+def test_serial_matches_transcript(entries, debug_output):
+  with PtyDevice(debug_output = debug_output) as device:
+    transport = conformance.SerialTransport(device.port)
+    try:
+      results = conformance.replay(entries, transport)
+    finally:
+      transport.close()
+  assert failures(results) == []
+
+def test_recording_replays(entries, tmp_path):
+  path = str(tmp_path / 'session.txt')
+  conformance.save_transcript(path, conformance.replay(entries, conformance.SimTransport()))
+  results = conformance.replay(entries, conformance.RecordedTransport(path))
+  assert failures(results) == []
@@ -0,0 +1,111 @@
+'''
+Runs two clients through a Gateway that shares one SimulatedConnection
+'''
+import asyncio
+import socket
+import time
+
+import pytest
+
+from conftest import FakeApp
+from gateway import Gateway
+from message import Message
+from sim.device import SimulatedDevice
+
+class SilentDevice(SimulatedDevice):
+  '''
+  A device that never answers 'get I'
+  '''
+  def execute(self, packet):
+    if packet == 'get I':
+      return None
+    return super(SilentDevice, self).execute(packet)
+
+def free_port():
+  with socket.socket() as sock:
+    sock.bind(('127.0.0.1', 0))
+    return sock.getsockname()[1]
+
+def serve(test, device = None, gateway_timeout = None):
+  '''
+  Run 'test' with a gateway and two contexts connected to it
+  '''
+  from commands import RoadRunnerContext
+  async def run():
+    gateway = Gateway()
+    gateway.log = lambda message, color = None: None
+    await gateway.context.connect_sim(device, time_scale = 0.002) # Laps in ~30ms
+    if gateway_timeout != None:
+      gateway.context.bt.adaptive_timeout = False
+      gateway.context.bt.timeout = gateway_timeout
+
+    port = free_port()
+    server = asyncio.create_task(gateway.run('127.0.0.1', port))
+    await asyncio.sleep(0.1)
+    clients = [ RoadRunnerContext(FakeApp()) for i in range(2) ]
+    for client in clients:
+      await client.connect_gateway('127.0.0.1', port)
+      client.bt.sync_supported = False # Keep 'time' requests out of the way
+    try:
+      await test(gateway, clients)
+    finally:
+      for client in clients:
+        client.bt.close()
+      await asyncio.sleep(0.05)
+      gateway.running = False
+      await server
+      gateway.context.bt.close()
+  asyncio.run(run())
+
+def test_each_client_gets_its_own_responses():
+  async def test(gateway, clients):
+    async def requests(client, name, count):
+      for i in range(count):
+        value    = '{0}.00'.format(i)
+        response = await client.send(Message('set {0} {1}'.format(name, value)))
+        assert response == 'OK+SET'
+        response = await client.send(Message('get {0}'.format(name)))
+        assert response == 'OK+GET\n{0} f64 {1}'.format(name, value)
+        response = await client.send(Message('type {0}'.format(name)))
+        assert response == 'OK+TYPE\nf64'
+    await asyncio.gather(requests(clients[0], 'P', 20), requests(clients[1], 'D', 20))
+  serve(test)
+
+def test_pushes_go_to_every_client():
+  async def test(gateway, clients):
+    assert await clients[0].send(Message('call drive')) == 'OK+CALL'
+    for i in range(100):
+      for client in clients:
+        client.handle_incoming()
+      await asyncio.sleep(0.01)
+      if all([ len(client.get_lap_times()) > 0 for client in clients ]):
+        break
+    for client in clients:
+      assert len(client.get_lap_times()) > 0
+  serve(test)
+
+def test_gateway_timeout_is_forwarded():
+  async def test(gateway, clients):
+    start = time.time()
+    with pytest.raises(TimeoutError):
+      await clients[0].send(Message('get I'))
+    assert time.time() - start < 2.0 # Much less than tcp_link.RESPONSE_TIMEOUT
+    assert await clients[0].send(Message('type I')) == 'OK+TYPE\nf64'
+    assert await clients[1].send(Message('get P')) == 'OK+GET\nP f64 4.50'
+  serve(test, SilentDevice(), gateway_timeout = 0.2)
+
+def test_late_response_is_dropped():
+  import tcp_link
+  async def run():
+    app  = FakeApp()
+    link = tcp_link.TCPConnection(app, '127.0.0.1', free_port()) # Nothing is listening
+    await link.get_connect_task()
+    message = Message('get P')
+    link.current_msg = message
+    link.sequence    = 2
+    link._on_packet(b'1 OK+GET\nP f64 1.00') # The answer to request 1
+    assert not message.is_complete()
+    link._on_packet(b'2 OK+GET\nP f64 2.00')
+    assert message.response == 'OK+GET\nP f64 2.00'
+    link.close()
+  asyncio.run(run())
@@ -0,0 +1,73 @@
+'''
+Tests for the request/response handling of the Link base class
+'''
+import asyncio
+
+import link
+from link import Link
+from message import Message
+
+class LoopbackLink(Link):
+  '''
+  A link that records what is written, so tests can answer it
+  '''
+  def __init__(self, app):
+    super(LoopbackLink, self).__init__(app)
+    self.written          = []
+    self.sync_supported   = False # No 'time' requests
+    self.adaptive_timeout = False
+    self.timeout          = 0.05
+    self.start()
+
+  async def _connect(self):
+    self.connected = True
+
+  async def _write(self, data):
+    self.written.append(data)
+
+  def respond(self, packet):
+    self._on_data(packet.encode('utf-8') + b'\0')
+
+async def sent(link, count):
+  while len(link.written) < count:
+    await asyncio.sleep(0.001)
+
+def test_late_response_is_not_given_to_the_next_message(app):
+  async def run():
+    device = LoopbackLink(app)
+    first  = Message('get P')
+    second = Message('set P 1')
+    device.enqueue_message(first)
+    device.enqueue_message(second)
+    await sent(device, 2) # The first message timed out
+    assert first.timed_out
+
+    device.respond('OK+GET\nP f64 1.00')
+    assert not second.has_response()
+    device.respond('OK+SET')
+    assert await second == 'OK+SET'
+    device.close()
+  asyncio.run(run())
+
+def test_errors_are_given_to_the_waiting_message(app):
+  async def run():
+    device = LoopbackLink(app)
+    message = Message('get nothing')
+    device.enqueue_message(message)
+    await sent(device, 1)
+    device.respond('ERR+Unknown Variable')
+    assert await message == 'ERR+Unknown Variable'
+    device.close()
+  asyncio.run(run())
+
+def test_bulk_requests_wait_longer(app):
+  async def run():
+    device = LoopbackLink(app)
+    device.adaptive_timeout = True
+    for i in range(8):
+      device.clock.add_rtt(0.01)
+    assert device.response_timeout(Message('get P')) < 1.5
+    assert device.response_timeout(Message('lsvar')) >= link.BULK_TIMEOUT
+    assert device.response_timeout(Message('map 2 0 400 100 50')) >= link.BULK_TIMEOUT
+    device.close()
+  asyncio.run(run())
@@ -0,0 +1,64 @@
+'''
+Runs serial_link.SerialConnection against a SimulatedDevice served on a
+pseudo terminal (see sim/pty_device.py)
+'''
+import asyncio
+import os
+
+import pytest
+
+pytestmark = pytest.mark.skipif(os.name != 'posix', reason = 'needs a pseudo terminal')
+
+from message import Message
+from sim.pty_device import PtyDevice
+
+async def pump(context, seconds):
+  '''
+  Handle incoming packets for a while, like App.update
+  '''
+  for i in range(int(seconds / 0.01)):
+    context.handle_incoming()
+    await asyncio.sleep(0.01)
+
+def serve(app, test, device = None, debug_output = b''):
+  '''
+  Run 'test' with a context connected to a PtyDevice over SerialConnection
+  '''
+  from commands import RoadRunnerContext
+  async def run():
+    context = RoadRunnerContext(app)
+    with PtyDevice(device, debug_output) as pty:
+      await context.connect_serial(pty.port)
+      assert context.bt.connected
+      try:
+        await test(context, pty.device)
+      finally:
+        context.bt.close() # Before the pty is closed under it
+  asyncio.run(run())
+
+def test_request_and_response(app):
+  async def test(context, device):
+    assert await context.send(Message('set P 2.5')) == 'OK+SET'
+    assert await context.send(Message('get P')) == 'OK+GET\nP f64 2.50'
+    assert await context.send(Message('call nothing')) == 'ERR+Command Not Found'
+    assert device.get('P') == 2.5
+  serve(app, test)
+
+def test_debug_output_is_stripped(app):
+  async def test(context, device):
+    assert await context.send(Message('type P')) == 'OK+TYPE\nf64'
+  serve(app, test, debug_output = b'Read Token\r\n')
+  assert 'Device: Read Token' in app.logged
+
+def test_pushes_are_not_taken_as_responses(app):
+  async def test(context, device):
+    assert await context.send(Message('watch P 10')) == 'OK+WATCH'
+    assert await context.send(Message('set strm 2')) == 'OK+SET'
+    context.watches.add('P', 10)
+    await pump(context, 0.3)
+    for i in range(20):
+      assert await context.send(Message('type I')) == 'OK+TYPE\nf64'
+    await pump(context, 0.1)
+    assert len(context.watches.get('P')) > 0
+    assert context.sensors.frames > 0
+  serve(app, test)
@@ -0,0 +1,54 @@
+import codec
+import variables
+
+def load_p(context, link, value = 4.5):
+  '''
+  List a single float variable, P, and answer the get for it
+  '''
+  context.handle_variable_list(None, 'OK+LSVAR\n1\nP f64\n')
+  get = link.sent.pop()
+  get.set_response('OK+G\n0 {0:.4f}'.format(value))
+  assert context.get_var('P') == value
+
+def test_set_acknowledged(context, link):
+  load_p(context, link)
+  message = context.set_var('P', 3.0)
+  assert context.get_var_entry('P').is_pending()
+  message.set_response('OK+SET')
+  entry = context.get_var_entry('P')
+  assert entry.source == variables.SOURCE_DEVICE
+  assert entry.value == 3.0
+
+def test_set_error_rolls_back(context, link, app):
+  load_p(context, link)
+  message = context.set_var('P', 3.0)
+  message.set_response('ERR+Unknown Variable')
+
+  entry = context.get_var_entry('P')
+  assert entry.value == 4.5
+  assert not entry.is_pending()
+  assert entry.is_stale(context.variables.ttl)
+  assert link.sent[-1].packet == codec.encode_get_id(0) # Fetched again
+  assert any([ 'Failed to set P' in line for line in app.logged ])
+
+def test_set_timeout_rolls_back(context, link):
+  load_p(context, link)
+  message = context.set_var('P', 3.0)
+  message.set_timed_out()
+
+  entry = context.get_var_entry('P')
+  assert entry.value == 4.5
+  assert not entry.is_pending()
+  assert entry.is_stale(context.variables.ttl)
+  assert link.sent[-1].packet == codec.encode_get_id(0)
+
+def test_failed_set_keeps_newer_value(context, link):
+  load_p(context, link)
+  first = context.set_var('P', 3.0)
+  link.sent[-1].sent = True # The first set was written, so the next is queued rather than merged
+  context.set_var('P', 2.0)
+  first.set_response('ERR+Unknown Variable')
+
+  entry = context.get_var_entry('P')
+  assert entry.value == 2.0 # Still waiting for the newer set
+  assert entry.is_pending()
@@ -0,0 +1,254 @@
+'''
+Library of tracks the robot has mapped, with the lap times recorded on each.
+
+Tracks are stored as JSON files named by a hash of their normalised sections.
+Each section is [type, size], as sent in 'sec' packets. Normalising merges
+neighbouring sections of the same type and drops sections that are too short
+to be real, so small differences between maps of the same track do not matter.
+
+Tracks are indexed by every run of INDEX_LENGTH section types (wrapping around
+the end of the loop). A map being streamed from the device is matched as each
+section arrives: a run of section types gives the tracks and positions it could
+be from, and each following section rules out candidates that do not continue
+the same way. A track is usually recognised after a handful of sections.
+'''
+import glob
+import hashlib
+import json
+import math
+import os
+import time
+
+DEFAULT_PATH = os.path.join(os.path.expanduser('~'), '.remoteroadrunner', 'tracks')
+
+INDEX_LENGTH     = 6    # Section types in each indexed run
+MIN_SECTION_SIZE = 20   # Sections smaller than this are treated as noise
+SIZE_TOLERANCE   = 0.3  # Relative difference allowed between matching section sizes
+SIZE_QUANTUM     = 0.25 # Sizes are rounded to this step in log2 space for hashing
+
+def normalise(sections):
+  '''
+  Merge neighbouring sections of the same type and remove tiny sections
+  '''
+  result = []
+  for section in sections:
+    kind, size = int(section[0]), float(section[1])
+    if size < MIN_SECTION_SIZE:
+      continue
+    if len(result) > 0 and result[-1][0] == kind:
+      result[-1][1] += size
+    else:
+      result.append([ kind, size ])
+  return result
+
+def content_hash(sections):
+  '''
+  Get the hash of normalised sections. Sizes are rounded so the hash
+  ignores small changes.
+  '''
+  text = ';'.join([ '{0},{1}'.format(kind, int(round(math.log2(max(size, 1)) / SIZE_QUANTUM))) for kind, size in sections ])
+  return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+def sizes_match(a, b):
+  return abs(a - b) <= SIZE_TOLERANCE * max(a, b)
+
+class TrackRecord:
+  def __init__(self, hash, sections, name = None, laps = None, created = None):
+    self.hash     = hash
+    self.sections = sections # Normalised [type, size] sections
+    self.name     = name if name != None else hash[:8]
+    self.laps     = laps if laps != None else [] # [time recorded, lap seconds]
+    self.created  = created if created != None else time.time()
+
+  def types(self):
+    return [ section[0] for section in self.sections ]
+
+  def best_laps(self, count = 3):
+    return sorted([ lap[1] for lap in self.laps ])[:count]
+
+  def to_json(self):
+    return { 'hash': self.hash, 'name': self.name, 'created': self.created, 'sections': self.sections, 'laps': self.laps }
+
+  @staticmethod
+  def from_json(data):
+    return TrackRecord(data['hash'], data['sections'], data.get('name'), data.get('laps'), data.get('created'))
+
+  def summary(self):
+    best = ', '.join([ '{0:.3f}s'.format(lap) for lap in self.best_laps() ])
+    return "'{0}' ({1} sections, {2} laps{3})".format(self.name, len(self.sections), len(self.laps), ', best ' + best if best != '' else '')
+
+class TrackLibrary:
+  def __init__(self, path = DEFAULT_PATH):
+    self.path   = path   # Directory the tracks are stored in, or None to keep them in memory
+    self.tracks = {}     # Hash -> TrackRecord
+    self.index  = {}     # Tuple of INDEX_LENGTH section types -> [(hash, position)]
+    if self.path != None:
+      os.makedirs(self.path, exist_ok = True)
+      for file_path in glob.glob(os.path.join(self.path, '*.json')):
+        with open(file_path, 'r') as track_file:
+          self.__add_record(TrackRecord.from_json(json.load(track_file)))
+
+  def __len__(self):
+    return len(self.tracks)
+
+  def __add_record(self, record):
+    self.tracks[record.hash] = record
+    types = record.types()
+    if len(types) < INDEX_LENGTH:
+      return
+    for position in range(len(types)):
+      run = tuple([ types[(position + i) % len(types)] for i in range(INDEX_LENGTH) ])
+      self.index.setdefault(run, []).append((record.hash, position))
+
+  def lookup(self, types):
+    '''
+    Get the (hash, position) of each place a run of INDEX_LENGTH section types appears
+    '''
+    return self.index.get(tuple(types), [])
+
+  def get(self, hash):
+    return self.tracks.get(hash)
+
+  def save(self, record):
+    if self.path == None:
+      return
+    file_path = os.path.join(self.path, record.hash + '.json')
+    with open(file_path + '.tmp', 'w') as track_file:
+      json.dump(record.to_json(), track_file)
+    os.replace(file_path + '.tmp', file_path)
+
+  def find(self, sections):
+    '''
+    Find a known track matching a complete map, or None
+    '''
+    sections = normalise(sections)
+    record   = self.tracks.get(content_hash(sections))
+    if record != None:
+      return record
+
+    matcher = TrackMatcher(self)
+    for section in sections:
+      matcher.add_section(section)
+    matcher.finish()
+    for candidate in matcher.candidates:
+      if candidate.matched == len(sections) and len(self.tracks[candidate.hash].sections) == len(sections):
+        return self.tracks[candidate.hash]
+
+    return self.find_short(sections)
+
+  def find_short(self, sections):
+    '''
+    Find a track too short to be indexed by comparing normalised sections directly
+    '''
+    if len(sections) >= INDEX_LENGTH:
+      return None
+    for record in self.tracks.values():
+      if len(record.sections) == len(sections):
+        if all([ a[0] == b[0] and sizes_match(a[1], b[1]) for a, b in zip(record.sections, sections) ]):
+          return record
+    return None
+
+  def add_track(self, sections):
+    '''
+    Get the record for a complete map, adding it to the library if it is new
+    '''
+    record = self.find(sections)
+    if record == None:
+      normalised = normalise(sections)
+      record = TrackRecord(content_hash(normalised), normalised)
+      self.__add_record(record)
+      self.save(record)
+    return record
+
+  def add_lap(self, record, lap_time):
+    record.laps.append([ time.time(), lap_time ])
+    self.save(record)
+
+  def rename(self, record, name):
+    record.name = name
+    self.save(record)
+
+class Candidate:
+  def __init__(self, hash, position, matched):
+    self.hash     = hash
+    self.position = position # Index in the track of the next section expected
+    self.matched  = matched  # Sections matched so far
+
+class TrackMatcher:
+  '''
+  Matches a map against the library as it is recieved, one section at a time.
+
+  The last section recieved may still grow (the next section could be the same
+  type and be merged into it) so it is only compared once a section of another
+  type arrives.
+
+  Once a track is recognised it is kept, even if the map later stops matching
+  (e.g. the map started part way through the track and wraps around).
+  '''
+  def __init__(self, library):
+    self.library    = library
+    self.sections   = [] # Normalised sections recieved, including the last (open) one
+    self.candidates = []
+    self.match      = None
+
+  def add_section(self, section):
+    '''
+    Add the next section of the map. Returns the recognised track or None.
+    '''
+    kind, size = int(section[0]), float(section[1])
+    if size >= MIN_SECTION_SIZE:
+      if len(self.sections) > 0 and self.sections[-1][0] == kind:
+        self.sections[-1][1] += size
+      else:
+        if len(self.sections) > 0:
+          self.__close_section(len(self.sections) - 1)
+        self.sections.append([ kind, size ])
+    return self.recognised()
+
+  def __close_section(self, index):
+    '''
+    Match a section that can no longer change
+    '''
+    kind, size = self.sections[index]
+
+    # Continue the existing candidates
+    alive = []
+    for candidate in self.candidates:
+      track    = self.library.get(candidate.hash).sections
+      expected = track[candidate.position % len(track)]
+      if expected[0] == kind and sizes_match(expected[1], size):
+        candidate.position += 1
+        candidate.matched  += 1
+        alive.append(candidate)
+    self.candidates = alive
+
+    # Start new candidates from the most recent run of section types.
+    # Sizes are checked for the whole run, except the first section of
+    # the map which may have been cut short.
+    first = index + 1 - INDEX_LENGTH # Index of the first section in the run
+    if len(self.candidates) == 0 and first >= 0:
+      run = self.sections[first:index + 1]
+      for hash, position in self.library.lookup([ s[0] for s in run ]):
+        track = self.library.get(hash).sections
+        sizes = [ sizes_match(track[(position + i) % len(track)][1], s[1]) for i, s in enumerate(run) ]
+        if all(sizes[1:]) and (sizes[0] or first == 0):
+          self.candidates.append(Candidate(hash, position + INDEX_LENGTH, INDEX_LENGTH))
+
+  def finish(self):
+    '''
+    Match the last section, once the whole map has been recieved
+    '''
+    if len(self.sections) > 0:
+      self.__close_section(len(self.sections) - 1)
+    if self.match == None:
+      self.match = self.library.find_short(self.sections)
+    return self.recognised()
+
+  def recognised(self):
+    '''
+    Get the recognised track. A track is recognised when all the candidates are on it.
+    '''
+    hashes = set([ candidate.hash for candidate in self.candidates ])
+    if len(hashes) == 1:
+      self.match = self.library.get(hashes.pop())
+    return self.match
@@ -0,0 +1,207 @@
+import collections
+import time
+
+import snapshot
+
+SOURCE_DEVICE  = 'device'  # Value was read from, or acknowledged by, the device
+SOURCE_PENDING = 'pending' # Value was changed locally and has not been acknowledged
+
+class VariableState:
+  '''
+  Queries shared by CachedVariable and its published VariableView
+  '''
+  def has_value(self):
+    return self.value is not None
+
+  def is_pending(self):
+    return self.source == SOURCE_PENDING
+
+  def age(self, now=None):
+    '''
+    Get the number of seconds since the value was confirmed by the device.
+    Returns None if the value has never been fetched.
+    '''
+    if self.fetched_at is None:
+      return None
+    return (time.time() if now is None else now) - self.fetched_at
+
+  def is_stale(self, ttl, now=None):
+    '''
+    Check if the value should be fetched from the device again.
+    Values with a pending local change are never stale.
+    '''
+    if self.is_pending():
+      return False
+    age = self.age(now)
+    return age is None or age > ttl
+
+VIEW_FIELDS = [ 'name', 'type', 'id', 'value', 'fetched_at', 'version', 'ack_seq', 'source' ]
+
+class VariableView(collections.namedtuple('VariableView', VIEW_FIELDS), VariableState):
+  '''
+  An immutable copy of a CachedVariable, published in a snapshot.VariableSnapshot
+  '''
+  __slots__ = ()
+
+class CachedVariable(VariableState):
+  def __init__(self, name, var_type):
+    self.name       = name
+    self.type       = var_type
+    self.id         = None           # Index of the variable on the device (see VariableCache.update_list)
+    self.value      = None
+    self.device_value = None         # The last value read from or acknowledged by the device
+    self.fetched_at = None           # Time the value was last confirmed by the device
+    self.version    = 0              # Incremented each time the local value changes
+    self.ack_seq    = 0              # The latest version acknowledged by the device
+    self.source     = SOURCE_DEVICE
+
+  def view(self):
+    return VariableView(*[ getattr(self, field) for field in VIEW_FIELDS ])
+
+class VariableCache:
+  def __init__(self, ttl=30.0):
+    self.entries = {}
+    self.ids     = [] # Name of the variable with each index on the device
+    self.ttl     = ttl # Seconds until a fetched value is considered stale
+    self.snapshot = snapshot.EMPTY_VARIABLES # Published copy of the entries, replaced on every change
+
+  def __contains__(self, name):
+    return name in self.entries
+
+  def names(self):
+    return self.entries.keys()
+
+  def get(self, name):
+    return self.entries[name]
+
+  def value(self, name):
+    return self.entries[name].value
+
+  def __publish(self, name=None):
+    '''
+    Publish a new snapshot after an entry changed, or after the
+    list of variables changed if 'name' is None
+    '''
+    current  = self.snapshot
+    position = current.index.get(name) if name is not None else None
+    if position is None:
+      entries = tuple([ entry.view() for entry in self.entries.values() ])
+      index   = { entry.name: i for i, entry in enumerate(entries) }
+    else: # Only the changed entry is copied, the index is shared
+      entries = current.entries[:position] + (self.entries[name].view(),) + current.entries[position + 1:]
+      index   = current.index
+    self.snapshot = snapshot.VariableSnapshot(current.version + 1, entries, index)
+
+  def name_of(self, index):
+    '''
+    Get the name of the variable with an index on the device, or None
+    '''
+    return self.ids[index] if 0 <= index < len(self.ids) else None
+
+  def clear_ids(self):
+    '''
+    Forget the device indices, e.g. when connecting to another device
+    '''
+    self.ids = []
+    for entry in self.entries.values():
+      entry.id = None
+    self.__publish()
+
+  def update_list(self, var_defs):
+    '''
+    Update the cache from the variable list reported by the device.
+    Entries with a matching type are kept, everything else is dropped.
+    The position of each variable in the list is its index on the device.
+
+    Returns the names of variables that were added.
+    '''
+    prev_entries = self.entries
+    self.entries = {}
+    self.ids     = []
+    added = []
+    for index, (name, var_type) in enumerate(var_defs):
+      entry    = prev_entries.get(name)
+      if entry is None or entry.type is not var_type:
+        entry = CachedVariable(name, var_type)
+        added.append(name)
+      entry.id = index
+      self.entries[name] = entry
+      self.ids.append(name)
+    self.__publish()
+    return added
+
+  def set_device_value(self, name, value, now=None):
+    '''
+    Store a value read from the device.
+    A pending local change takes priority over the device value.
+    '''
+    entry = self.entries.get(name)
+    if entry is None:
+      entry = CachedVariable(name, type(value))
+      self.entries[name] = entry
+
+    if entry.is_pending():
+      return False
+
+    if entry.value != value:
+      entry.version += 1
+    entry.value        = value
+    entry.device_value = value
+    entry.ack_seq    = entry.version
+    entry.fetched_at = time.time() if now is None else now
+    self.__publish(name)
+    return True
+
+  def set_local(self, name, value):
+    '''
+    Change a value locally. The value is marked as pending until acknowledged.
+
+    Returns the version that must be acknowledged.
+    '''
+    entry = self.entries[name]
+    entry.value   = value
+    entry.version += 1
+    entry.source  = SOURCE_PENDING
+    self.__publish(name)
+    return entry.version
+
+  def acknowledge(self, name, version, now=None):
+    '''
+    Signal the device has applied the local value with the given version.
+    '''
+    entry = self.entries.get(name)
+    if entry is None:
+      return
+    entry.ack_seq = max(entry.ack_seq, version)
+    if entry.ack_seq >= entry.version:
+      entry.source       = SOURCE_DEVICE
+      entry.device_value = entry.value
+      entry.fetched_at   = time.time() if now is None else now
+    self.__publish(name)
+
+  def reject(self, name, version):
+    '''
+    Signal the device did not apply the local value with the given version
+    (it responded with an error, or not at all). Unless a newer local value
+    is pending, the last device value is restored and marked stale so it is
+    fetched again.
+
+    Returns True if the value was rolled back.
+    '''
+    entry = self.entries.get(name)
+    if entry is None or not entry.is_pending() or entry.version != version:
+      return False
+    entry.value      = entry.device_value
+    entry.version   += 1
+    entry.ack_seq    = entry.version
+    entry.source     = SOURCE_DEVICE
+    entry.fetched_at = None # Stale
+    self.__publish(name)
+    return True
+
+  def stale(self, now=None):
+    '''
+    Get the names of variables that need to be fetched from the device.
+    Variables with a type the host does not support are never fetched.
+    '''
+    return [ name for name, entry in self.entries.items() if entry.type is not None and entry.is_stale(self.ttl, now) ]
@@ -0,0 +1,169 @@
+'''
+History of variables pushed by the device with 'watch'.
+
+Samples are stored in preallocated ring buffers. Each series also keeps
+min/max summaries at several levels of detail (each level covers twice as
+many samples per entry as the one below), so a plot of any length of
+history only reads a fixed number of entries.
+'''
+import numpy
+
+DEFAULT_CAPACITY = 1 << 16 # Samples kept per variable
+DEFAULT_PERIOD   = 20      # Milliseconds between pushes
+
+class RingBuffer:
+  '''
+  A fixed size buffer of floats. The oldest values are overwritten when full.
+  '''
+  def __init__(self, capacity, dtype = numpy.float32):
+    self.data  = numpy.zeros(capacity, dtype = dtype)
+    self.start = 0 # Index of the oldest value
+    self.count = 0
+
+  def __len__(self):
+    return self.count
+
+  def capacity(self):
+    return len(self.data)
+
+  def append(self, value):
+    end = (self.start + self.count) % len(self.data)
+    self.data[end] = value
+    if self.count < len(self.data):
+      self.count += 1
+    else:
+      self.start = (self.start + 1) % len(self.data)
+
+  def last(self, count):
+    '''
+    Get the newest 'count' values, oldest first
+    '''
+    count = min(count, self.count)
+    end   = (self.start + self.count) % len(self.data)
+    first = end - count
+    if first >= 0:
+      return self.data[first:end]
+    return numpy.concatenate([ self.data[first:], self.data[:end] ])
+
+  def clear(self):
+    self.start = 0
+    self.count = 0
+
+class WatchSeries:
+  def __init__(self, name, period = DEFAULT_PERIOD, capacity = DEFAULT_CAPACITY, min_entries = 256):
+    self.name     = name
+    self.period   = period # Requested milliseconds between samples
+    self.times    = RingBuffer(capacity, numpy.int64) # Device time of each sample
+    self.values   = RingBuffer(capacity)
+    self.total    = 0      # Number of samples ever recieved
+
+    # Level 0 is the raw values. Level k holds the min/max of 2^k samples.
+    self.mins    = [ self.values ]
+    self.maxs    = [ self.values ]
+    self.pending = [ None ] # Partial (min, max) for the next entry of each level
+    size = capacity // 2
+    while size >= min_entries:
+      self.mins.append(RingBuffer(size))
+      self.maxs.append(RingBuffer(size))
+      self.pending.append(None)
+      size //= 2
+
+  def __len__(self):
+    return len(self.values)
+
+  def append(self, time, value):
+    self.times.append(time)
+    self.values.append(value)
+    self.total += 1
+
+    # Combine pairs of entries into the next level up
+    low, high = value, value
+    for level in range(1, len(self.mins)):
+      pending = self.pending[level]
+      if pending == None:
+        self.pending[level] = (low, high)
+        break
+      low, high = min(low, pending[0]), max(high, pending[1])
+      self.pending[level] = None
+      self.mins[level].append(low)
+      self.maxs[level].append(high)
+
+  def latest(self):
+    return self.values.last(1)[0] if len(self.values) > 0 else None
+
+  def latest_time(self):
+    return int(self.times.last(1)[0]) if len(self.times) > 0 else None
+
+  def clear(self):
+    self.times.clear()
+    self.total = 0
+    for level in range(len(self.mins)):
+      self.mins[level].clear()
+      self.maxs[level].clear()
+      self.pending[level] = None
+
+  def decimate(self, samples, buckets):
+    '''
+    Get the min and max of the newest 'samples' values in 'buckets' groups.
+    Returns a float32 array of interleaved min/max values for plotting.
+
+    The level of detail is chosen so that at most 2 * buckets entries are
+    read, so the cost does not depend on 'samples'.
+    '''
+    samples = min(samples, len(self.values))
+    buckets = max(1, buckets)
+    if samples == 0:
+      return numpy.zeros(0, dtype = numpy.float32)
+
+    level = 0
+    while level + 1 < len(self.mins) and (samples >> level) > 2 * buckets:
+      level += 1
+
+    count = max(1, min(samples >> level, len(self.mins[level])))
+    lows  = self.mins[level].last(count)
+    highs = self.maxs[level].last(count)
+    if count <= buckets:
+      return numpy.stack([ lows, highs ], axis = 1).ravel().astype(numpy.float32)
+
+    # Reduce to the requested number of buckets (the first few entries are dropped)
+    per_bucket = count // buckets
+    used       = per_bucket * buckets
+    lows  = lows [count - used:].reshape(buckets, per_bucket).min(axis = 1)
+    highs = highs[count - used:].reshape(buckets, per_bucket).max(axis = 1)
+    return numpy.stack([ lows, highs ], axis = 1).ravel().astype(numpy.float32)
+
+class WatchList:
+  '''
+  The watched variables, fed by 'watch' packets from the device
+  '''
+  def __init__(self, capacity = DEFAULT_CAPACITY):
+    self.capacity = capacity
+    self.series   = {}
+
+  def __contains__(self, name):
+    return name in self.series
+
+  def names(self):
+    return self.series.keys()
+
+  def get(self, name):
+    return self.series[name]
+
+  def add(self, name, period = DEFAULT_PERIOD):
+    if name in self.series:
+      self.series[name].period = period
+    else:
+      self.series[name] = WatchSeries(name, period, self.capacity)
+    return self.series[name]
+
+  def remove(self, name):
+    if name in self.series:
+      del self.series[name]
+
+  def add_samples(self, time, values):
+    '''
+    Add the (name, value) samples recieved at the device time 'time'
+    '''
+    for name, value in values:
+      if name in self.series:
+        self.series[name].append(time, value)
@@ -0,0 +1,69 @@
+#include "CommandLink.h"
+#include "Util.h"
+
+CommandLink::CommandLink(Stream *pStream, Commands *pCommands, bool debugOutput)
+  : m_pStream(pStream)
+  , m_debugOutput(debugOutput)
+  , m_commands(pCommands, &m_recvBuffer, pStream)
+{}
+
+void CommandLink::update()
+{
+  while (m_pStream->available()) {
+    if (!m_recieving && m_debugOutput) {
+      DEBUG_PRINT("Recieving: ");
+    }
+
+    m_recieving = true; // Signal we are recieving a command
+    char c = m_pStream->read();
+    if (c == '\0')
+    {
+      if (m_recvBuffer.available() > 1) {
+        if (m_debugOutput)
+          DEBUG_PRINTLN("Executing command");
+        m_commands.execute();
+      }
+      m_recvBuffer.flush();
+      m_recieving = false; // Signal we have finished revieving the command
+      if (m_debugOutput) {
+        DEBUG_PRINTLN("");
+        DEBUG_PRINTLN("Recieve Done");
+      }
+    } // New line signals the end of a command 
+    else {
+      m_recvBuffer.write(c);
+      if (m_debugOutput)
+        DEBUG_WRITE(c);
+    }
+  }
+
+  // Push any watched variables that are due
+  m_commands.updateWatches(millis());
+
+  // Only send a response if we are not recieving and data
+  if (m_sendBuffer.available())
+  {
+    if (m_debugOutput)
+      DEBUG_PRINT("Sending: ");
+
+    // Send all the data available
+    while (m_sendBuffer.available()) {
+      if (m_debugOutput)
+        DEBUG_WRITE(m_sendBuffer.peek());
+      m_pStream->write(m_sendBuffer.read());
+    }
+    if (m_debugOutput)
+      DEBUG_PRINTLN("");
+    m_sendBuffer.flush(); // Free the memory
+    m_pStream->write('\0'); // Write 0 to indicate the end of a message
+  }
+}
+
+void CommandLink::writePacket(uint8_t const *pData, int size)
+{
+  // Not echoed to the debug output, binary data would corrupt it
+  m_pStream->write(pData, size);
+  m_pStream->write('\0');
+}
+
+size_t CommandLink::write(uint8_t data) { return m_sendBuffer.write(data); }
@@ -0,0 +1,50 @@
+#ifndef CommandLink_h__
+#define CommandLink_h__
+
+#include "SerialCommands.h"
+#include "StringStream.h"
+
+class Stream;
+
+// A command interface over a Stream.
+//
+// Incoming packets are terminated by a '\0' character and executed
+// using a SerialCommands interface. Data printed to the link is buffered
+// and sent as a single '\0' terminated packet on the next call to update().
+// Watched variables are also pushed from update().
+class CommandLink : public Print
+{
+public:
+  CommandLink(Stream *pStream, Commands *pCommands, bool debugOutput);
+
+  void update();
+
+  // Send a packet of binary data immediately.
+  // The data must not contain any '\0' bytes.
+  void writePacket(uint8_t const *pData, int size);
+
+  virtual size_t write(uint8_t data);
+
+protected:
+  Stream *m_pStream = nullptr;
+
+  // Buffer of data to send 
+  StringStream m_sendBuffer;
+
+  // Buffer of data to recieve
+  StringStream m_recvBuffer;
+
+  // Communication states
+  bool m_commandReady = false;
+  bool m_recieving = false;
+
+  // Print communication details to Serial.
+  // Must be false if the link is using Serial. Nothing is printed
+  // unless PRINT_DEBUG_INFO is defined (see Util.h).
+  bool m_debugOutput = false;
+
+  // The command set available through the link
+  SerialCommands m_commands;
+};
+
+#endif // CommandLink_h__
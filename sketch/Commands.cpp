@@ -24,6 +24,14 @@ bool Commands::call(char const * name) const {
   return true;
 }
 
+bool Commands::call(int index) const {
+  if (index < 0 || index >= (int)m_numCommands)
+    return false;
+
+  m_pCommands[index].func();
+  return true;
+}
+
 bool Commands::hasCommand(char const * name) const {
   return getCommand(name) != 0;
 }
@@ -37,6 +45,15 @@ int Commands::getVariableType(char const * name) const {
   return pDef ? pDef->typeID : -1;
 }
 
+int Commands::getVariableType(int index) const {
+  return (index >= 0 && index < (int)m_numVars) ? m_pVars[index].typeID : -1;
+}
+
+int Commands::getVariableIndex(char const * name) const {
+  VarDef *pDef = getVariable(name);
+  return pDef ? (int)(pDef - m_pVars) : -1;
+}
+
 Commands::VarDef* Commands::getVariable(char const * name) const {
   for (uint32_t i = 0; i < m_numVars; ++i)
     if (strcmp(m_pVars[i].name, name) == 0)
@@ -81,3 +98,13 @@ char const * Commands::getCommandName(int index) const
 {
   return m_pCommands[index].name;  
 }
+
+void Commands::setTrackProfile(TrackMap *pProfile)
+{
+  m_pTrackProfile = pProfile;
+}
+
+TrackMap* Commands::getTrackProfile() const
+{
+  return m_pTrackProfile;
+}
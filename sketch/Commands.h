@@ -4,6 +4,8 @@
 #include <stdint.h>
 #include "Util.h"
 
+class TrackMap;
+
 /**
  * Commands class for calling functions and accessing variables using strings.
  */
@@ -51,6 +53,11 @@ public:
    */
   bool call(char const * name) const;
 
+  /**
+   * Call a registered command by index (its position in the command list).
+   */
+  bool call(int index) const;
+
   /**
    * Check if a command is registered.
    */
@@ -76,6 +83,12 @@ public:
    */
   char const * getVariableName(int index) const;
 
+  /**
+   * Get the index of a variable.
+   * Returns -1 if the variable does not exist.
+   */
+  int getVariableIndex(char const * name) const;
+
   /**
    * Get the type of a variable
    */
@@ -107,6 +120,21 @@ public:
     return true;
   }
 
+  /**
+   * Set a variable by index. The type must be the same as the
+   * registered variable type.
+   *
+   * Returns true if the internal variable was set.
+   * Returns false otherwise.
+   */
+  template<typename T>
+  bool set(int index, T const & var) const {
+    if (index < 0 || index >= (int)m_numVars || m_pVars[index].typeID != TypeID<T>())
+      return false;
+    *(T*)m_pVars[index].pVar = var;
+    return true;
+  }
+
   /**
    * Get a variable. The type must be the same as the registered
    * variable type.
@@ -123,6 +151,27 @@ public:
     return true;
   }
 
+  /**
+   * Get a variable by index. The type must be the same as the
+   * registered variable type.
+   *
+   * Returns true if the variable was copied into pVar.
+   * Returns false otherwise.
+   */
+  template<typename T>
+  bool get(int index, T * pVar) const {
+    if (index < 0 || index >= (int)m_numVars || m_pVars[index].typeID != TypeID<T>())
+      return false;
+    *pVar = *(T*)m_pVars[index].pVar;
+    return true;
+  }
+
+  /**
+   * Get the type of a variable by index.
+   * Returns -1 if the index is out of range.
+   */
+  int getVariableType(int index) const;
+
   /**
    * Get the type of a registered variable.
    *
@@ -131,6 +180,17 @@ public:
    */
   int getVariableType(char const * name) const;
 
+  /**
+   * Set the track map that uploaded maps are written to ('map' packets).
+   * Uploads are rejected if no map is set.
+   */
+  void setTrackProfile(TrackMap *pProfile);
+
+  /**
+   * Get the track map that uploaded maps are written to.
+   */
+  TrackMap* getTrackProfile() const;
+
 protected:
   VarDef* getVariable(char const * name) const;
   CmdDef* getCommand(char const * name) const;
@@ -140,6 +200,8 @@ protected:
 
   VarDef  *m_pVars   = nullptr;
   uint32_t m_numVars = 0;
+
+  TrackMap *m_pTrackProfile = nullptr;
 };
 
 #endif // Commands_h__
@@ -3,6 +3,7 @@
 #include "Arduino.h"
 #include "pins_arduino.h"
 #include "Interrupts.h"
+#include "Util.h"
 
 #define CLOCK_SPEED long(16000000)
 
@@ -77,16 +78,16 @@ public:
 
     if (requiredComparison == 0 || prescaler == 0)
     {
-      Serial.println("Invalid prescale or comp value");
+      DEBUG_PRINTLN("Invalid prescale or comp value");
       return false;
     }
 
-    Serial.print("Comp Reg: ");
-    Serial.print(requiredComparison);
-    Serial.print(" Prescaler: ");
-    Serial.print(prescaler);
-    Serial.print(" Prescaler Idx: ");
-    Serial.println(prescalerIndex);
+    DEBUG_PRINT("Comp Reg: ");
+    DEBUG_PRINT(requiredComparison);
+    DEBUG_PRINT(" Prescaler: ");
+    DEBUG_PRINT(prescaler);
+    DEBUG_PRINT(" Prescaler Idx: ");
+    DEBUG_PRINTLN(prescalerIndex);
 
     switch (m_width)
     {
@@ -130,3 +130,6 @@ int SensorArray::lineMissingTime() { return m_lineMissingMilli; }
 
 // Get the number of milliseconds the line has been detected continuosly.
 int SensorArray::lineDetectedTime() { return m_lineDetectedMilli; }
+
+// Get the calibrated value of a sensor
+int SensorArray::getSensorValue(int index) const { return m_sensors[index].getValue(); }
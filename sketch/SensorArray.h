@@ -75,6 +75,9 @@ public:
   void update();
 
   void resetCalibration();
+
+  // Get the calibrated value of a sensor
+  int getSensorValue(int index) const;
   
 protected:
   void updateSensorValues();
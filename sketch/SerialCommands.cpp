@@ -1,5 +1,6 @@
 #include "Commands.h"
 #include "SerialCommands.h"
+#include "TrackMap.h"
 
 char const * SerialCommands::callToken = "call";
 char const * SerialCommands::setToken  = "set";
@@ -7,6 +8,13 @@ char const * SerialCommands::getToken  = "get";
 char const * SerialCommands::typeToken = "type";
 char const * SerialCommands::lsCmdToken = "lscmd";
 char const * SerialCommands::lsVarToken = "lsvar";
+char const * SerialCommands::watchToken = "watch";
+char const * SerialCommands::unwatchToken = "unwatch";
+char const * SerialCommands::timeToken = "time";
+char const * SerialCommands::mapToken = "map";
+char const * SerialCommands::idCallToken = "c";
+char const * SerialCommands::idSetToken  = "s";
+char const * SerialCommands::idGetToken  = "g";
 
 SerialCommands::SerialCommands(Commands *pCommands, Stream *pIn, Stream *pOut)
   : m_pCommands(pCommands)
@@ -52,8 +60,19 @@ ResultType SerialCommands::execute()
     return RT_None;
   
   readToken(m_pIn);
-  Serial.println("Read Token");
-  if (m_lastToken.equalsIgnoreCase(callToken)) {    
+  DEBUG_PRINTLN("Read Token");
+
+  // Index addressed forms are checked first, they are sent the most
+  if (m_lastToken.equalsIgnoreCase(idGetToken)) {
+    return executeGetID();
+  }
+  else if (m_lastToken.equalsIgnoreCase(idSetToken)) {
+    return executeSetID();
+  }
+  else if (m_lastToken.equalsIgnoreCase(idCallToken)) {
+    return executeCallID();
+  }
+  else if (m_lastToken.equalsIgnoreCase(callToken)) {    
     return executeCall();
   }
   else if (m_lastToken.equalsIgnoreCase(setToken)) {
@@ -71,6 +90,18 @@ ResultType SerialCommands::execute()
   else if (m_lastToken.equalsIgnoreCase(lsVarToken)) {
     return respondListVar();
   }
+  else if (m_lastToken.equalsIgnoreCase(watchToken)) {
+    return executeWatch();
+  }
+  else if (m_lastToken.equalsIgnoreCase(unwatchToken)) {
+    return executeUnwatch();
+  }
+  else if (m_lastToken.equalsIgnoreCase(timeToken)) {
+    return respondTime();
+  }
+  else if (m_lastToken.equalsIgnoreCase(mapToken)) {
+    return executeMap();
+  }
   return respondFailure("Unknown Command Token");
 }
 
@@ -106,6 +137,52 @@ ResultType SerialCommands::executeSet()
   return success ? respondSet() : respondFailure("Unknown Variable");
 }
 
+ResultType SerialCommands::executeCallID()
+{
+  int index = (int)m_pIn->parseInt(SKIP_WHITESPACE);
+  if (m_pCommands->call(index)) {
+    return respondCall();
+  }
+  return respondFailure("Command Not Found");
+}
+
+ResultType SerialCommands::executeSetID()
+{
+  int index = (int)m_pIn->parseInt(SKIP_WHITESPACE);
+
+  bool success = false;
+  int id = m_pCommands->getVariableType(index);
+  if (id == TypeID<int>()) {
+    success = m_pCommands->set<int>(index, (int)m_pIn->parseInt(SKIP_WHITESPACE));
+  }
+  else if (id == TypeID<float>()) {
+    success = m_pCommands->set<float>(index, m_pIn->parseFloat(SKIP_WHITESPACE));
+  }
+  else if (id == TypeID<double>()) {
+    success = m_pCommands->set<double>(index, m_pIn->parseFloat(SKIP_WHITESPACE));
+  }
+  else if (id == TypeID<bool>()) {
+    success = m_pCommands->set<bool>(index, m_pIn->parseInt(SKIP_WHITESPACE) != 0);
+  }
+
+  return success ? respondSet() : respondFailure("Unknown Variable");
+}
+
+ResultType SerialCommands::executeGetID()
+{
+  int index = (int)m_pIn->parseInt(SKIP_WHITESPACE);
+  int id = m_pCommands->getVariableType(index);
+  if (id != TypeID<int>() && id != TypeID<float>() && id != TypeID<double>() && id != TypeID<bool>())
+    return respondFailure("Unknown Variable");
+
+  m_pOut->print("OK+G\n");
+  m_pOut->print(index);
+  m_pOut->print(" ");
+  printValue(index);
+  m_pOut->write('\0');
+  return RT_GetID;
+}
+
 ResultType SerialCommands::executeGet()
 {  
   readToken(m_pIn);
@@ -132,6 +209,166 @@ ResultType SerialCommands::executeType()
   return respondType();
 }
 
+ResultType SerialCommands::executeWatch()
+{
+  readToken(m_pIn);
+  int index = m_pCommands->getVariableIndex(m_lastToken.c_str());
+  if (index < 0)
+    return respondFailure("Unknown Variable");
+
+  long requested = m_pIn->parseInt(SKIP_WHITESPACE);
+  unsigned long period = requested < (long)MinWatchPeriod ? MinWatchPeriod : (unsigned long)requested;
+
+  // Update the period if the variable is already watched
+  for (int i = 0; i < m_watchCount; ++i) {
+    if (m_watches[i].varIndex == index) {
+      m_watches[i].period = period;
+      return respondWatch();
+    }
+  }
+
+  if (m_watchCount >= MaxWatches)
+    return respondFailure("Too Many Watches");
+
+  m_watches[m_watchCount].varIndex = index;
+  m_watches[m_watchCount].period   = period;
+  m_watches[m_watchCount].lastSent = 0;
+  ++m_watchCount;
+  return respondWatch();
+}
+
+ResultType SerialCommands::executeUnwatch()
+{
+  readToken(m_pIn);
+  if (m_lastToken.length() == 0) {
+    m_watchCount = 0; // Remove all watches
+    return respondUnwatch();
+  }
+
+  int index = m_pCommands->getVariableIndex(m_lastToken.c_str());
+  for (int i = 0; i < m_watchCount; ++i) {
+    if (m_watches[i].varIndex == index) {
+      m_watches[i] = m_watches[--m_watchCount];
+      return respondUnwatch();
+    }
+  }
+  return respondFailure("Not Watched");
+}
+
+ResultType SerialCommands::executeMap()
+{
+  TrackMap *pProfile = m_pCommands->getTrackProfile();
+  if (pProfile == nullptr)
+    return respondFailure("No Track Profile");
+
+  long count = m_pIn->parseInt(SKIP_WHITESPACE);
+  if (count < 0 || count > MAX_SECTIONS)
+    return respondFailure("Too Many Sections");
+
+  pProfile->clear();
+  for (long i = 0; i < count; ++i) {
+    long type   = m_pIn->parseInt(SKIP_WHITESPACE);
+    long length = m_pIn->parseInt(SKIP_WHITESPACE);
+    long speed  = m_pIn->parseInt(SKIP_WHITESPACE);
+    long brake  = m_pIn->parseInt(SKIP_WHITESPACE);
+
+    // A truncated packet reads as 0, which is never a valid length
+    if (type < TrackMap::ST_Straight || type > TrackMap::ST_RTurn || length <= 0
+      || speed < 0 || speed > 255 || brake < 0 || brake > length || brake > 0xFFFF) {
+      pProfile->clear();
+      return respondFailure("Bad Map");
+    }
+
+    pProfile->setSection(i, (TrackMap::SectionType)type, length, speed, brake);
+  }
+  return respondMap(count);
+}
+
+void SerialCommands::updateWatches(unsigned long time)
+{
+  bool started = false;
+  for (int i = 0; i < m_watchCount; ++i) {
+    Watch &watch = m_watches[i];
+    if (time - watch.lastSent < watch.period)
+      continue;
+
+    if (!started) {
+      m_pOut->print("watch ");
+      m_pOut->print(time);
+      started = true;
+    }
+
+    m_pOut->write('\n');
+    m_pOut->print(m_pCommands->getVariableName(watch.varIndex));
+    m_pOut->print(" ");
+    printValue(watch.varIndex);
+    watch.lastSent = time;
+  }
+
+  if (started)
+    m_pOut->write('\0');
+}
+
+bool SerialCommands::printValue(int index)
+{
+  int id = m_pCommands->getVariableType(index);
+  if (id == TypeID<int>()) {
+    int val;
+    m_pCommands->get<int>(index, &val);
+    m_pOut->print(val);
+  }
+  else if (id == TypeID<float>()) {
+    float val;
+    m_pCommands->get<float>(index, &val);
+    m_pOut->print(val, 4);
+  }
+  else if (id == TypeID<double>()) {
+    double val;
+    m_pCommands->get<double>(index, &val);
+    m_pOut->print(val, 4);
+  }
+  else if (id == TypeID<bool>()) {
+    bool val;
+    m_pCommands->get<bool>(index, &val);
+    m_pOut->print(val ? 1 : 0);
+  }
+  else {
+    m_pOut->print("nan");
+    return false;
+  }
+  return true;
+}
+
+ResultType SerialCommands::respondWatch()
+{
+  m_pOut->print("OK+WATCH");
+  m_pOut->write('\0');
+  return RT_Watch;
+}
+
+ResultType SerialCommands::respondUnwatch()
+{
+  m_pOut->print("OK+UNWATCH");
+  m_pOut->write('\0');
+  return RT_Unwatch;
+}
+
+ResultType SerialCommands::respondTime()
+{
+  m_pOut->print("OK+TIME\n");
+  m_pOut->print(millis());
+  m_pOut->write('\0');
+  return RT_Time;
+}
+
+ResultType SerialCommands::respondMap(int count)
+{
+  m_pOut->print("OK+MAP\n");
+  m_pOut->print(count);
+  m_pOut->write('\0');
+  return RT_Map;
+}
+
 ResultType SerialCommands::respondSet()
 {
   m_pOut->print("OK+SET");
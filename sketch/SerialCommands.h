@@ -29,6 +29,40 @@
  *
  * To list all commands:
  *   lscmd
+ *
+ * Variables and commands can also be addressed by their index in the
+ * lsvar/lscmd lists, which avoids sending and searching for names:
+ *   c index
+ *   s index value
+ *   g index
+ * 'c' and 's' respond the same as 'call' and 'set'. 'g' responds with
+ * the index and value only:
+ *   OK+G
+ *   index value
+ *
+ * To get the device time (millis()), used to synchronise clocks:
+ *   time
+ *
+ * To push the value of a variable every 'period' milliseconds:
+ *   watch myVar period
+ *
+ * To stop pushing a variable (or all variables if no name is given):
+ *   unwatch myVar
+ *
+ * To upload a track map with speed targets, in one packet:
+ *   map count
+ *   type length speed brake
+ *   ...
+ * 'speed' is the target motor speed for the section and 'brake' is the
+ * distance before the end of the section to start changing to the next
+ * section's speed. The response is the number of sections loaded:
+ *   OK+MAP
+ *   count
+ *
+ * Watched values are pushed by updateWatches() as a single packet:
+ *   watch time
+ *   myVar value
+ *   ...
  *   
  * Gets will add data to the SerialCommands read buffer.
  * This can be read from using the read() function.
@@ -43,6 +77,11 @@ enum ResultType {
   RT_Type,
   RT_ListCommands,
   RT_ListVariables,
+  RT_Watch,
+  RT_Unwatch,
+  RT_Time,
+  RT_Map,
+  RT_GetID,
   RT_Count,
 };
 
@@ -57,6 +96,19 @@ public:
   static char const * typeToken;
   static char const * lsCmdToken;
   static char const * lsVarToken;
+  static char const * watchToken;
+  static char const * unwatchToken;
+  static char const * timeToken;
+  static char const * mapToken;
+  static char const * idCallToken;
+  static char const * idSetToken;
+  static char const * idGetToken;
+
+  // Maximum number of variables that can be watched at once
+  static const int MaxWatches = 8;
+
+  // Minimum time between pushes of a watched variable in milliseconds
+  static const unsigned long MinWatchPeriod = 10;
 
   /**
    * Create a SerialCommands interface using a set of Commands.
@@ -69,6 +121,12 @@ public:
    */
   ResultType execute();
 
+  /**
+   * Push the values of watched variables that are due.
+   * All due values are written as one packet.
+   */
+  void updateWatches(unsigned long time);
+
 protected:
   void readToken(Stream *pStream);
   
@@ -76,12 +134,22 @@ protected:
   ResultType executeSet();
   ResultType executeGet();
   ResultType executeType();
+  ResultType executeWatch();
+  ResultType executeUnwatch();
+  ResultType executeMap();
+  ResultType executeCallID();
+  ResultType executeSetID();
+  ResultType executeGetID();
 
   ResultType respondSet();
   ResultType respondCall();
   ResultType respondType();
   ResultType respondListCmd();
   ResultType respondListVar();
+  ResultType respondWatch();
+  ResultType respondUnwatch();
+  ResultType respondTime();
+  ResultType respondMap(int count);
   ResultType respondFailure(char const *msg);
 
   template<typename T>
@@ -104,6 +172,19 @@ protected:
     return RT_Get;
   }
   
+  // Print the value of a variable. Floating point values are printed with 4 decimal places.
+  bool printValue(int index);
+
+  struct Watch
+  {
+    int varIndex = -1;           // Index of the variable in m_pCommands
+    unsigned long period   = 0;  // Milliseconds between pushes
+    unsigned long lastSent = 0;  // Time of the last push
+  };
+
+  Watch m_watches[MaxWatches];
+  int   m_watchCount = 0;
+
   String  m_lastToken; // Last token read from the Stream input. User internally
   
   Commands *m_pCommands = nullptr; // The set of commands available
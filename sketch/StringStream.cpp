@@ -3,7 +3,11 @@
 StringStream::StringStream(String s = "")
   : m_string(s)
   , m_position(0)
-{}
+{
+  // The whole packet is buffered before it is parsed. Without this parseInt and
+  // parseFloat wait for more data (1 second by default) at the end of the packet.
+  setTimeout(0);
+}
 
 int StringStream::available() {
   return m_string.length() - m_position;
@@ -17,6 +17,8 @@ void TrackMap::addSection(int avgMotorDiff, uint32_t length) {
   {
     m_sections[m_size].type = secType;
     m_sections[m_size].time = length;
+    m_sections[m_size].speed = 0;
+    m_sections[m_size].brake = 0;
     ++m_size;
   }
 }
@@ -26,13 +28,85 @@ uint32_t TrackMap::sectionLength(size_t index) {
 }
 
 TrackMap::SectionType TrackMap::sectionType(size_t index) {
-  return m_sections[index].type;
+  return (SectionType)m_sections[index].type;
 }
 
 size_t TrackMap::sectionCount() {
   return m_size;
 }
 
+bool TrackMap::setSection(size_t index, SectionType type, uint32_t length, uint8_t speed, uint16_t brake) {
+  if (index >= MAX_SECTIONS || index > m_size)
+    return false;
+
+  m_sections[index].type  = type;
+  m_sections[index].time  = length;
+  m_sections[index].speed = speed;
+  m_sections[index].brake = brake;
+  if (index == m_size)
+    ++m_size;
+  return true;
+}
+
+int TrackMap::targetSpeed(double distance, int defaultSpeed) {
+  double start = 0;
+  for (size_t i = 0; i < m_size; ++i) {
+    double end = start + m_sections[i].time;
+    if (distance < end) {
+      int speed = m_sections[i].speed;
+      if (speed == 0)
+        return defaultSpeed;
+
+      // Change to the next section's speed over the braking distance
+      double brakeStart = end - m_sections[i].brake;
+      if (i + 1 < m_size && m_sections[i + 1].speed != 0 && distance > brakeStart && m_sections[i].brake > 0) {
+        double t = (distance - brakeStart) / m_sections[i].brake;
+        return speed + (int)((m_sections[i + 1].speed - speed) * t);
+      }
+      return speed;
+    }
+    start = end;
+  }
+  return defaultSpeed;
+}
+
+void TrackMap::truncate(size_t count) {
+  if (count < m_size)
+    m_size = count;
+}
+
 void TrackMap::clear() {
   m_size = 0;
 }
+
+bool SentTrackMap::setSection(size_t index, TrackMap::SectionType type, uint32_t length) {
+  if (index >= MAX_SECTIONS || index > m_size)
+    return false;
+
+  m_sections[index].type   = type;
+  m_sections[index].length = length > 0xFFFF ? 0xFFFF : length;
+  if (index == m_size)
+    ++m_size;
+  return true;
+}
+
+uint32_t SentTrackMap::sectionLength(size_t index) {
+  return m_sections[index].length;
+}
+
+TrackMap::SectionType SentTrackMap::sectionType(size_t index) {
+  return (TrackMap::SectionType)m_sections[index].type;
+}
+
+size_t SentTrackMap::sectionCount() {
+  return m_size;
+}
+
+void SentTrackMap::truncate(size_t count) {
+  if (count < m_size)
+    m_size = count;
+}
+
+void SentTrackMap::clear() {
+  m_size = 0;
+}
@@ -17,8 +17,10 @@ public:
 
   struct Section
   {
-    SectionType type; // Type of section
+    uint8_t  type;  // Type of section (SectionType, stored in a byte)
     uint32_t time;  // Time taken to complete the section
+    uint8_t  speed; // Target motor speed for the section (0 if not set)
+    uint16_t brake; // Distance before the end of the section to start changing to the next section's speed
   };
 
   // Add a new section of track to the map.
@@ -35,6 +37,20 @@ public:
   // Get the number of sections
   size_t sectionCount();
 
+  // Set a section of an uploaded map, including its speed target.
+  // A section can be replaced, or added after the last section.
+  // Returns false if the index is out of range.
+  bool setSection(size_t index, SectionType type, uint32_t length, uint8_t speed, uint16_t brake);
+
+  // Get the target motor speed at a distance into the lap.
+  // The speed changes linearly to the next section's speed over
+  // the braking distance at the end of each section.
+  // Returns 'defaultSpeed' past the end of the map or if the section has no target.
+  int targetSpeed(double distance, int defaultSpeed);
+
+  // Remove the sections after the first 'count' sections
+  void truncate(size_t count);
+
   // Clear the track map
   void clear();
 
@@ -43,4 +59,42 @@ private:
   Section m_sections[MAX_SECTIONS];
 };
 
+// The track map as the host has it, used to tell which sections changed.
+// Only the type and length sent are kept, 3 bytes a section instead of
+// the 8 a TrackMap section takes. Lengths are sent as 16 bit ints, so
+// they are stored in 16 bits (saturated at 65535).
+class SentTrackMap
+{
+public:
+  // Record the section sent to the host at 'index'.
+  // A section can be replaced, or added after the last section.
+  // Returns false if the index is out of range.
+  bool setSection(size_t index, TrackMap::SectionType type, uint32_t length);
+
+  // Get the length of a section the host has
+  uint32_t sectionLength(size_t index);
+
+  // Get the type of a section the host has
+  TrackMap::SectionType sectionType(size_t index);
+
+  // Get the number of sections
+  size_t sectionCount();
+
+  // Remove the sections after the first 'count' sections
+  void truncate(size_t count);
+
+  // Clear the map
+  void clear();
+
+private:
+  struct Section
+  {
+    uint8_t  type;
+    uint16_t length;
+  };
+
+  uint8_t m_size = 0;
+  Section m_sections[MAX_SECTIONS];
+};
+
 #endif // TrackMap_h__
@@ -11,14 +11,25 @@ void * operator new (unsigned int, void * ptr);
 
 #define ArraySize(arr) (sizeof(arr) / sizeof(*arr))
 
+#define WIRED_LINK       // Comment this line to disable the command link on the USB serial port
 #define PRINT_DEBUG_INFO // Comment this line to disable debug Serial prints
 
+// Debug prints share the USB serial port with the wired link and would
+// corrupt its packets, so they are only compiled in when the link is off.
+#ifdef WIRED_LINK
+  #undef PRINT_DEBUG_INFO
+#endif
+
 #ifdef PRINT_DEBUG_INFO
+  #define DEBUG_ENABLED true
   #define DEBUG_PRINT(val) Serial.print(val)
   #define DEBUG_PRINTLN(val) Serial.println(val)
+  #define DEBUG_WRITE(val) Serial.write(val)
 #else
+  #define DEBUG_ENABLED false
   #define DEBUG_PRINT(val)
   #define DEBUG_PRINTLN(val)
+  #define DEBUG_WRITE(val)
 #endif
 
 extern char const * whitespace;
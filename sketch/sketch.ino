@@ -5,6 +5,7 @@
 #include "SoftwareSerial.h"
 #include "PIDController.h"
 #include "Bluetooth.h"
+#include "CommandLink.h"
 #include "List.h"
 #include "TrackMap.h"
 #include "Interrupts.h"
@@ -12,6 +13,7 @@
 SensorArray   sensorArray; // Sensor array object. Handles reading sensors and calculating line position
 PIDController pidController;
 TrackMap      trackMap;
+TrackMap      trackProfile; // Map and speed targets uploaded by the host
 
 const int motors_R     = 3;          // Right motor pin
 const int motors_L     = 11;         // Left motor pin
@@ -60,9 +62,42 @@ double speedUpThreshold = 0.35;  // The percentage motor difference to threshold
 int    speedDiffSamples = 10; // Number of samples to include in the average 
 int    straightLoops    = 0;
 
+// Speed profile uploaded by the host (see TrackMap::targetSpeed).
+// While following the profile, the motor speed is set from the distance
+// travelled into the lap instead of reacting to straights and corners.
+bool   followProfile    = false;
+double lapDistance      = 0;  // Distance travelled this lap, in the same units as section lengths
+unsigned long lastDriveTime = 0;
+
+// Track map sync (see sendTrackInfo).
+// sentMap is the map as the host has it. Sections that changed by less than
+// mapTolerance are not sent, and keep the length the host has in sentMap, so
+// small changes cannot add up without being sent. Only the type and
+// length of each section are kept (see SentTrackMap), to save RAM.
+SentTrackMap  sentMap;
+unsigned long mapVersion    = 0;     // Incremented for every map sent
+double        mapTolerance  = 0.1;   // Fraction a section length can change by before it is sent
+bool          trackResync   = false; // The host asked for the full map
+
 // Current control system correction value
 float correction = 0;
 
+// Last control system error (distance of the line from the centre)
+float pidError = 0;
+
+// Sensor array stream.
+// Samples are sent in batches as binary packets:
+//   [STREAM_MARKER] [sequence number of the first sample] [IR_SENSOR_COUNT bytes per sample]...
+// Every byte is in the range 1-255 as 0 terminates packets.
+#define STREAM_MARKER 0xFE
+#define STREAM_BATCH  8
+int streamLink   = 0;  // 0: off, 1: bluetooth, 2: wired
+int streamPeriod = 10; // Milliseconds between samples
+uint8_t streamBuffer[2 + STREAM_BATCH * IR_SENSOR_COUNT];
+int streamSamples = 0;
+uint8_t streamSeq = 1;
+unsigned long lastStreamSample = 0;
+
 // Current lap details
 bool lapStarted = false;
 unsigned long lapStartTime = 0;
@@ -81,7 +116,7 @@ Sensor rightTrackSensor;
 Sensor leftTrackSensor;
 
 void startCalibration() {
-  Serial.println("Start Calibration");
+  DEBUG_PRINTLN("Start Calibration");
   sensorArray.resetCalibration();
   leftTrackSensor.resetCalibration();
   rightTrackSensor.resetCalibration();
@@ -89,13 +124,16 @@ void startCalibration() {
 }
 
 void endCalibration() {
-  Serial.println("End Calibration");
+  DEBUG_PRINTLN("End Calibration");
   g_calibrateSensors = false;
 }
 
 void startDriving() { allowDrive = true; }
 void stopDriving()  { allowDrive = false; }
 
+// Send the full track map again. The map is sent from loop(), not while the command is executing.
+void requestTrackSync() { trackResync = true; }
+
 // Expose variables to the command interface
 Commands::VarDef cmdVars[] = {
   { "P",        kp },
@@ -112,7 +150,23 @@ Commands::VarDef cmdVars[] = {
   { "colDtcLps", colourDetectLoops},
   { "colMin", colourMin},
   { "colMax", colourMax },
-  { "ssDetct", ssDetectThreshold}
+  { "ssDetct", ssDetectThreshold},
+
+  // Live values, useful to watch while driving
+  { "err",    pidError },
+  { "crr",    correction },
+  { "motSpd", curMotorSpeed },
+  { "lapDst", lapDistance },
+
+  // Follow the speed profile uploaded with 'map'
+  { "prof",   followProfile },
+
+  // Track map sync
+  { "mapTol", mapTolerance },
+
+  // Sensor array stream settings
+  { "strm",    streamLink },
+  { "strmPer", streamPeriod }
 };
 
 // Expose functions to the command interface
@@ -120,7 +174,8 @@ Commands::CmdDef cmdList[] = {
   { "startCalib", startCalibration },
   { "endCalib",   endCalibration },
   { "drive",      startDriving },
-  { "stop",       stopDriving }
+  { "stop",       stopDriving },
+  { "syncTrack",  requestTrackSync }
 };
 
 // Create the command set
@@ -128,12 +183,19 @@ Commands cmdSet(cmdList, ArraySize(cmdList), cmdVars, ArraySize(cmdVars));
 
 Bluetooth bt(10, 9, &cmdSet);
 
+// Wired command interface over the USB serial port.
+// Debug prints are compiled out while it is enabled (see WIRED_LINK in Util.h).
+#define SERIAL_BAUD 115200
+#ifdef WIRED_LINK
+CommandLink wired(&Serial, &cmdSet, false);
+#endif
+
 void detectRightMarker();
 void detectLeftMarker();
 
 void setup() {
   // Enabling serial
-  Serial.begin(9600);
+  Serial.begin(SERIAL_BAUD);
 
   // Configuration for the IR sensor array
   SensorConfig sensorConf = {    
@@ -161,6 +223,8 @@ void setup() {
 
   pinMode(13, OUTPUT);
   
+  cmdSet.setTrackProfile(&trackProfile);
+
   pidController.setTarget(0.5);
   rightTrackSensor.setPin(23);
   leftTrackSensor.setPin(22);
@@ -200,7 +264,7 @@ int motorSpeed_R = 0; // Speed of the right motor
 
 void onStartDriving()
 {
-  Serial.println("Start Driving");
+  DEBUG_PRINTLN("Start Driving");
 
   // Reset the stop time.
   stopTime = 0;
@@ -214,6 +278,7 @@ void onStartDriving()
 
   // Set the motor speed to the corner speed
   curMotorSpeed = cornerSpeed;
+  lastDriveTime = 0;
 
   markerWasDetected = false;
   markerIsDetected  = false;
@@ -226,23 +291,132 @@ void onStopDriving() {
   detachInterrupts();
 }
 
-void sendTrackInfo()
+// Track map packets.
+// The first map, and the map the host asks for with 'syncTrack', is sent in full:
+//   newtrack version
+//   sec type length      (one packet per section)
+// After that only the sections that changed since the map the host has are sent, in one packet:
+//   mapd version count
+//   index type length
+//   ...
+// 'count' is the number of sections in the map, the host drops any sections past it.
+// Each map sent after a lap has the next version, so the host can tell it missed a delta.
+// The lap time follows the map:
+//   lap milliseconds
+
+// Check if a section of the track map is different to the map the host has
+bool sectionChanged(size_t index)
+{
+  if (index >= sentMap.sectionCount() || trackMap.sectionType(index) != sentMap.sectionType(index))
+    return true;
+
+  double sent = sentMap.sectionLength(index);
+  return fabs(trackMap.sectionLength(index) - sent) > sent * mapTolerance;
+}
+
+// Send the map the host has (sentMap) in full
+void sendFullTrack(CommandLink &link)
+{
+  link.print("newtrack ");
+  link.print(mapVersion);
+  link.update(); // Send data
+  for (size_t i = 0; i < sentMap.sectionCount(); ++i) {
+    link.print("sec ");
+    link.print((int)sentMap.sectionType(i));
+    link.print(" ");
+    link.print((int)sentMap.sectionLength(i));
+    link.update(); // Send data
+  }
+}
+
+void sendTrackDelta(CommandLink &link)
+{
+  link.print("mapd ");
+  link.print(mapVersion);
+  link.print(" ");
+  link.print((int)trackMap.sectionCount());
+  for (size_t i = 0; i < trackMap.sectionCount(); ++i) {
+    if (!sectionChanged(i))
+      continue;
+    link.print("\n");
+    link.print((int)i);
+    link.print(" ");
+    link.print((int)trackMap.sectionType(i));
+    link.print(" ");
+    link.print((int)trackMap.sectionLength(i));
+  }
+  link.update(); // Send data
+}
+
+void sendTrackInfo(CommandLink &link, bool full)
 {
-  Serial.println("Send Track");
+  if (full) sendFullTrack(link);
+  else      sendTrackDelta(link);
 
-  bt.print("newtrack");
-  bt.update(); // Send data
+  link.print("lap ");
+  link.print((lapFinishTime - lapStartTime));
+  link.update(); // Send data
+}
+
+// Copy the sections sent to the host into sentMap
+void updateSentMap(bool full)
+{
   for (size_t i = 0; i < trackMap.sectionCount(); ++i) {
-    bt.print("sec ");
-    bt.print((int)trackMap.sectionType(i));
-    bt.print(" ");
-    bt.print((int)trackMap.sectionLength(i));
-    bt.update(); // Send data
+    if (full || sectionChanged(i))
+      sentMap.setSection(i, trackMap.sectionType(i), trackMap.sectionLength(i));
   }
+  sentMap.truncate(trackMap.sectionCount());
+}
 
-  bt.print("lap ");
-  bt.print((lapFinishTime - lapStartTime));
-  bt.update(); // Send data
+// Scale a sensor value to a byte that is never 0
+uint8_t streamByte(int value) {
+  return (uint8_t)constrain(value / 4, 1, 255);
+}
+
+void updateSensorStream()
+{
+  if (streamLink == 0) {
+    streamSamples = 0;
+    return;
+  }
+
+  unsigned long now = millis();
+  if (now - lastStreamSample < (unsigned long)streamPeriod)
+    return;
+  lastStreamSample = now;
+
+  if (streamSamples == 0) {
+    streamBuffer[0] = STREAM_MARKER;
+    streamBuffer[1] = streamSeq;
+  }
+
+  uint8_t *pSample = streamBuffer + 2 + streamSamples * IR_SENSOR_COUNT;
+  for (int i = 0; i < IR_SENSOR_COUNT; ++i)
+    pSample[i] = streamByte(sensorArray.getSensorValue(i));
+
+  streamSeq = streamSeq == 255 ? 1 : streamSeq + 1;
+  if (++streamSamples == STREAM_BATCH) {
+    if (streamLink == 1) bt.writePacket(streamBuffer, sizeof(streamBuffer));
+#ifdef WIRED_LINK
+    else                 wired.writePacket(streamBuffer, sizeof(streamBuffer));
+#endif
+    streamSamples = 0;
+  }
+}
+
+void sendTrackInfo()
+{
+  DEBUG_PRINTLN("Send Track");
+  bool full = sentMap.sectionCount() == 0;
+  ++mapVersion;
+  if (full)
+    updateSentMap(true); // The full map is sent from sentMap
+  sendTrackInfo(bt, full);
+#ifdef WIRED_LINK
+  sendTrackInfo(wired, full);
+#endif
+  if (!full)
+    updateSentMap(false); // Deltas are worked out against the previous map
 }
 
 void reset() {
@@ -252,9 +426,10 @@ void reset() {
 
 void onLapStart()
 {
-  Serial.println("Start Lap");
+  DEBUG_PRINTLN("Start Lap");
   lapStartTime = millis();
   lapStarted  = true;
+  lapDistance = 0;
   trackMap.clear();
 }
 
@@ -265,11 +440,11 @@ void onLapEnd()
   debugPrint("End Lap: ", lapFinishTime + stopDelay);
   lapStarted = false;
   addSectionInfo();
-  Serial.println();
+  DEBUG_PRINTLN("");
 }
 
 void onEnterSlowZone() {
-  Serial.println("Start Slow Zone");
+  DEBUG_PRINTLN("Start Slow Zone");
   inStraight    = true;
   allowAccell   = false;
   curMotorSpeed = slowSpeed;
@@ -291,14 +466,14 @@ void addSectionInfo() {
 }
 
 void onExitSlowZone() {
-  Serial.println("Exit Slow Zone");
+  DEBUG_PRINTLN("Exit Slow Zone");
   inStraight    = true;
   allowAccell   = true;
   curMotorSpeed = cornerSpeed;
 }
 
 void onEnterCorner() {
-  Serial.println("Enter Corner");
+  DEBUG_PRINTLN("Enter Corner");
   inStraight    = false;
   allowAccell   = true;
   inSlowZone    = false;
@@ -307,7 +482,7 @@ void onEnterCorner() {
 }
 
 void onLapBreak() {  
-  Serial.println("Lap finished");
+  DEBUG_PRINTLN("Lap finished");
   // Stop motors
   applyMotorSpeed(0, 0);
   driving = false;
@@ -376,6 +551,16 @@ void drive() {
    // Get the line position calculated by the sensor array
   static double linePos = 0.5;
 
+  // Distance travelled since the last update, at the last motor speeds
+  unsigned long now = millis();
+  if (lastDriveTime != 0)
+    lapDistance += (motorSpeed_L + motorSpeed_R) / 2.0 * (now - lastDriveTime) / 1000;
+  lastDriveTime = now;
+
+  bool following = followProfile && lapStarted && !inSlowZone && trackProfile.sectionCount() > 0;
+  if (following)
+    curMotorSpeed = trackProfile.targetSpeed(lapDistance, curMotorSpeed);
+
   if (sensorArray.lineDetected() && !sensorArray.horizontalLineDetected())
     linePos = sensorArray.getLinePos();
   else
@@ -383,6 +568,7 @@ void drive() {
 
   // Update the PID controller if a line is detected
   correction = pidController.addSample(linePos, millis()) * curMotorSpeed * PIDScaleFactor;
+  pidError   = pidController.getError();
 
   if (correction > 0){
     motorSpeed_R = curMotorSpeed - correction;
@@ -418,7 +604,7 @@ void drive() {
     inStraight = false;
   }
 
-  if (inStraight && allowAccell) {
+  if (inStraight && allowAccell && !following) {
     curMotorSpeed = min(acceleration + curMotorSpeed, straightSpeed);
   }
 
@@ -434,6 +620,20 @@ void loop() {
   // reads/writes data from the module and processes commands
   bt.update();
 
+#ifdef WIRED_LINK
+  // Update the wired connection
+  wired.update();
+#endif
+
+  // Resend the map the host should have, if it asked for it
+  if (trackResync) {
+    trackResync = false;
+    sendFullTrack(bt);
+#ifdef WIRED_LINK
+    sendFullTrack(wired);
+#endif
+  }
+
   // Am having a weird issue where the left motor direction reverts to backwards even though I've set it to forwards
   // Setting to forwards every loop seems to fix it for now though
   pinMode(17, OUTPUT);
@@ -443,6 +643,7 @@ void loop() {
   sensorArray.update();
   leftTrackSensor.read();
   rightTrackSensor.read();
+  updateSensorStream();
 
   if (g_calibrateSensors)
   {
@@ -519,7 +720,7 @@ void loop() {
       canDetectMarker   = false;
     }
 
-    Serial.println();
+    DEBUG_PRINTLN("");
     canDetectMarker |= millis() - markerMissingTime > 250;
 
     // Keep driving while the line has not been missing for more than 0.1 seconds